@@ -1,24 +1,74 @@
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from shapely import Point
+import pyarrow as pa
+import pyarrow.dataset as ds
+from shapely import STRtree
+
+ACCIDENT_COLUMNS = ["jahr", "x_linref", "y_linref", "x_wgs84", "y_wgs84"]
+
+# municipality keys have leading zeros and must not be read as numbers
+PARTITIONING = ds.partitioning(pa.schema([("jahr", pa.int16()),
+                                          ("ags", pa.string())]),
+                               flavor = "hive")
 
 
 def fetch_accidents(
-        path: str) -> gpd.GeoDataFrame():
+        path: str,
+        bbox: tuple = None,
+        years: list = None,
+        municipalities: list = None) -> gpd.GeoDataFrame():
     """
     Fetches traffic accident data from the provided file.
-    """
 
-    # read accidents from file
-    accidents = pd.read_hdf(path)
+    Parameters
+    ----------
+    path : str
+        Path of a partitioned parquet store as written by
+        write_accident_store or of a legacy h5-file.
+    bbox : tuple, optional
+        Bounding box (minx, miny, maxx, maxy) in EPSG:25832 to which the
+        accidents are restricted.
+    years : list, optional
+        Years of accidents to load. All years are loaded if none are given.
+    municipalities : list, optional
+        Official municipality keys (AGS) of the accidents to load.
+
+    Returns
+    -------
+    accidents : gpd.GeoDataFrame
+        Accidents with point geometries in EPSG:25832.
+
+    """
+    if path.endswith(".h5"):
+        accidents = pd.read_hdf(path)
+        accidents = accidents[ACCIDENT_COLUMNS]
+        if years:
+            accidents = accidents[accidents.jahr.isin(years)]
+        if bbox:
+            minx, miny, maxx, maxy = bbox
+            accidents = accidents[accidents.x_linref.between(minx, maxx) &
+                                  accidents.y_linref.between(miny, maxy)]
+    else:
+        # filters are applied to partitions and row groups while reading
+        filters = []
+        if years:
+            filters.append(("jahr", "in", list(years)))
+        if municipalities:
+            filters.append(("ags", "in", list(municipalities)))
+        if bbox:
+            minx, miny, maxx, maxy = bbox
+            filters += [("x_linref", ">=", minx), ("x_linref", "<=", maxx),
+                        ("y_linref", ">=", miny), ("y_linref", "<=", maxy)]
+        accidents = pd.read_parquet(path,
+                                    columns = ACCIDENT_COLUMNS,
+                                    filters = filters or None,
+                                    partitioning = PARTITIONING)
 
-    # reduce accident geometry to points
-    accidents["geometry"] = accidents.apply(lambda x: Point(x["x_linref"],
-                                                            x["y_linref"]),
-                                            axis="columns")
-    # convert to geodataframe
+    # create all point geometries at once
+    geometry = gpd.points_from_xy(accidents["x_linref"], accidents["y_linref"])
     accidents = gpd.GeoDataFrame(accidents,
-                                 geometry="geometry",
+                                 geometry=geometry,
                                  crs="epsg:25832")
     accidents = accidents[["x_linref", "y_linref",
                            "x_wgs84", "y_wgs84", "geometry"]]
@@ -26,12 +76,73 @@ def fetch_accidents(
     return accidents
 
 
+def write_accident_store(accidents_df: pd.DataFrame, path: str):
+    """
+    Writes accident data as parquet store partitioned by year and
+    municipality. Existing partitions for the same year and municipality are
+    replaced.
+
+    Parameters
+    ----------
+    accidents_df : pd.DataFrame
+        Accidents including the columns "jahr" and "ags" (official
+        municipality key).
+    path : str
+        Directory of the store.
+
+    Returns
+    -------
+    None.
+
+    """
+    # sorting by location keeps row groups spatially compact for filtering
+    accidents_df = accidents_df.sort_values(["ags", "jahr", "x_linref",
+                                             "y_linref"])
+    accidents_df.to_parquet(path,
+                            partition_cols = ["jahr", "ags"],
+                            existing_data_behavior = "delete_matching",
+                            row_group_size = 10000)
+
+
+def convert_hdf_store(hdf_path: str, store_path: str, ags: str):
+    """
+    Converts a legacy h5-file with accidents of a single municipality into
+    a partitioned parquet store.
+
+    Parameters
+    ----------
+    hdf_path : str
+        Path of the h5-file.
+    store_path : str
+        Directory of the store.
+    ags : str
+        Official municipality key of the accidents, e.g. "05334002" for Aachen.
+
+    Returns
+    -------
+    None.
+
+    """
+    accidents_df = pd.read_hdf(hdf_path)
+    accidents_df["ags"] = ags
+    write_accident_store(accidents_df, store_path)
+
+
 def match_accidents_network(edges: pd.DataFrame, accidents: pd.DataFrame):
+    """
+    Counts the accidents within 5 m of each edge and scores the edges
+    accordingly.
+    """
     edges.insert(10, "accident_count", 0)
     edges.insert(11, "score_accident", 0)
     edges_geometry = gpd.GeoSeries(edges.geometry).buffer(5, resolution = 16)
-    for accident in accidents.geometry:
-        edges.loc[edges_geometry.contains(accident), "accident_count"] = edges.loc[edges_geometry.contains(accident), "accident_count"]+1
+
+    # find all pairs of accidents and buffered edges containing them at once
+    tree = STRtree(edges_geometry.to_numpy())
+    _, edge_positions = tree.query(accidents.geometry.to_numpy(),
+                                   predicate = "within")
+    edges["accident_count"] = np.bincount(edge_positions,
+                                          minlength = len(edges))
     
     edges.loc[edges.accident_count <= 1, "score_accident"] = 5
     edges.loc[edges.accident_count  > 1, "score_accident"] = 4
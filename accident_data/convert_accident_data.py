@@ -1,117 +1,177 @@
 import logging
 import os
+import re
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 
+from accident_data.accidents_util import write_accident_store
+
 log = logging.getLogger('Unfaelle')
 
-# IDs relating to Aachen
-LAND_ID = 5
-REGBEZ_ID = 3
-KREIS_ID = 34
-GEMEINDE_ID = 2
+# Folder containing the yearly zip or CSV exports of the Unfallatlas
+# (https://www.opengeodata.nrw.de/produkte/transport_verkehr/unfallatlas)
+DIRECTORY_CSV = "accident_data/unfallatlas"
 
-# Folder containing the CSV exports
-DIRECTORY_CSV = "https://www.opengeodata.nrw.de/produkte/transport_verkehr/unfallatlas"
+# Stores the accidents are written to, one for each type of road user
+STORE_PATHS = {"rad": "accident_data/accidents_bike",
+               "fuss": "accident_data/accidents_foot"}
 
 START_YEAR = 2016
 END_YEAR = 2022
 
-ID_LIST = []
+# Number of rows read from a CSV file at once
+CHUNK_SIZE = 200000
+
+# Official municipality keys (AGS) or prefixes of them to convert, e.g.
+# "05334002" for Aachen or "05" for North Rhine-Westphalia. Leave empty to
+# convert all municipalities.
+REGIONS = []
+
+COLUMNS = ["ULAND", "UREGBEZ", "UKREIS", "UGEMEINDE", "UJAHR",
+           "IstRad", "IstFuss", "LINREFX", "LINREFY",
+           "XGCSWGS84", "YGCSWGS84"]
+USECOLS = {column.upper() for column in COLUMNS + ["OBJECTID"]}
+
+
+def find_year_files(directory: str) -> dict:
+    """
+    Finds the zip or CSV export for each year between START_YEAR and END_YEAR
+    in the given directory.
+
+    Returns
+    -------
+    year_files : dict
+        Paths of the exports by year.
+
+    """
+    year_files = {}
+    for filename in sorted(os.listdir(directory)):
+        match = re.search(r"(\d{4})", filename)
+        if not match or not filename.lower().endswith((".zip", ".csv", ".txt")):
+            continue
+        year = int(match.group(1))
+        if START_YEAR <= year <= END_YEAR:
+            year_files[year] = f"{directory}/{filename}"
+    return year_files
+
+
+def open_export(path: str):
+    """
+    Opens the CSV file of an export, reading it directly from the zip archive
+    if necessary.
+    """
+    if not path.lower().endswith(".zip"):
+        return open(path, "rb")
+    archive = zipfile.ZipFile(path)
+    members = [name for name in archive.namelist()
+               if name.lower().endswith((".csv", ".txt"))]
+    # exports may contain several files, the one with linear references is used
+    members.sort(key=lambda name: "linref" not in name.lower())
+    return archive.open(members[0])
+
+
+def municipality_keys(chunk: pd.DataFrame) -> pd.Series:
+    """
+    Builds the eight digit official municipality key (AGS) from the ID columns.
+    """
+    keys = (chunk["ULAND"] * 10**6 + chunk["UREGBEZ"] * 10**5 +
+            chunk["UKREIS"] * 10**3 + chunk["UGEMEINDE"])
+    return keys.astype(int).astype(str).str.zfill(8)
+
 
-def read_unfaelle_csv() -> pd.DataFrame:
+def read_unfaelle_csv(path: str, regions: list = REGIONS) -> pd.DataFrame:
     """
-    Reads csv data from the path specified above. The csv files need to 
-    accord to the standard unfallatlas format.
+    Reads one yearly export in chunks and keeps only bicycle and pedestrian
+    accidents in the given regions. The csv files need to accord to the
+    standard unfallatlas format.
+
+    Parameters
+    ----------
+    path : str
+        Path of the zip or CSV export.
+    regions : list, optional
+        Official municipality keys or prefixes of them. All municipalities
+        are kept if the list is empty.
 
     Returns
     -------
-    Unfaelle_df : DataFrame
-        Dataframe including all relevant incidents concerning the town 
-        specified through IDs. (Aachen)
+    accidents_df : DataFrame
+        Dataframe including all relevant incidents of the export.
 
     """
-    accidents_df = pd.DataFrame()
-    
-    filenames = os.listdir(DIRECTORY_CSV)
-    
-    # for year in range(START_YEAR,END_YEAR+1):
-    #     filename = f"Unfallorte{year}_EPSG25832_CSV.zip"
-    #     directory = f"{DIRECTORY_CSV}/{filename}"
-    #     data = pd.read_csv(directory, 
-    #                        delimiter = ";", 
-    #                        decimal = ",",
-    #                        usecols = ["OBJECTID", "ULAND", 
-    #                                   "UREGBEZ", "UKREIS",
-    #                                   "UGEMEINDE", "UJAHR", 
-    #                                   "IstRad", "IstFuss", 
-    #                                   "LINREFX", "LINREFY", 
-    #                                   "XGCSWGS84", "YGCSWGS84"],
-    #                        index_col = "OBJECTID")
-        
-    #     accidents_df = pd.concat([accidents_df, data])
-    
-    for filename in filenames:
-        directory =f"{DIRECTORY_CSV}/{filename}"
-        
-        data = pd.read_csv(directory, 
-                           delimiter = ";", 
-                           decimal = ",",
-                           usecols = ["OBJECTID", "ULAND", 
-                                      "UREGBEZ", "UKREIS",
-                                      "UGEMEINDE", "UJAHR", 
-                                      "IstRad", "IstFuss", 
-                                      "LINREFX", "LINREFY", 
-                                      "XGCSWGS84", "YGCSWGS84"],
-                           index_col = "OBJECTID")
-        
-        accidents_df = pd.concat([accidents_df, data])
-        
-    accidents_df = accidents_df[accidents_df.ULAND == LAND_ID]
-    accidents_df = accidents_df[accidents_df.UREGBEZ == REGBEZ_ID]
-    accidents_df = accidents_df[accidents_df.UKREIS == KREIS_ID]
-    accidents_df = accidents_df[accidents_df.UGEMEINDE == GEMEINDE_ID]
-    accidents_df = accidents_df[["UJAHR", "IstRad", "IstFuss", 
-                                 "LINREFX", "LINREFY", 
+    chunks = []
+    with open_export(path) as file:
+        reader = pd.read_csv(file,
+                             delimiter = ";",
+                             decimal = ",",
+                             usecols = lambda column: column.upper() in USECOLS,
+                             encoding_errors = "replace",
+                             chunksize = CHUNK_SIZE)
+        for chunk in reader:
+            # column names differ in case between some years
+            chunk.columns = [column.upper() for column in chunk.columns]
+            chunk = chunk.rename(columns = {column.upper(): column
+                                            for column in COLUMNS})
+            chunk = chunk[(chunk["IstRad"] == 1) | (chunk["IstFuss"] == 1)]
+            chunk.insert(0, "ags", municipality_keys(chunk))
+            if regions:
+                chunk = chunk[chunk["ags"].str.startswith(tuple(regions))]
+            chunks.append(chunk)
+
+    if not chunks:
+        raise ValueError(f"The export {path} contains no accidents.")
+    accidents_df = pd.concat(chunks)
+    accidents_df = accidents_df.set_index("OBJECTID")
+    accidents_df = accidents_df[["ags", "UJAHR", "IstRad", "IstFuss",
+                                 "LINREFX", "LINREFY",
                                  "XGCSWGS84", "YGCSWGS84"]]
-    
-    accidents_df = accidents_df.rename(columns={"UJAHR": "jahr", 
-                                "IstRad": "rad", 
+
+    accidents_df = accidents_df.rename(columns={"UJAHR": "jahr",
+                                "IstRad": "rad",
                                 "IstFuss": "fuss",
                                 "XGCSWGS84": "x_wgs84",
                                 "YGCSWGS84": "y_wgs84",
                                 "LINREFX": "x_linref",
                                 "LINREFY": "y_linref"})
-    
+
     accidents_df.index.names = ['objectid']
     return accidents_df
 
-def accidents_to_hdf(accidents_df: pd.DataFrame):
-    """
-    Writes the accident data as h5-files.
 
-    Parameters
-    ----------
-    accidents_df : pd.DataFrame
-        List of accidents as read from the given csv-files.
+def convert_year(year: int, path: str, regions: list = REGIONS) -> int:
+    """
+    Converts the export of one year and writes it to the accident stores.
 
     Returns
     -------
-    None.
+    count : int
+        Number of converted accidents.
 
     """
-    accidents_foot = accidents_df[accidents_df["fuss"] == 1]
-    accidents_foot.to_hdf("accident_data/accidents_foot.h5", complevel=9, key = "fixed")
-    accidents_bike = accidents_df[accidents_df["rad"] == 1]
-    accidents_bike.to_hdf("accident_data/accidents_bike.h5", complevel=9, key = "fixed")
-    
-def main(db_uri: str):
-    accidents_df = read_unfaelle_csv()
-    
-    accidents_to_hdf(accidents_df)
-        
-    
+    accidents_df = read_unfaelle_csv(path, regions)
+    for column, store_path in STORE_PATHS.items():
+        write_accident_store(accidents_df[accidents_df[column] == 1],
+                             store_path)
+    log.info(f"Converted {len(accidents_df)} accidents of {year}.")
+    return len(accidents_df)
+
+
+def main(directory: str = DIRECTORY_CSV,
+         regions: list = REGIONS,
+         workers: int = None):
+    """
+    Converts the exports of all years in parallel.
+    """
+    year_files = find_year_files(directory)
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = {year: executor.submit(convert_year, year, path, regions)
+                   for year, path in year_files.items()}
+        for year, future in futures.items():
+            future.result()
+
+
 if __name__ == '__main__':
     logging.basicConfig(
         filename = "unfallatlas.log",
@@ -119,4 +179,4 @@ if __name__ == '__main__':
         format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s',
         datefmt='%d-%m-%Y %H:%M:%S',
     )
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,172 @@
+"""
+Compact aggregate statistics of the results, computed while scoring.
+
+The statistics are written next to the results, so cities can be compared
+without reloading the building-level data.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# number of bins of the histogram used for quantiles
+QUANTILE_BINS = 1000
+QUANTILES = [0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95]
+
+
+class ScoreStatistics():
+    """
+    Streaming statistics of building scores. Scores are added chunk by chunk
+    and only histograms and sums are kept.
+
+    Parameters
+    ----------
+    categories : list
+        POI categories contributing to the scores.
+    bins : int, optional
+        Number of bins of the score histogram between 0 and 1.
+
+    """
+    def __init__(self, categories: list, bins: int = 20):
+        self.categories = list(categories)
+        self.bins = bins
+        self.count = 0
+        self.score_sum = 0.0
+        self.score_square_sum = 0.0
+        self.score_min = np.inf
+        self.score_max = -np.inf
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        self.fine_histogram = np.zeros(QUANTILE_BINS, dtype=np.int64)
+        self.category_sums = np.zeros(len(self.categories))
+        self.type_counts = {}
+        self.type_sums = {}
+
+    def update(self, contributions: pd.DataFrame, building_types: pd.Series = None):
+        """
+        Adds a chunk of scored buildings.
+
+        Parameters
+        ----------
+        contributions : pd.DataFrame
+            Contribution of each category to the score of each building,
+            scaled so that the contributions of a building sum up to its score.
+        building_types : pd.Series, optional
+            OSM building type of each building.
+
+        """
+        contributions = contributions[self.categories].fillna(0)
+        scores = contributions.sum(axis=1).to_numpy()
+        if len(scores) == 0:
+            return
+
+        self.count += len(scores)
+        self.score_sum += scores.sum()
+        self.score_square_sum += np.square(scores).sum()
+        self.score_min = min(self.score_min, scores.min())
+        self.score_max = max(self.score_max, scores.max())
+        self.histogram += np.histogram(scores, bins=self.bins, range=(0, 1))[0]
+        self.fine_histogram += np.histogram(scores, bins=QUANTILE_BINS,
+                                            range=(0, 1))[0]
+        self.category_sums += contributions.sum(axis=0).to_numpy()
+
+        if building_types is not None:
+            grouped = pd.Series(scores, index=building_types.index) \
+                .groupby(building_types.to_numpy())
+            for building_type, count in grouped.count().items():
+                self.type_counts[building_type] = self.type_counts.get(building_type, 0) + int(count)
+            for building_type, score_sum in grouped.sum().items():
+                self.type_sums[building_type] = self.type_sums.get(building_type, 0.0) + float(score_sum)
+
+    def merge(self, other: "ScoreStatistics"):
+        """
+        Adds the statistics of another part of the region, e.g. a tile.
+        """
+        self.count += other.count
+        self.score_sum += other.score_sum
+        self.score_square_sum += other.score_square_sum
+        self.score_min = min(self.score_min, other.score_min)
+        self.score_max = max(self.score_max, other.score_max)
+        self.histogram += other.histogram
+        self.fine_histogram += other.fine_histogram
+        self.category_sums += other.category_sums
+        for building_type, count in other.type_counts.items():
+            self.type_counts[building_type] = self.type_counts.get(building_type, 0) + count
+            self.type_sums[building_type] = self.type_sums.get(building_type, 0.0) + other.type_sums[building_type]
+
+    def quantiles(self, quantiles: list = QUANTILES) -> dict:
+        """
+        Estimates quantiles of the scores from the fine histogram with a
+        resolution of 1/QUANTILE_BINS.
+        """
+        cumulative = np.cumsum(self.fine_histogram) / max(self.count, 1)
+        upper_edges = np.arange(1, QUANTILE_BINS + 1) / QUANTILE_BINS
+        positions = np.searchsorted(cumulative, quantiles)
+        positions = np.clip(positions, 0, QUANTILE_BINS - 1)
+        return {str(q): float(upper_edges[p]) for q, p in zip(quantiles, positions)}
+
+    def to_dict(self) -> dict:
+        count = max(self.count, 1)
+        mean = self.score_sum / count
+        std = np.sqrt(max(self.score_square_sum / count - mean**2, 0))
+        total = self.category_sums.sum()
+        return {
+            "count": self.count,
+            "mean": mean,
+            "std": std,
+            "min": float(self.score_min) if self.count else None,
+            "max": float(self.score_max) if self.count else None,
+            "quantiles": self.quantiles(),
+            "histogram": {"edges": np.linspace(0, 1, self.bins + 1).tolist(),
+                          "counts": self.histogram.tolist()},
+            "category_contributions": {
+                category: {"mean": category_sum / count,
+                           "share": category_sum / total if total else 0.0}
+                for category, category_sum in zip(self.categories,
+                                                  self.category_sums.tolist())},
+            "building_types": {
+                building_type: {"count": self.type_counts[building_type],
+                                "mean": self.type_sums[building_type] / self.type_counts[building_type]}
+                for building_type in sorted(self.type_counts)}}
+
+
+def suitability_statistics(edges: pd.DataFrame, bins: int = 10) -> dict:
+    """
+    Calculates the length weighted distribution of suitability modifiers
+    for each highway type.
+    """
+    highway = edges["highway"].map(
+        lambda value: ",".join(sorted(value)) if isinstance(value, list) else str(value))
+    modifiers = edges["suitability_modifier"].to_numpy(dtype=float)
+    lengths = edges["length"].to_numpy(dtype=float)
+
+    statistics = {}
+    for highway_type, positions in highway.groupby(highway.to_numpy()).indices.items():
+        type_lengths = lengths[positions]
+        type_modifiers = modifiers[positions]
+        total_length = type_lengths.sum()
+        counts = np.histogram(type_modifiers, bins=bins, range=(0, 1),
+                              weights=type_lengths)[0]
+        statistics[highway_type] = {
+            "edges": len(positions),
+            "length": total_length,
+            "mean_modifier": float(np.average(type_modifiers, weights=type_lengths))
+                if total_length > 0 else float(type_modifiers.mean()),
+            "length_histogram": counts.tolist()}
+    return {"bins": np.linspace(0, 1, bins + 1).tolist(),
+            "highway_types": statistics}
+
+
+def write_statistics(statistics: ScoreStatistics,
+                     edges: pd.DataFrame,
+                     CONFIG: dict):
+    """
+    Writes the building score and suitability statistics as json file next
+    to the results.
+    """
+    content = {"city": CONFIG["city"],
+               "buildings": statistics.to_dict(),
+               "suitability": suitability_statistics(edges)}
+    os.makedirs(CONFIG["export_path"], exist_ok=True)
+    with open(f"{CONFIG['export_path']}/statistics.json", "w") as file:
+        json.dump(content, file, indent=2, default=float)
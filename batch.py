@@ -0,0 +1,207 @@
+"""
+Batch calculation of several cities and profiles.
+
+The jobs (one per city and profile) run in parallel processes as long as
+their estimated memory fits into the memory budget. The first job of every
+city calculates the suitability network, buildings and POIs; the other
+profiles of the city start afterwards and reuse them from the cache and the
+checkpoints. A summary with runtime and peak memory of every job is written
+to "EXPORT_PATH/batch_summary.json".
+
+Usage: python batch.py batch.json
+
+The batch file lists the cities and, optionally, the profiles as overrides
+of the configuration, e.g.
+{"cities": ["Aachen, Germany", {"city": "Utrecht, Netherlands",
+                                "pbf_path": "pyrosm/utrecht.osm.pbf"}],
+ "profiles": {"default": {},
+              "commuter": {"model_weight_factors": {...}}}}
+"""
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import instrumentation
+from bikeability_config import CONFIG
+
+log = logging.getLogger("Bikeability")
+
+
+def export_name(city: str) -> str:
+    """
+    Converts a city name into a directory name, e.g. "Aachen, Germany" into
+    "aachen".
+    """
+    return re.sub(r"\W+", "_", city.split(",")[0].strip().lower())
+
+
+def job_config(CONFIG: dict, city: dict, profile: str, overrides: dict) -> dict:
+    """
+    Builds the configuration of one job from the base configuration, the
+    city and the profile overrides. Results are written to a subdirectory
+    per city and profile.
+    """
+    config = {**CONFIG, "pbf_path": ""}
+    config.update(city)
+    config.update(overrides)
+    config["export_path"] = (f"{CONFIG['export_path']}/"
+                             f"{export_name(config['city'])}/{profile}")
+    return config
+
+
+def run_job(config: dict) -> dict:
+    """
+    Runs the calculation and exports for one city and profile in a worker
+    process.
+
+    Returns
+    -------
+    result : dict
+        Status, wall time, CPU time and peak resident set size of the job.
+
+    """
+    # imported in the worker to keep the scheduler process small
+    import metrics
+    import profiling
+    from aggregates import write_statistics
+    from pipeline import run_pipeline
+    from scoring import save_results
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    instrumentation.start_report(config["city"])
+    profiling.configure(config)
+    metrics.start(config)
+    try:
+        results = run_pipeline(config)
+        write_statistics(results["statistics"], results["edges"], config)
+        with instrumentation.stage("exports", rows=len(results["buildings"])):
+            save_results(results["buildings"], results["POIs"],
+                         results["edges"], config)
+        status, error = "finished", None
+    except Exception as exception:
+        log.exception(f"Batch job for {config['city']} failed.")
+        status, error = "failed", repr(exception)
+    finally:
+        metrics.stop()
+    instrumentation.write_report(config)
+    return {"status": status,
+            "error": error,
+            "runtime": time.perf_counter() - start,
+            "cpu_time": time.process_time() - cpu_start,
+            "peak_rss": instrumentation.peak_rss()}
+
+
+def run_batch(cities: list,
+              profiles: dict,
+              CONFIG: dict,
+              workers: int = None,
+              memory_budget: int = None) -> list:
+    """
+    Runs all combinations of cities and profiles in parallel under a memory
+    budget.
+
+    Parameters
+    ----------
+    cities : list
+        City names or dictionaries of city specific configuration containing
+        at least "city".
+    profiles : dict
+        Configuration overrides by profile name.
+    CONFIG : dict
+        Base bikeability configuration.
+    workers : int, optional
+        Maximum number of parallel jobs, defaults to "BATCH_WORKERS".
+    memory_budget : int, optional
+        Memory in bytes available to all running jobs, defaults to
+        "BATCH_MEMORY_BUDGET".
+
+    Returns
+    -------
+    summary : list
+        Result of every job.
+
+    """
+    workers = workers or CONFIG["batch_workers"] or os.cpu_count()
+    memory_budget = memory_budget or CONFIG["batch_memory_budget"]
+    cities = [{"city": city} if isinstance(city, str) else city
+              for city in cities]
+    profiles = profiles or {"default": {}}
+
+    # the first profile of each city is ready immediately, the others wait
+    # for it to share its network, buildings and POIs
+    ready = [(city, profile) for city in cities
+             for profile in list(profiles)[:1]]
+    waiting = {city["city"]: [(city, profile) for profile in list(profiles)[1:]]
+               for city in cities}
+    # peak memory of finished jobs by city, used as estimate for the others
+    observed = {}
+    running = {}
+    summary = []
+
+    def estimate(city: dict) -> int:
+        return observed.get(city["city"], CONFIG["batch_job_memory"])
+
+    # every process is only used for one job, so its peak memory is the job's
+    with ProcessPoolExecutor(max_workers=workers,
+                             max_tasks_per_child=1) as executor:
+        while ready or running:
+            reserved = sum(memory for _, _, memory in running.values())
+            for job in list(ready):
+                city, profile = job
+                memory = estimate(city)
+                if len(running) >= workers:
+                    break
+                # at least one job runs, even if it exceeds the budget
+                if running and reserved + memory > memory_budget:
+                    continue
+                config = job_config(CONFIG, city, profile, profiles[profile])
+                future = executor.submit(run_job, config)
+                running[future] = (city, profile, memory)
+                reserved += memory
+                ready.remove(job)
+                log.info(f"Started {city['city']} ({profile}).")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                city, profile, _ = running.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exception:
+                    # the worker process itself failed, e.g. out of memory
+                    result = {"status": "failed", "error": repr(exception),
+                              "runtime": None, "cpu_time": None,
+                              "peak_rss": None}
+                log.info(f"{result['status'].capitalize()} {city['city']} "
+                         f"({profile}).")
+                summary.append({"city": city["city"], "profile": profile,
+                                **result})
+                if result["peak_rss"]:
+                    observed[city["city"]] = max(
+                        observed.get(city["city"], 0), result["peak_rss"])
+                ready.extend(waiting.pop(city["city"], []))
+
+    os.makedirs(CONFIG["export_path"], exist_ok=True)
+    with open(f"{CONFIG['export_path']}/batch_summary.json", "w") as file:
+        json.dump(summary, file, indent=2)
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename="bikeability.log",
+        level=logging.INFO,
+        format="%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s",
+        datefmt="%d-%m-%Y %H:%M:%S")
+
+    with open(sys.argv[1]) as file:
+        batch = json.load(file)
+    run_batch(cities=batch["cities"],
+              profiles=batch.get("profiles"),
+              CONFIG=CONFIG,
+              workers=batch.get("workers"),
+              memory_budget=batch.get("memory_budget"))
@@ -0,0 +1,128 @@
+"""
+Load test of a running scoring service.
+
+Concurrent clients send score requests with random points within the bounds
+of the network and the throughput and latency percentiles are reported. With
+a limited number of distinct points, repeated points are answered from the
+result cache.
+
+Usage (from the repository root, with "python cli.py serve" running):
+    python -m benchmarks.load_test --requests 2000 --concurrency 32
+    python -m benchmarks.load_test --distinct 100
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                  method: str, path: str, content: dict = None) -> tuple:
+    """
+    Sends a request over an open connection.
+
+    Returns
+    -------
+    status : int
+        HTTP status code.
+    response : dict
+        Decoded json response.
+
+    """
+    body = json.dumps(content).encode() if content is not None else b""
+    writer.write((f"{method} {path} HTTP/1.1\r\n"
+                  "Host: localhost\r\n"
+                  "Content-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n"
+                  "\r\n").encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    response = await reader.readexactly(int(headers["content-length"]))
+    return status, json.loads(response)
+
+
+async def client(host: str, port: int, requests: list, profile: str,
+                 latencies: list, errors: list):
+    """
+    Sends the requests one after another over one connection.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for points in requests:
+            start = time.perf_counter()
+            status, response = await request(reader, writer, "POST", "/score",
+                                             {"profile": profile, "points": points})
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(response.get("error", status))
+    finally:
+        writer.close()
+
+
+async def run_load_test(args: argparse.Namespace) -> dict:
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    _, health = await request(reader, writer, "GET", "/health")
+    writer.close()
+    profile = args.profile or next(iter(health["profiles"]))
+    min_lon, min_lat, max_lon, max_lat = health["profiles"][profile]["bounds"]
+
+    rng = random.Random(args.seed)
+    distinct = [[rng.uniform(min_lon, max_lon), rng.uniform(min_lat, max_lat)]
+                for _ in range(args.distinct or args.requests * args.points)]
+    requests = [[rng.choice(distinct) if args.distinct else distinct.pop()
+                 for _ in range(args.points)]
+                for _ in range(args.requests)]
+
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(client(args.host, args.port,
+                                  requests[number::args.concurrency], profile,
+                                  latencies, errors)
+                           for number in range(args.concurrency)))
+    wall_time = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    _, health = await request(reader, writer, "GET", "/health")
+    writer.close()
+
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {"requests": len(latencies),
+            "errors": len(errors),
+            "wall_time": wall_time,
+            "requests_per_second": len(latencies) / wall_time,
+            "points_per_second": len(latencies) * args.points / wall_time,
+            "latency_p50": percentiles[49],
+            "latency_p95": percentiles[94],
+            "latency_p99": percentiles[98],
+            "cache": health["cache"]}
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--profile", help="profile to request, the first one by default")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="number of clients sending requests at the same time")
+    parser.add_argument("--points", type=int, default=1,
+                        help="number of points per request")
+    parser.add_argument("--distinct", type=int,
+                        help="number of distinct points, all points differ by default")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run_load_test(args))
+    print(json.dumps(result, indent=2))
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
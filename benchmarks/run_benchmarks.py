@@ -0,0 +1,185 @@
+"""
+Offline benchmarks of the suitability and scoring stages on synthetic cities.
+
+Every stage is timed at each of the given scales and compared with the
+stored baselines. Besides the runtimes, a few result values are compared, so
+changes of the results are noticed as well. The run fails if a stage is
+slower than its baseline by more than the tolerance, a result differs or a
+scale has no baseline. Runtimes depend on the machine, so no baselines are
+committed; they are stored once on the machine running the benchmarks.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks --store-baseline
+    python -m benchmarks.run_benchmarks --scales 1000 10000
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+import osmnx as ox
+
+import instrumentation
+from benchmarks.synthetic_city import generate_city
+from cli import COMMAND_MODULES
+from bikeability_config import CONFIG
+from scoring import score_buildings
+from suitability import Suitability
+
+SCALES = [1000, 10000, 100000, 1000000]
+BASELINE_PATH = "benchmarks/baselines.json"
+# relative slowdown of a stage that counts as regression
+TOLERANCE = 0.25
+# relative difference of result values that counts as change
+RESULT_TOLERANCE = 1e-6
+# number of runs of each startup measurement, the fastest run is used
+STARTUP_RUNS = 3
+
+
+def benchmark_scale(buildings: int, score_sample: int, CONFIG: dict) -> dict:
+    """
+    Generates a city with the given number of buildings and runs all stages
+    on it. As scoring is by far the slowest stage, only a sample of the
+    buildings is scored.
+
+    Returns
+    -------
+    result : dict
+        Measurements of all stages and the result values.
+
+    """
+    config = {**CONFIG, "use_accidents": False}
+    report = instrumentation.start_report(f"synthetic {buildings}")
+    suitability = Suitability()
+
+    with instrumentation.stage("generate", rows=buildings):
+        city = generate_city(buildings, config)
+    network_osm = city["network_osm"]
+    scoring = network_osm[["name", "id", "tags", "osm_type", "highway",
+                           "geometry", "motor_vehicle", "lit", "length"]]
+
+    with instrumentation.stage("separation", rows=len(scoring)):
+        scoring, _ = suitability.score_route_separation(network_osm, scoring, config)
+    with instrumentation.stage("surface", rows=len(scoring)):
+        scoring, _ = suitability.score_route_surfaces(network_osm, scoring, config)
+    with instrumentation.stage("light", rows=len(scoring)):
+        scoring, _ = suitability.score_route_lights(network_osm, scoring, config)
+
+    nodes, edges = ox.graph_to_gdfs(city["graph"])
+    nodes, edges = suitability.remove_ignored_types(nodes, edges, config)
+    with instrumentation.stage("suitability_to_network", rows=len(edges)):
+        edges, network = suitability.suitability_to_network(
+            nodes, edges, city["graph"], scoring, config)
+    edges.sort_index(inplace=True)
+
+    sample = city["buildings"].iloc[:score_sample]
+    with instrumentation.stage("score_buildings", rows=len(sample)):
+        scored = score_buildings(sample, city["POIs"], network, edges, config)
+
+    stages = {record["stage"]: {key: record[key] for key in
+                                ["wall_time", "cpu_time", "peak_rss", "rows"]}
+              for record in report.stages}
+    report.close()
+    return {"stages": stages,
+            "results": {"mean_modifier": float(edges.suitability_modifier.mean()),
+                        "mean_score": float(scored.score.mean()),
+                        "edges": len(edges)}}
+
+
+def time_process(command: list) -> float:
+    """
+    Returns the shortest wall time of several runs of a command.
+    """
+    times = []
+    for _ in range(STARTUP_RUNS):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark_startup() -> dict:
+    """
+    Measures the startup time of the command-line interface and the time
+    until each subcommand has imported its modules, in fresh processes.
+    """
+    stages = {"help": {"wall_time": time_process(
+        [sys.executable, "cli.py", "--help"])}}
+    for command, module in COMMAND_MODULES.items():
+        stages[command] = {"wall_time": time_process(
+            [sys.executable, "-c", f"import cli, {module}"])}
+    return {"stages": stages, "results": {}}
+
+
+def compare(results: dict, baselines: dict, tolerance: float) -> list:
+    """
+    Compares the measurements with the baselines of the same scales.
+
+    Returns
+    -------
+    problems : list
+        Descriptions of all regressions and changed results.
+
+    """
+    problems = []
+    for scale, result in results.items():
+        baseline = baselines.get(scale)
+        if baseline is None:
+            problems.append(f"{scale}: no baseline, store one with --store-baseline")
+            continue
+        for stage, measurement in result["stages"].items():
+            if stage not in baseline["stages"]:
+                continue
+            base_time = baseline["stages"][stage]["wall_time"]
+            ratio = measurement["wall_time"] / base_time if base_time else math.inf
+            print(f"{scale:>8} {stage:<24} {measurement['wall_time']:9.3f}s "
+                  f"baseline {base_time:9.3f}s ({ratio:5.2f}x)")
+            if ratio > 1 + tolerance:
+                problems.append(f"{scale} {stage}: {ratio:.2f}x slower")
+        for name, value in result["results"].items():
+            base_value = baseline["results"].get(name)
+            if base_value is not None and not math.isclose(
+                    value, base_value, rel_tol=RESULT_TOLERANCE):
+                problems.append(f"{scale} {name}: {value} instead of {base_value}")
+    return problems
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES[:2],
+                        help="numbers of buildings of the synthetic cities")
+    parser.add_argument("--score-sample", type=int, default=200,
+                        help="number of buildings scored at every scale")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--store-baseline", "--update-baseline", action="store_true",
+                        help="store the measurements as new baselines")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = {"startup": benchmark_startup()}
+    results.update({str(scale): benchmark_scale(scale, args.score_sample, CONFIG)
+                    for scale in args.scales})
+
+    baselines = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline) as file:
+            baselines = json.load(file)
+
+    if args.store_baseline:
+        baselines.update(results)
+        with open(args.baseline, "w") as file:
+            json.dump(baselines, file, indent=2)
+        print(f"Stored baselines for {', '.join(results)}.")
+        return 0
+
+    problems = compare(results, baselines, args.tolerance)
+    for problem in problems:
+        print(problem)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Generator of synthetic cities for offline benchmarks.
+
+A city is a square grid of streets with OSM-like tags, residential buildings
+next to the street nodes and POIs of every category of
+WEIGHT_FACTORS_CATEGORIES. All data is in EPSG:25832 and generated from a
+seed, so the same size and seed always result in the same city.
+"""
+import math
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import pandas as pd
+import shapely
+
+# origin of the grid in EPSG:25832 (Aachen)
+ORIGIN = (294000.0, 5628000.0)
+
+# highway types with their share of the streets
+HIGHWAY_TYPES = {"residential": 0.4, "service": 0.1, "tertiary": 0.1,
+                 "secondary": 0.07, "primary": 0.05, "living_street": 0.04,
+                 "unclassified": 0.04, "cycleway": 0.06, "footway": 0.05,
+                 "track": 0.03, "path": 0.03, "bus": 0.03}
+
+# values of the other tags, None meaning the tag is missing
+TAG_VALUES = {
+    "bicycle": [None, None, None, "yes", "designated", "use_sidepath",
+                "optional_sidepath", "dismount"],
+    "bicycle_road": [None] * 9 + ["yes"],
+    "cycleway": [None, None, None, "no", "lane", "track", "shared_lane",
+                 "opposite_lane", "share_busway"],
+    "motor_vehicle": [None, None, "yes", "no", "destination", "private",
+                      "agricultural"],
+    "surface": [None, "asphalt", "asphalt", "concrete", "paving_stones",
+                "sett", "cobblestone", "gravel", "ground", "asphalt;sett"],
+    "smoothness": [None, None, "excellent", "good", "intermediate", "bad",
+                   "horrible"],
+    "tracktype": [None] * 6 + ["grade1", "grade2", "grade3", "grade4"],
+    "lit": [None, "yes", "yes", "no", "limited", "automatic"],
+    "maxspeed": [None, "30", "50", "70"],
+    "lanes": [None, "1", "2", "4"],
+    "oneway": [None, "yes", "no"],
+    "segregated": [None, "yes", "no"],
+    "sidewalk": [None, "both", "left", "right", "no"],
+    "junction": [None] * 9 + ["roundabout"],
+    "foot": [None, "yes", "designated"],
+    "footway": [None] * 4 + ["sidewalk"],
+    "est_width": [None],
+    "width": [None, "3", "5"]}
+
+
+def grid_size(buildings: int, buildings_per_node: int) -> int:
+    return max(2, math.ceil(math.sqrt(buildings / buildings_per_node)))
+
+
+def generate_streets(size: int, block: float, rng: np.random.Generator):
+    """
+    Generates a grid of streets with one OSM way per street segment.
+
+    Returns
+    -------
+    graph : nx.MultiDiGraph
+        Street network in the format of osmnx.
+    network_osm : gpd.GeoDataFrame
+        Ways with their tags in the format of `Suitability.import_network`.
+
+    """
+    rows, columns = np.divmod(np.arange(size * size), size)
+    node_ids = np.arange(size * size) + 1
+    x = ORIGIN[0] + columns * block
+    y = ORIGIN[1] + rows * block
+
+    # horizontal and vertical segments between neighbouring nodes
+    ids = node_ids.reshape(size, size)
+    u = np.concatenate([ids[:, :-1].ravel(), ids[:-1, :].ravel()])
+    v = np.concatenate([ids[:, 1:].ravel(), ids[1:, :].ravel()])
+    way_ids = np.arange(len(u)) + 1
+    geometries = shapely.linestrings(
+        np.stack([np.stack([x[u - 1], y[u - 1]], axis=1),
+                  np.stack([x[v - 1], y[v - 1]], axis=1)], axis=1))
+
+    highway = rng.choice(list(HIGHWAY_TYPES), size=len(u),
+                         p=np.array(list(HIGHWAY_TYPES.values())) /
+                         sum(HIGHWAY_TYPES.values()))
+    network_osm = pd.DataFrame({"highway": highway})
+    for tag, values in TAG_VALUES.items():
+        network_osm[tag] = rng.choice(np.array(values, dtype=object),
+                                      size=len(u))
+    # streets with the same name share scores in `fill_in_scores`
+    network_osm["name"] = [f"Street {i}" for i in rng.integers(0, max(1, len(u) // 8), len(u))]
+    network_osm["id"] = way_ids
+    network_osm["tags"] = None
+    network_osm["osm_type"] = "way"
+    network_osm["length"] = block
+    network_osm.insert(2, "rightofway", "Yes")
+    network_osm = gpd.GeoDataFrame(network_osm, geometry=geometries,
+                                   crs="EPSG:25832")
+
+    graph = nx.MultiDiGraph(crs="EPSG:25832")
+    graph.add_nodes_from(
+        (node, {"x": node_x, "y": node_y, "street_count": 4})
+        for node, node_x, node_y in zip(node_ids.tolist(), x.tolist(), y.tolist()))
+    for direction in [(u, v, geometries), (v, u, shapely.reverse(geometries))]:
+        graph.add_edges_from(
+            (start, end, 0, {"osmid": way, "highway": street_type,
+                             "name": name, "oneway": False,
+                             "reversed": False, "length": block,
+                             "maxspeed": maxspeed, "lanes": lanes,
+                             "geometry": geometry})
+            for start, end, way, street_type, name, maxspeed, lanes, geometry
+            in zip(direction[0].tolist(), direction[1].tolist(),
+                   way_ids.tolist(), highway.tolist(),
+                   network_osm["name"], network_osm["maxspeed"],
+                   network_osm["lanes"], direction[2]))
+    return graph, network_osm
+
+
+def place_near_nodes(count: int, graph: nx.MultiDiGraph, block: float,
+                     rng: np.random.Generator) -> tuple:
+    """
+    Places points close to randomly chosen nodes, so the chosen node is also
+    the nearest one.
+    """
+    nodes = rng.integers(1, graph.number_of_nodes() + 1, count)
+    coordinates = np.array([(graph.nodes[node]["x"], graph.nodes[node]["y"])
+                            for node in range(1, graph.number_of_nodes() + 1)])
+    offsets = rng.uniform(-block / 3, block / 3, (count, 2))
+    points = coordinates[nodes - 1] + offsets
+    return nodes, points
+
+
+def generate_buildings(count: int, graph: nx.MultiDiGraph, block: float,
+                       CONFIG: dict,
+                       rng: np.random.Generator) -> gpd.GeoDataFrame:
+    """
+    Generates residential buildings in the format of
+    `fetch_and_filter_residences`.
+    """
+    nodes, points = place_near_nodes(count, graph, block, rng)
+    centroids = shapely.points(points)
+    geometries = shapely.box(points[:, 0] - 5, points[:, 1] - 5,
+                             points[:, 0] + 5, points[:, 1] + 5)
+    types = rng.choice(CONFIG["residential_building_types"], count)
+    return gpd.GeoDataFrame({"osmid": np.arange(count) + 1,
+                             "geometry": geometries,
+                             "centroid": gpd.GeoSeries(centroids, crs="EPSG:25832"),
+                             "node": nodes,
+                             "building": types},
+                            geometry="geometry", crs="EPSG:25832")
+
+
+def generate_POIs(per_category: int, graph: nx.MultiDiGraph, block: float,
+                  CONFIG: dict, rng: np.random.Generator) -> gpd.GeoDataFrame:
+    """
+    Generates the same number of POIs for every category in the format of
+    `fetch_POIs`.
+    """
+    categories = CONFIG["weight_factors_categories"]
+    POI_categories = np.repeat(list(categories), per_category)
+    POI_types = [rng.choice(categories[category]) for category in POI_categories]
+    nodes, points = place_near_nodes(len(POI_categories), graph, block, rng)
+    geometries = gpd.GeoSeries(shapely.points(points), crs="EPSG:25832")
+    return gpd.GeoDataFrame({"name": [f"POI {i}" for i in range(len(nodes))],
+                             "osmid": np.arange(len(nodes)) + 1,
+                             "geometry": geometries,
+                             "centroid": geometries,
+                             "node": nodes,
+                             "POI_type": POI_types,
+                             "POI_category": POI_categories},
+                            geometry="geometry", crs="EPSG:25832")
+
+
+def generate_city(buildings: int,
+                  CONFIG: dict,
+                  seed: int = 0,
+                  buildings_per_node: int = 10,
+                  block: float = 100.0) -> dict:
+    """
+    Generates a synthetic city.
+
+    Parameters
+    ----------
+    buildings : int
+        Number of residential buildings.
+    CONFIG : dict
+        Bikeability configuration, used for building types and POI
+        categories.
+    seed : int, optional
+        Seed of the random generator.
+    buildings_per_node : int, optional
+        Average number of buildings per street node, determines the size of
+        the street grid.
+    block : float, optional
+        Distance between neighbouring street nodes in metres.
+
+    Returns
+    -------
+    city : dict
+        The street network ("graph"), ways with tags ("network_osm"),
+        buildings and POIs.
+
+    """
+    rng = np.random.default_rng(seed)
+    graph, network_osm = generate_streets(
+        grid_size(buildings, buildings_per_node), block, rng)
+    # at least as many POIs per category as are searched per building
+    per_category = max(10, buildings // 200)
+    return {"graph": graph,
+            "network_osm": network_osm,
+            "buildings": generate_buildings(buildings, graph, block, CONFIG, rng),
+            "POIs": generate_POIs(per_category, graph, block, CONFIG, rng)}
@@ -1,8 +1,47 @@
 USE_ACCIDENTS = False
 VISUALIZE = False
-ACCIDENT_PATH = "accident_data/accidents_bike.h5"
+VIS_LOD = True # simplify and merge geometries of the html maps
+VIS_ZOOM = 14 # zoom level the geometries of the html maps are simplified for
+VIS_PRECISION = 5 # decimal places of coordinates in the html maps
+VIS_POLYGON_TOLERANCE = 1 # metres building and POI outlines of the html maps are simplified by, finer than the streets
+ACCIDENT_PATH = "accident_data/accidents_bike.h5" # h5-file or partitioned parquet store
+ACCIDENT_YEARS = [] # leave empty to use accidents of all years
 PBF_PATH = "" # leave empty when no protobuff file is available
 EXPORT_PATH = "results"
+EXPORT_FORMATS = ["parquet"] # "parquet" (GeoParquet) and/or "flatgeobuf"
+VECTOR_TILES = False # export buildings and edges as MBTiles vector tiles
+VECTOR_TILE_ZOOMS = [10, 16] # minimum and maximum zoom level
+VECTOR_TILE_WORKERS = None # number of processes, None uses all cores
+OUTPUT_WORKERS = 4 # number of processes writing exports and visualisations
+USE_CACHE = True # reuse scored suitability networks of previous runs
+CACHE_PATH = "cache"
+CACHE_MAX_SIZE = 5 * 1024**3 # bytes, least recently used entries are removed
+BATCH_WORKERS = None # parallel cities in batch runs, None uses all cores
+BATCH_MEMORY_BUDGET = 16 * 1024**3 # bytes available to all parallel cities
+BATCH_JOB_MEMORY = 4 * 1024**3 # bytes estimated for a city before its first run
+PROFILE_MODE = None # None, "cprofile", "sampling" or "tracemalloc"
+PROFILE_STAGES = ["scores"] # stages to profile, "score_building" profiles the scoring of single buildings
+PROFILE_PATH = "profiles"
+PROFILE_TOP = 20 # number of functions in the profile summary
+METRICS_PATH = "" # directory of the Prometheus textfile collector, leave empty to disable metrics
+METRICS_INTERVAL = 15 # seconds between updates of the metrics
+ROUTE_CACHE_SIZE = 100000 # routes kept for buildings sharing a street node, per process, 0 disables the cache; memory grows with the number and length of the routes
+USE_CHECKPOINTS = True # resume interrupted runs from the last finished stage
+CHECKPOINT_PATH = "checkpoints"
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8080
+SERVICE_WORKERS = None # processes of the scoring service running searches, None uses all cores
+SERVICE_CACHE_SIZE = 100000 # scores of nodes kept by the scoring service
+SERVICE_BATCH_DELAY = 0.01 # seconds the scoring service collects requested nodes into a batch
+SERVICE_BATCH_SIZE = 64 # maximum number of nodes scored in one batch
+SERVICE_MAX_BODY = 1000000 # bytes, larger requests are rejected by the scoring service
+QUEUE_PATH = "queue" # directory of the work queue of distributed scoring, shared by coordinator and workers
+QUEUE_LEASE = 3600 # seconds after which chunks claimed by a worker are claimed again
+QUEUE_MAX_ATTEMPTS = 3 # attempts to score a chunk before it counts as failed
+QUEUE_POLL_INTERVAL = 5 # seconds between checks of the work queue
+QUEUE_CELL_SIZE = 1000 # metres, size of the grid cells buildings are ordered by before chunking
+FEATURE_SOURCE = "overpass" # buildings and POIs from "overpass" or the local protobuff file ("pbf")
+BOUNDARY_PATH = "" # file with the boundary of the city (e.g. GeoJSON), the "pbf" features are clipped to it
 CITY = "Aachen, Germany"
 
 MODEL_WEIGHT_FACTORS = {
@@ -74,9 +113,23 @@ TRANSLATION_FACTORS = {"separation": factors_separation,
 # The road types that aren't evaluated
 IGNORED_TYPES =["motorway", "service"]
 
+# Number of buildings scored at once, after which statistics are updated.
+SCORE_CHUNK_SIZE = 1000
+
 # Maximum distance for bike travel. POIs outside this distance aren't considered for calculation.
 MAX_DISTANCE = 3000 
 
+# Maximum distance in metres between a scored point and the nearest node of the
+# network. Points farther away, e.g. outside the city, get no scores.
+MAX_SNAP_DISTANCE = 500
+
+# Tiled execution for large regions (e.g. federal states). Edge length of the
+# square tiles in metres and the overlap around each tile, which has to cover
+# the maximum routing distance.
+TILE_SIZE = 10000
+TILE_HALO = MAX_DISTANCE
+TILE_PATH = "tiles"
+
 
 WEIGHT_FACTORS_CATEGORIES = {
     "education": ["university", "school"],
@@ -191,13 +244,54 @@ CONFIG = {
     "use_accidents": USE_ACCIDENTS,
     "visualize": VISUALIZE,
     "accident_path": ACCIDENT_PATH,
+    "accident_years": ACCIDENT_YEARS,
+    "pbf_path": PBF_PATH,
     "export_path": EXPORT_PATH,
+    "export_formats": EXPORT_FORMATS,
+    "vector_tiles": VECTOR_TILES,
+    "vector_tile_zooms": VECTOR_TILE_ZOOMS,
+    "vector_tile_workers": VECTOR_TILE_WORKERS,
+    "output_workers": OUTPUT_WORKERS,
+    "use_cache": USE_CACHE,
+    "cache_path": CACHE_PATH,
+    "cache_max_size": CACHE_MAX_SIZE,
+    "feature_source": FEATURE_SOURCE,
+    "boundary_path": BOUNDARY_PATH,
+    "use_checkpoints": USE_CHECKPOINTS,
+    "metrics_path": METRICS_PATH,
+    "metrics_interval": METRICS_INTERVAL,
+    "route_cache_size": ROUTE_CACHE_SIZE,
+    "profile_mode": PROFILE_MODE,
+    "profile_stages": PROFILE_STAGES,
+    "profile_path": PROFILE_PATH,
+    "profile_top": PROFILE_TOP,
+    "batch_workers": BATCH_WORKERS,
+    "batch_memory_budget": BATCH_MEMORY_BUDGET,
+    "batch_job_memory": BATCH_JOB_MEMORY,
+    "checkpoint_path": CHECKPOINT_PATH,
+    "service_host": SERVICE_HOST,
+    "service_port": SERVICE_PORT,
+    "service_workers": SERVICE_WORKERS,
+    "service_cache_size": SERVICE_CACHE_SIZE,
+    "service_batch_delay": SERVICE_BATCH_DELAY,
+    "service_batch_size": SERVICE_BATCH_SIZE,
+    "service_max_body": SERVICE_MAX_BODY,
+    "queue_path": QUEUE_PATH,
+    "queue_lease": QUEUE_LEASE,
+    "queue_max_attempts": QUEUE_MAX_ATTEMPTS,
+    "queue_poll_interval": QUEUE_POLL_INTERVAL,
+    "queue_cell_size": QUEUE_CELL_SIZE,
     "city": CITY,
     "default_scores": DEFAULT_SCORES,
     "factor_weights": FACTOR_WEIGHTS,
     "translation_factors": TRANSLATION_FACTORS,
     "ignored_types": IGNORED_TYPES,
     "max_distance": MAX_DISTANCE,
+    "max_snap_distance": MAX_SNAP_DISTANCE,
+    "score_chunk_size": SCORE_CHUNK_SIZE,
+    "tile_size": TILE_SIZE,
+    "tile_halo": TILE_HALO,
+    "tile_path": TILE_PATH,
     "pois_model": POIS_MODEL,
     "weight_factors_categories": WEIGHT_FACTORS_CATEGORIES,
     "model_weight_factors": MODEL_WEIGHT_FACTORS,
@@ -0,0 +1,329 @@
+"""
+Command-line interface of the bikeability calculation.
+
+Every subcommand imports only the modules it needs, so e.g. creating maps of
+existing results doesn't load osmnx and pyrosm, and `--help` starts
+instantly.
+
+Usage:
+    python cli.py [options] suitability   score the road network
+    python cli.py [options] score         score the buildings
+    python cli.py [options] export        export the results
+    python cli.py [options] visualise     create maps of exported results
+    python cli.py [options] run           all of the above
+    python cli.py [options] batch FILE    run several cities and profiles
+    python cli.py [options] points FILE   score the points of a CSV or Parquet file
+    python cli.py [options] serve         serve scores of coordinates over HTTP
+    python cli.py [options] coordinate    export with scoring by distributed workers
+    python cli.py [options] work          score chunks of the distributed work queue
+
+Thanks to the cache and the checkpoints, later subcommands reuse the results
+of earlier ones.
+"""
+import argparse
+import logging
+import os
+import sys
+import warnings
+
+from bikeability_config import CONFIG
+
+log = logging.getLogger("Bikeability")
+
+# module imported by each subcommand, used to measure the startup times
+COMMAND_MODULES = {"suitability": "network_cache",
+                   "score": "pipeline",
+                   "export": "pipeline",
+                   "visualise": "visualisation",
+                   "run": "pipeline",
+                   "batch": "batch",
+                   "points": "point_scoring",
+                   "serve": "service",
+                   "coordinate": "distributed",
+                   "work": "distributed"}
+
+
+def command_suitability(CONFIG: dict, args: argparse.Namespace):
+    """
+    Scores the road network and exports its edges.
+    """
+    from network_cache import eval_suitability_cached
+    from scoring import export_layer
+
+    edges, _ = eval_suitability_cached(CONFIG)
+    os.makedirs(CONFIG["export_path"], exist_ok=True)
+    export_layer(edges, "edges", CONFIG)
+    if CONFIG["visualize"]:
+        import visualisation
+        visualisation.create_suitability_visualisation(edges, CONFIG["export_path"])
+
+
+def command_score(CONFIG: dict, args: argparse.Namespace) -> dict:
+    """
+    Scores the buildings and writes the aggregate statistics.
+    """
+    from aggregates import write_statistics
+    from pipeline import run_pipeline
+
+    results = run_pipeline(CONFIG)
+    write_statistics(results["statistics"], results["edges"], CONFIG)
+    return results
+
+
+def command_export(CONFIG: dict, args: argparse.Namespace,
+                   visualise: bool = False, run_pipeline=None):
+    """
+    Exports the scored buildings, POIs and edges.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    import instrumentation
+    from aggregates import write_statistics
+    from scoring import submit_exports, wait_for_outputs
+
+    if run_pipeline is None:
+        from pipeline import run_pipeline
+
+    # visualisations and exports run in background processes
+    with ProcessPoolExecutor(max_workers=CONFIG["output_workers"]) as executor:
+        results = run_pipeline(CONFIG, executor if visualise else None)
+        write_statistics(results["statistics"], results["edges"], CONFIG)
+        with instrumentation.stage("exports", rows=len(results["buildings"])):
+            outputs = results["outputs"]
+            outputs.update(submit_exports(executor, results["buildings"],
+                                          results["POIs"], results["edges"],
+                                          CONFIG, visualise=visualise))
+            wait_for_outputs(outputs)
+
+
+def read_export(export_path: str, name: str):
+    """
+    Reads an exported layer from its GeoParquet or FlatGeobuf file,
+    whichever exists.
+    """
+    import geopandas as gpd
+
+    if os.path.isfile(f"{export_path}/{name}.parquet"):
+        return gpd.read_parquet(f"{export_path}/{name}.parquet")
+    if os.path.isfile(f"{export_path}/{name}.fgb"):
+        return gpd.read_file(f"{export_path}/{name}.fgb")
+    raise FileNotFoundError(f"No export of {name} found in {export_path}, "
+                            "run the export command first.")
+
+
+def command_visualise(CONFIG: dict, args: argparse.Namespace):
+    """
+    Creates the maps of buildings, POIs and edges from exported results.
+    """
+    import visualisation
+
+    export_path = CONFIG["export_path"]
+    visualisation.create_building_visualisation(
+        read_export(export_path, "buildings"), export_path)
+    visualisation.create_POI_visualisation(
+        read_export(export_path, "POIs"), export_path)
+    visualisation.create_suitability_visualisation(
+        read_export(export_path, "edges"), export_path)
+
+
+def command_run(CONFIG: dict, args: argparse.Namespace):
+    """
+    Runs the whole calculation including exports and maps.
+    """
+    command_export(CONFIG, args, visualise=True)
+
+
+def command_batch(CONFIG: dict, args: argparse.Namespace):
+    """
+    Runs all cities and profiles of a batch file.
+    """
+    import json
+
+    from batch import run_batch
+
+    with open(args.file) as file:
+        batch = json.load(file)
+    run_batch(cities=batch["cities"],
+              profiles=batch.get("profiles"),
+              CONFIG=CONFIG,
+              workers=batch.get("workers"),
+              memory_budget=batch.get("memory_budget"))
+
+
+def command_points(CONFIG: dict, args: argparse.Namespace):
+    """
+    Scores the points of a CSV or Parquet file.
+    """
+    import instrumentation
+    from point_scoring import read_points, score_points, write_points
+
+    if args.max_snap_distance is not None:
+        CONFIG["max_snap_distance"] = args.max_snap_distance
+    points = read_points(args.file, args.x_column, args.y_column, args.crs)
+    with instrumentation.stage("points", rows=len(points)):
+        points_scored = score_points(points, CONFIG, workers=args.workers)
+    output = args.output or f"{CONFIG['export_path']}/points.parquet"
+    write_points(points_scored, output)
+    log.info(f"Scores of {len(points_scored)} points written to {output}.")
+
+
+def command_serve(CONFIG: dict, args: argparse.Namespace):
+    """
+    Serves scores of arbitrary coordinates over HTTP.
+    """
+    import json
+
+    from service import serve
+
+    profiles = None
+    if args.profiles:
+        with open(args.profiles) as file:
+            profiles = json.load(file)
+    if args.host:
+        CONFIG["service_host"] = args.host
+    if args.port:
+        CONFIG["service_port"] = args.port
+    serve(CONFIG, profiles)
+
+
+def command_coordinate(CONFIG: dict, args: argparse.Namespace):
+    """
+    Exports the results, with buildings scored by the workers of the queue.
+    """
+    from distributed import run_coordinator
+
+    command_export(CONFIG, args, run_pipeline=run_coordinator)
+
+
+def command_work(CONFIG: dict, args: argparse.Namespace):
+    """
+    Scores chunks of the work queue of a coordinator.
+    """
+    from distributed import work
+
+    work(CONFIG, worker=args.worker, exit_when_idle=args.exit_when_idle)
+
+
+COMMANDS = {"suitability": command_suitability,
+            "score": command_score,
+            "export": command_export,
+            "visualise": command_visualise,
+            "run": command_run,
+            "batch": command_batch,
+            "points": command_points,
+            "serve": command_serve,
+            "coordinate": command_coordinate,
+            "work": command_work}
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="bikeability",
+        description="Calculates bikeability scores of residential buildings.")
+    parser.add_argument("--city", help="city to evaluate, e.g. \"Aachen, Germany\"")
+    parser.add_argument("--pbf-path", help="protobuff file of the city")
+    parser.add_argument("--export-path", help="directory of the results")
+    parser.add_argument("--feature-source", choices=["overpass", "pbf"],
+                        help="source of buildings and POIs")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="don't use the network and feature cache")
+    parser.add_argument("--no-checkpoints", action="store_true",
+                        help="don't use stage checkpoints")
+    parser.add_argument("--visualise", action="store_true",
+                        help="create the suitability map as well")
+    parser.add_argument("--profile", choices=["cprofile", "sampling", "tracemalloc"],
+                        help="profile the stages given with --profile-stages")
+    parser.add_argument("--profile-stages", nargs="+",
+                        help="stages to profile, e.g. scores score_building")
+    parser.add_argument("--queue-path",
+                        help="directory of the work queue of distributed scoring")
+    parser.add_argument("--metrics-path",
+                        help="directory the Prometheus metrics are written to")
+    parser.add_argument("--log-file", default="bikeability.log")
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, command in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=command.__doc__.strip())
+        if name == "batch":
+            subparser.add_argument("file", help="json file with cities and profiles")
+        elif name == "points":
+            subparser.add_argument("file", help="CSV or Parquet file with the points")
+            subparser.add_argument("--output",
+                                   help="Parquet or CSV file of the scored points")
+            subparser.add_argument("--x-column", default="lon")
+            subparser.add_argument("--y-column", default="lat")
+            subparser.add_argument("--crs", default="EPSG:4326",
+                                   help="coordinate reference system of the columns")
+            subparser.add_argument("--workers", type=int,
+                                   help="number of processes, all cores by default")
+            subparser.add_argument("--max-snap-distance", type=float,
+                                   help="metres between a point and its node, farther points aren't scored")
+        elif name == "work":
+            subparser.add_argument("--worker", help="name of the worker")
+            subparser.add_argument("--exit-when-idle", action="store_true",
+                                   help="stop when no chunks are left")
+        elif name == "serve":
+            subparser.add_argument("--host")
+            subparser.add_argument("--port", type=int)
+            subparser.add_argument("--profiles",
+                                   help="json file with the profiles as overrides of the configuration")
+    return parser
+
+
+def apply_arguments(CONFIG: dict, args: argparse.Namespace) -> dict:
+    """
+    Returns a copy of the configuration with the command-line options
+    applied.
+    """
+    config = dict(CONFIG)
+    overrides = {"city": args.city,
+                 "pbf_path": args.pbf_path,
+                 "export_path": args.export_path,
+                 "feature_source": args.feature_source,
+                 "profile_mode": args.profile,
+                 "profile_stages": args.profile_stages,
+                 "metrics_path": args.metrics_path,
+                 "queue_path": args.queue_path}
+    config.update({key: value for key, value in overrides.items()
+                   if value is not None})
+    if args.no_cache:
+        config["use_cache"] = False
+    if args.no_checkpoints:
+        config["use_checkpoints"] = False
+    if args.visualise:
+        config["visualize"] = True
+    return config
+
+
+def main(argv: list = None):
+    args = build_parser().parse_args(argv)
+    config = apply_arguments(CONFIG, args)
+
+    logging.basicConfig(
+        filename=args.log_file,
+        level=logging.INFO,
+        format="%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s",
+        datefmt="%d-%m-%Y %H:%M:%S")
+    warnings.filterwarnings("error", message="DeprecationWarning: Passing a BlockManager to GeoDataFrame is deprecated and will raise in a future version. Use public APIs instead.")
+
+    if args.command == "batch":
+        COMMANDS["batch"](config, args)
+        return
+
+    import instrumentation
+    import metrics
+    import profiling
+
+    # measure all stages of the run
+    instrumentation.start_report(config["city"])
+    profiling.configure(config)
+    metrics.start(config)
+    try:
+        COMMANDS[args.command](config, args)
+    finally:
+        metrics.stop()
+    instrumentation.write_report(config)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+Compact representation of buildings and POIs for scoring.
+
+Scoring only needs the nearest node, the centroid and a category of every
+building and POI. `CompactPoints` keeps them as struct of arrays: the
+position of the node in the node table of the network (int32), the centroid
+in EPSG:25832 (float32) and a category code (uint8), 13 bytes per object
+instead of polygons, a second centroid GeoSeries, osmid objects and strings.
+Absolute coordinates in EPSG:25832 would be rounded to about 0.5 m by
+float32, so centroids are stored as offsets from an origin next to the
+points and distances are calculated in float64.
+Scores are calculated by position and joined back to the geometries only for
+the export.
+"""
+from dataclasses import dataclass
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+
+# category code of objects without category
+NO_CODE = 255
+
+
+def node_table(network: nx.MultiDiGraph) -> np.ndarray:
+    """
+    Returns the sorted node ids of a network. The position of a node in the
+    table is its index in compact points.
+    """
+    return np.sort(np.fromiter(network.nodes, dtype=np.int64,
+                               count=network.number_of_nodes()))
+
+
+@dataclass(frozen=True)
+class CompactPoints():
+    """
+    Nodes, centroids and categories of buildings or POIs as arrays.
+
+    Attributes
+    ----------
+    node : np.ndarray
+        Position of the nearest node in the node table (int32).
+    x, y : np.ndarray
+        Centroid in EPSG:25832 as offset from the origin (float32).
+    category : np.ndarray
+        Category code (uint8), NO_CODE for objects without category.
+    node_ids : np.ndarray
+        Node table of the network, shared by all compact points of it.
+    origin : tuple
+        Origin of the offsets in EPSG:25832.
+
+    """
+    node: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    category: np.ndarray
+    node_ids: np.ndarray
+    origin: tuple = (0.0, 0.0)
+
+    def __len__(self) -> int:
+        return len(self.node)
+
+    @property
+    def nbytes(self) -> int:
+        return self.node.nbytes + self.x.nbytes + self.y.nbytes + self.category.nbytes
+
+    def node_id(self, positions: np.ndarray) -> np.ndarray:
+        """
+        Returns the ids of the nodes of the points at the positions.
+        """
+        return self.node_ids[self.node[positions]]
+
+    def coordinates(self, positions: np.ndarray) -> tuple:
+        """
+        Returns the centroids of the points at the positions in EPSG:25832
+        (float64).
+        """
+        return (self.x[positions].astype(np.float64) + self.origin[0],
+                self.y[positions].astype(np.float64) + self.origin[1])
+
+    def take(self, positions: np.ndarray) -> "CompactPoints":
+        return CompactPoints(node=self.node[positions],
+                             x=self.x[positions],
+                             y=self.y[positions],
+                             category=self.category[positions],
+                             node_ids=self.node_ids,
+                             origin=self.origin)
+
+    def nearest(self, x: float, y: float, k: int) -> np.ndarray:
+        """
+        Returns the positions of the k points with the shortest linear
+        distance to (x, y) in EPSG:25832, nearest first.
+        """
+        # scalars don't upcast float32 arrays
+        distances = np.hypot(self.x.astype(np.float64) - (x - self.origin[0]),
+                             self.y.astype(np.float64) - (y - self.origin[1]))
+        if k < len(distances):
+            candidates = np.argpartition(distances, k)[:k]
+        else:
+            candidates = np.arange(len(distances))
+        return candidates[np.argsort(distances[candidates], kind="stable")]
+
+
+def compact_points(frame: gpd.GeoDataFrame,
+                   node_ids: np.ndarray,
+                   codes: np.ndarray) -> CompactPoints:
+    """
+    Converts buildings or POIs into compact points.
+
+    Parameters
+    ----------
+    frame : gpd.GeoDataFrame
+        Buildings or POIs with a "node" and a "centroid" column in
+        EPSG:25832.
+    node_ids : np.ndarray
+        Node table of the network, see node_table.
+    codes : np.ndarray
+        Category code of each row, -1 for rows without category.
+
+    Returns
+    -------
+    points : CompactPoints
+        The compact points, in the order of the rows.
+
+    """
+    codes = np.asarray(codes)
+    if codes.max(initial=-1) >= NO_CODE:
+        raise ValueError(f"Compact points support up to {NO_CODE} categories.")
+    nodes = frame["node"].to_numpy(dtype=np.int64)
+    positions = np.searchsorted(node_ids, nodes)
+    if len(nodes) and (positions.max() >= len(node_ids)
+                       or (node_ids[positions] != nodes).any()):
+        raise ValueError("Nodes of the points are missing in the network.")
+    x = frame["centroid"].x.to_numpy(dtype=np.float64)
+    y = frame["centroid"].y.to_numpy(dtype=np.float64)
+    # whole metres, so points on a metre grid keep exact offsets
+    origin = ((float(np.floor(x.min())), float(np.floor(y.min())))
+              if len(x) else (0.0, 0.0))
+    return CompactPoints(node=positions.astype(np.int32),
+                         x=(x - origin[0]).astype(np.float32),
+                         y=(y - origin[1]).astype(np.float32),
+                         category=np.where(codes < 0, NO_CODE, codes).astype(np.uint8),
+                         node_ids=node_ids,
+                         origin=origin)
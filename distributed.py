@@ -0,0 +1,243 @@
+"""
+Distributed building scoring through the work queue.
+
+The coordinator runs the suitability, buildings and POIs stages, splits the
+compact buildings into spatial chunks and publishes them in the work queue
+in "QUEUE_PATH", together with the compiled model, the compact POIs and a
+pointer to the suitability network in the cache. Workers on any machine with
+access to the directory and the cache claim chunks, score them and write
+their partial results next to them. The coordinator merges the results once
+all chunks are done.
+
+Usage:
+    python cli.py [options] coordinate    score and export with workers
+    python cli.py [options] work          score chunks of the queue
+"""
+import hashlib
+import logging
+import os
+import socket
+import time
+import traceback
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import aggregates
+import compact
+import network_cache
+import scoring
+from pipeline import run_pipeline
+from suitability import Suitability
+from work_queue import WorkQueue, write_pickle
+
+log = logging.getLogger("Bikeability")
+
+
+def job_key(buildings: compact.CompactPoints, POIs_by_category: tuple,
+            model, network_key: str, chunks: list) -> str:
+    """
+    Derives the key of a job from its contents, so a restarted coordinator
+    finds the chunks and results of its earlier run.
+    """
+    sha256 = hashlib.sha256(network_key.encode())
+    for positions in chunks:
+        sha256.update(positions.tobytes())
+    for points in (buildings, *POIs_by_category):
+        for array in (points.node, points.x, points.y, points.category):
+            sha256.update(array.tobytes())
+        sha256.update(repr(points.origin).encode())
+    sha256.update(model.weights.tobytes())
+    sha256.update(repr(model.categories).encode())
+    return sha256.hexdigest()[:32]
+
+
+def spatial_chunks(buildings: compact.CompactPoints, chunk_size: int,
+                   cell_size: float) -> list:
+    """
+    Splits the buildings into chunks of neighbouring buildings, ordered by
+    grid cells, so the routes of a chunk share large parts of the network.
+
+    Returns
+    -------
+    chunks : list
+        Positions of the buildings of every chunk.
+
+    """
+    order = np.lexsort((buildings.x, (buildings.x // cell_size).astype(np.int64),
+                        (buildings.y // cell_size).astype(np.int64)))
+    return [order[start:start + chunk_size]
+            for start in range(0, len(order), chunk_size)]
+
+
+def coordinate(CONFIG: dict,
+               buildings: compact.CompactPoints,
+               POIs_by_category: tuple,
+               network,
+               edges,
+               model,
+               statistics: aggregates.ScoreStatistics = None,
+               checkpoint_path: str = None,
+               chunk_size: int = 1000) -> np.ndarray:
+    """
+    Scores compact buildings through the work queue. Takes the arguments of
+    scoring.score_compact_buildings, the results of finished chunks are
+    kept in the queue instead of the checkpoint path.
+
+    Returns
+    -------
+    scores : np.ndarray
+        Score of each building, in the order of the buildings.
+
+    """
+    queue = WorkQueue(CONFIG)
+
+    # workers load the network from the cache instead of the queue
+    cache_path = CONFIG["cache_path"]
+    network_key = network_cache.cache_key(CONFIG, Suitability().get_pbf_path(CONFIG))
+    if not os.path.isdir(f"{cache_path}/{network_key}"):
+        network_cache.store_entry(cache_path, network_key, edges, network)
+
+    chunks = spatial_chunks(buildings, chunk_size, CONFIG["queue_cell_size"])
+    job = job_key(buildings, POIs_by_category, model, network_key, chunks)
+    # the network is pinned until all chunks are scored, so it isn't evicted
+    # while workers may still load it, even if the coordinator is restarted
+    network_cache.pin_entry(cache_path, network_key, job)
+    if queue.has_job(job):
+        log.info(f"Resuming job {job}.")
+        queue.retry_failed(job)
+    else:
+        os.makedirs(queue.job_path(job), exist_ok=True)
+        write_pickle(f"{queue.job_path(job)}/job.pkl",
+                     {"CONFIG": CONFIG,
+                      "network": (cache_path, network_key),
+                      "model": model,
+                      "POIs_by_category": POIs_by_category,
+                      "node_ids": buildings.node_ids})
+        for chunk, positions in enumerate(chunks):
+            write_pickle(queue.chunk_file(job, chunk),
+                         {"positions": positions,
+                          "node": buildings.node[positions],
+                          "x": buildings.x[positions],
+                          "y": buildings.y[positions],
+                          "category": buildings.category[positions],
+                          "origin": buildings.origin})
+        queue.publish(job, len(chunks))
+        log.info(f"Published job {job} with {len(chunks)} chunks.")
+
+    # wait for the workers
+    with tqdm(total=len(chunks)) as progress:
+        while True:
+            # expires claims of crashed workers, which fail after the last
+            # attempt even if no worker is left to claim them
+            queue.expire()
+            status = queue.status(job)
+            progress.update(status["done"] - progress.n)
+            if status["pending"] == status["claimed"] == 0:
+                break
+            time.sleep(CONFIG["queue_poll_interval"])
+    network_cache.unpin_entry(cache_path, network_key, job)
+    if status["failed"]:
+        errors = queue.errors(job)
+        raise RuntimeError(f"{len(errors)} chunks of job {job} failed, "
+                           f"e.g. chunk {errors[0][0]}: {errors[0][1]}")
+
+    scores = np.empty(len(buildings))
+    for chunk in range(len(chunks)):
+        result = pd.read_pickle(queue.result_file(job, chunk))
+        scores[result["positions"]] = result["scores"]
+        if statistics is not None:
+            statistics.merge(result["statistics"])
+    return scores
+
+
+def run_coordinator(CONFIG: dict, executor=None) -> dict:
+    """
+    Runs the pipeline with building scoring by the workers of the queue,
+    see pipeline.run_pipeline.
+    """
+    return run_pipeline(CONFIG, executor,
+                        score_function=partial(coordinate, CONFIG))
+
+
+def load_job(path: str) -> dict:
+    """
+    Loads a job and the suitability network it points to.
+    """
+    job = pd.read_pickle(f"{path}/job.pkl")
+    cached = network_cache.load_entry(*job["network"])
+    if cached is None:
+        raise RuntimeError(f"Suitability network {job['network'][1]} is "
+                           f"missing in the cache {job['network'][0]}.")
+    job["edges"], job["network"] = cached
+    return job
+
+
+def score_chunk(queue: WorkQueue, job: dict, job_id: str, chunk: int):
+    """
+    Scores a chunk and writes its scores and statistics.
+    """
+    data = pd.read_pickle(queue.chunk_file(job_id, chunk))
+    buildings = compact.CompactPoints(node=data["node"],
+                                      x=data["x"],
+                                      y=data["y"],
+                                      category=data["category"],
+                                      node_ids=job["node_ids"],
+                                      origin=data["origin"])
+    statistics = aggregates.ScoreStatistics(job["CONFIG"]["weight_factors_categories"])
+    scores = scoring.score_compact_buildings(
+        buildings, job["POIs_by_category"], job["network"], job["edges"],
+        job["model"], statistics, chunk_size=job["CONFIG"]["score_chunk_size"])
+    write_pickle(queue.result_file(job_id, chunk),
+                 {"positions": data["positions"],
+                  "scores": scores,
+                  "statistics": statistics})
+
+
+def work(CONFIG: dict, worker: str = None, exit_when_idle: bool = False):
+    """
+    Claims and scores chunks of the queue until interrupted.
+
+    Parameters
+    ----------
+    CONFIG : dict
+        Bikeability configuration, only the queue settings are used.
+    worker : str, optional
+        Name of the worker, host name and process id by default.
+    exit_when_idle : bool, optional
+        Whether to stop as soon as no chunks are left instead of waiting
+        for new jobs.
+
+    Returns
+    -------
+    None.
+
+    """
+    queue = WorkQueue(CONFIG)
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    jobs = {}
+    log.info(f"Worker {worker} started on queue {queue.path}.")
+    while True:
+        claimed = queue.claim(worker)
+        if claimed is None:
+            status = queue.status()
+            if exit_when_idle and status["pending"] == status["claimed"] == 0:
+                break
+            time.sleep(CONFIG["queue_poll_interval"])
+            continue
+
+        job_id, chunk = claimed
+        start = time.time()
+        try:
+            if job_id not in jobs:
+                # only the network of the latest job is kept
+                jobs = {job_id: load_job(queue.job_path(job_id))}
+            score_chunk(queue, jobs[job_id], job_id, chunk)
+        except Exception:
+            log.exception(f"Chunk {chunk} of job {job_id} failed.")
+            queue.fail(job_id, chunk, worker, traceback.format_exc(limit=5))
+            continue
+        queue.complete(job_id, chunk)
+        log.info(f"Scored chunk {chunk} of job {job_id} in {time.time() - start:.1f}s.")
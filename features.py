@@ -0,0 +1,155 @@
+"""
+Sources for the OSM features (buildings and POIs) of the scoring.
+
+Features are either downloaded from the Overpass API through osmnx or
+extracted from the local protobuff file of the region with pyrosm. Both
+sources return the same schema as `ox.features_from_place`, and extracts are
+kept in the on-disk cache, so later runs don't need to fetch them again.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+import geopandas as gpd
+import osmnx as ox
+import pyrosm
+from shapely.geometry import Polygon
+
+import network_cache
+from suitability import Suitability
+
+log = logging.getLogger("Bikeability")
+
+FEATURE_SOURCES = ["overpass", "pbf"]
+
+# version of the extracts, part of their cache keys, so extracts of earlier
+# versions aren't loaded
+FEATURE_VERSION = 2
+
+
+def fetch_from_overpass(CONFIG: dict, tags: dict,
+                        polygon: Polygon = None) -> gpd.GeoDataFrame:
+    """
+    Downloads the features matching the tags for the city or polygon
+    (EPSG:4326) from the Overpass API.
+    """
+    if polygon is None:
+        return ox.features_from_place(CONFIG["city"], tags)
+    return ox.features_from_polygon(polygon, tags)
+
+
+def boundary(CONFIG: dict) -> Polygon:
+    """
+    Returns the boundary of the city (EPSG:4326) from "BOUNDARY_PATH", or
+    None if no boundary file is configured.
+    """
+    if not CONFIG["boundary_path"]:
+        return None
+    return gpd.read_file(CONFIG["boundary_path"]).to_crs("EPSG:4326").unary_union
+
+
+def fetch_from_pbf(CONFIG: dict, tags: dict,
+                   polygon: Polygon = None) -> gpd.GeoDataFrame:
+    """
+    Extracts the features matching the tags from the local protobuff file of
+    the region within the polygon (EPSG:4326), by default the boundary of
+    the city. Nothing is downloaded, so it runs without network access.
+    """
+    if polygon is None:
+        # the extracts cover the surroundings of the city as well
+        polygon = boundary(CONFIG)
+    if polygon is None:
+        log.info("No boundary configured, using all features of the protobuff file.")
+    osm = pyrosm.OSM(Suitability().get_pbf_path(CONFIG, download=False),
+                     bounding_box=polygon)
+    features = osm.get_data_by_custom_criteria(
+        custom_filter=tags,
+        osm_keys_to_keep=list(tags),
+        filter_type="keep")
+    if features is None:
+        features = gpd.GeoDataFrame(columns=["id", "osm_type", "geometry"],
+                                    geometry="geometry", crs="EPSG:4326")
+
+    # same schema as osmnx: (element_type, osmid) index and one column per tag
+    features = features.rename(columns={"id": "osmid",
+                                        "osm_type": "element_type"})
+    for column in list(tags) + ["name"]:
+        if column not in features.columns:
+            features[column] = None
+    features = features.set_index(["element_type", "osmid"])
+    features = features.set_crs("EPSG:4326", allow_override=True)
+    if polygon is None:
+        return features
+    # same area as the Overpass results
+    return features[features.intersects(polygon)]
+
+
+def feature_cache_key(CONFIG: dict, tags: dict,
+                      polygon: Polygon = None) -> str:
+    """
+    Derives the cache key of an extract from its source, the tags and the
+    area. Extracts of the protobuff file also depend on its content.
+    """
+    source = CONFIG["feature_source"]
+    sections = {"source": source, "tags": tags, "version": FEATURE_VERSION}
+    sections["area"] = CONFIG["city"] if polygon is None else polygon.wkt
+    content = json.dumps(sections, sort_keys=True, default=str)
+
+    sha256 = hashlib.sha256()
+    if source == "pbf":
+        pbf_path = Suitability().get_pbf_path(CONFIG, download=False)
+        sha256.update(network_cache.hash_file(pbf_path, CONFIG["cache_path"]).encode())
+        if polygon is None and CONFIG["boundary_path"]:
+            sha256.update(network_cache.hash_file(CONFIG["boundary_path"],
+                                                  CONFIG["cache_path"]).encode())
+    sha256.update(content.encode())
+    return f"features-{sha256.hexdigest()[:32]}"
+
+
+def fetch_features(CONFIG: dict, tags: dict,
+                   polygon: Polygon = None) -> gpd.GeoDataFrame:
+    """
+    Returns the features matching the tags from the configured source,
+    using the cache if enabled.
+
+    Parameters
+    ----------
+    CONFIG : dict
+        Bikeability configuration.
+    tags : dict
+        OSM tags of the features in the format used by osmnx, e.g.
+        {"building": ["house", "apartments"], "office": True}.
+    polygon : Polygon, optional
+        Area (EPSG:4326) to fetch instead of the whole city.
+
+    Returns
+    -------
+    features : gpd.GeoDataFrame
+        Features in EPSG:4326, indexed by element type and osmid.
+
+    """
+    source = CONFIG["feature_source"]
+    if source not in FEATURE_SOURCES:
+        raise ValueError(f"Unknown feature source {source}, "
+                         f"expected one of {FEATURE_SOURCES}.")
+    fetch = fetch_from_pbf if source == "pbf" else fetch_from_overpass
+    if not CONFIG["use_cache"]:
+        return fetch(CONFIG, tags, polygon)
+
+    cache_path = CONFIG["cache_path"]
+    os.makedirs(cache_path, exist_ok=True)
+    key = feature_cache_key(CONFIG, tags, polygon)
+
+    start = time.time()
+    cached = network_cache.load_entry(cache_path, key, names=("features",))
+    if cached is not None:
+        log.info(f"Loaded features {key} from cache in {time.time() - start:.1f}s.")
+        return cached[0]
+
+    features = fetch(CONFIG, tags, polygon)
+    network_cache.store_entry(cache_path, key, features, names=("features",))
+    network_cache.evict(cache_path, CONFIG["cache_max_size"])
+    log.info(f"Stored {len(features)} features {key} in cache.")
+    return features
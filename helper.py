@@ -6,6 +6,7 @@ Created on Wed Nov 15 12:25:41 2023
 """
 
 import os
+from collections import OrderedDict
 from typing import List
 
 import geopandas as gpd
@@ -14,6 +15,29 @@ import numpy as np
 import osmnx as ox
 import pandas as pd
 
+import metrics
+
+# routes by start and end node, only valid for the network they were
+# calculated in
+_route_cache = OrderedDict()
+_route_cache_network = None
+
+def counting_weight(weight: str):
+    """
+    Returns a weight function for multigraphs that counts the relaxed edges
+    of a search. It calculates the same weights as networkx does for the
+    attribute name.
+    """
+    def weight_function(u, v, data):
+        metrics.inc("edges_relaxed_total")
+        return min(attributes.get(weight, 1) for attributes in data.values())
+    return weight_function
+
+def search_weight(weight: str):
+    if metrics.enabled():
+        return counting_weight(weight)
+    return weight
+
 def calc_shortest_path_length(
         end_node: int,
         start_node: int,
@@ -30,13 +54,15 @@ def calc_shortest_path_length(
     #     target=end_node,
     #     weight="length")
 
-    if nx.has_path(G = network, source=start_node, target=end_node):
+    metrics.inc("searches_total")
+    try:
         return nx.shortest_path_length(
             G=network,
             source=start_node,
             target=end_node,
-            weight="length_modified")
-    else:
+            weight=search_weight("length_modified"))
+    except nx.NetworkXNoPath:
+        metrics.inc("unreachable_pairs_total")
         return 99999999
 
 def calc_weight_sum(CONFIG: dict) -> int:
@@ -51,20 +77,43 @@ def calc_weight_sum(CONFIG: dict) -> int:
 def calc_shortest_path(
         end_node: int,
         start_node: int,
-        network: nx.MultiDiGraph) -> list:
+        network: nx.MultiDiGraph,
+        cache_size: int = 0) -> list:
     """
     Calculates the shortest path between two points in the network as a series
-    of nodes.
+    of nodes. Up to cache_size routes are cached, as buildings sharing a node
+    have the same routes to the POIs.
     """
+    global _route_cache_network
     end_node = int(end_node)
-    if nx.has_path(G = network, source=start_node, target=end_node):
-        return nx.shortest_path(
-            G=network,
-            source=start_node,
-            target=end_node,
-            weight="length_modified")
+    if _route_cache_network is not network:
+        _route_cache.clear()
+        _route_cache_network = network
+
+    key = (start_node, end_node)
+    if cache_size and key in _route_cache:
+        metrics.inc("route_cache_hits_total")
+        _route_cache.move_to_end(key)
+        route = _route_cache[key]
     else:
-        return []
+        metrics.inc("route_cache_misses_total")
+        metrics.inc("searches_total")
+        # a single search instead of checking the connection first
+        try:
+            route = nx.shortest_path(
+                G=network,
+                source=start_node,
+                target=end_node,
+                weight=search_weight("length_modified"))
+        except nx.NetworkXNoPath:
+            route = []
+        if cache_size:
+            _route_cache[key] = route
+            while len(_route_cache) > cache_size:
+                _route_cache.popitem(last=False)
+    if not route:
+        metrics.inc("unreachable_pairs_total")
+    return route
 
 def sigmoid(x):
     midpoint = 5000
@@ -0,0 +1,188 @@
+"""
+Timing and memory instrumentation of the calculation stages.
+
+Stages are measured with the context manager `stage`, which records wall
+time, CPU time, peak resident set size and, optionally, the number of rows
+processed. Measurements are collected in the active run report, which is
+written as json file next to the results. Without an active report, `stage`
+does nothing, so instrumented functions can be used on their own.
+"""
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import profiling
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+log = logging.getLogger("Bikeability")
+
+# interval in seconds in which the resident set size is sampled
+SAMPLE_INTERVAL = 0.05
+
+# report of the current run
+_report = None
+
+
+def peak_rss() -> int:
+    """
+    Returns the peak resident set size of the current process in bytes.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return psutil.Process().memory_info().peak_wset
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemorySampler(threading.Thread):
+    """
+    Samples the resident set size of the process in a background thread
+    and keeps the peak of every active stage up to date.
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.process = psutil.Process()
+        self.records = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def sample(self):
+        rss = self.process.memory_info().rss
+        with self.lock:
+            for record in self.records:
+                record["peak_rss"] = max(record["peak_rss"], rss)
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            self.sample()
+
+    def add(self, record: dict):
+        with self.lock:
+            self.records.append(record)
+        self.sample()
+
+    def remove(self, record: dict):
+        self.sample()
+        with self.lock:
+            self.records.remove(record)
+
+
+class RunReport():
+    """
+    Measurements of all stages of one run.
+
+    Parameters
+    ----------
+    name : str
+        Name of the run, e.g. the city.
+
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.time()
+        self.stages = []
+        self.path = []
+        self.sampler = None
+        if psutil is not None:
+            self.sampler = MemorySampler()
+            self.sampler.start()
+
+    @contextmanager
+    def stage(self, name: str, rows: int = None):
+        """
+        Measures a stage. Nested stages are named after their parents, e.g.
+        "suitability/separation". The yielded record can be used to set the
+        row count once it is known.
+        """
+        self.path.append(name)
+        record = {"stage": "/".join(self.path),
+                  "rows": rows,
+                  "peak_rss": 0}
+        self.stages.append(record)
+        if self.sampler is not None:
+            self.sampler.add(record)
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            with profiling.profile(record["stage"]):
+                yield record
+        finally:
+            record["wall_time"] = time.perf_counter() - start
+            record["cpu_time"] = time.process_time() - cpu_start
+            if self.sampler is not None:
+                self.sampler.remove(record)
+            else:
+                # peak of the whole process so far
+                record["peak_rss"] = peak_rss()
+            self.path.pop()
+            log.info(f"Stage {record['stage']} took {record['wall_time']:.1f}s, "
+                     f"peak memory {record['peak_rss'] / 1024**2:.0f} MiB.")
+
+    def to_dict(self) -> dict:
+        return {"name": self.name,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S",
+                                         time.localtime(self.started)),
+                "wall_time": time.time() - self.started,
+                "peak_rss": peak_rss(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "stages": self.stages}
+
+    def close(self):
+        if self.sampler is not None:
+            self.sampler.stopped.set()
+            self.sampler.join()
+
+
+def start_report(name: str) -> RunReport:
+    """
+    Starts a new run report, which collects the measurements of all
+    following stages.
+    """
+    global _report
+    if _report is not None:
+        _report.close()
+    _report = RunReport(name)
+    return _report
+
+
+@contextmanager
+def stage(name: str, rows: int = None):
+    """
+    Measures a stage in the active run report.
+    """
+    if _report is None:
+        with profiling.profile(name):
+            yield {}
+        return
+    with _report.stage(name, rows) as record:
+        yield record
+
+
+def write_report(CONFIG: dict) -> dict:
+    """
+    Writes the active run report to "EXPORT_PATH/run_report.json" and
+    closes it.
+    """
+    global _report
+    if _report is None:
+        return None
+    content = _report.to_dict()
+    _report.close()
+    _report = None
+    os.makedirs(CONFIG["export_path"], exist_ok=True)
+    with open(f"{CONFIG['export_path']}/run_report.json", "w") as file:
+        json.dump(content, file, indent=2)
+    return content
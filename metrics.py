@@ -0,0 +1,159 @@
+"""
+Counters and gauges of the scoring, exported in the Prometheus text format.
+
+The counters are updated from the scoring loop and the routing in `helper`
+and are written periodically by a background thread to
+"METRICS_PATH/bikeability_<pid>.prom", where the textfile collector of the
+Prometheus node exporter can pick them up. Every process writes its own file,
+so parallel batch jobs, tiles and the workers of point scoring and the
+service don't overwrite each other's metrics. The series of a process carry
+its pid as label, so processes scoring the same city don't export duplicate
+series, and its file is removed when it stops. Files left behind by crashed
+processes are removed by the next process starting in the same directory.
+"""
+import logging
+import multiprocessing.util
+import os
+import re
+import threading
+import time
+
+log = logging.getLogger("Bikeability")
+
+# name, type and help text of all metrics
+METRICS = {
+    "buildings_scored_total": ("counter", "Buildings scored."),
+    "buildings_to_score": ("gauge", "Buildings of the current run."),
+    "buildings_per_second": ("gauge", "Buildings scored per second in the last interval."),
+    "searches_total": ("counter", "Shortest path searches run."),
+    "edges_relaxed_total": ("counter", "Edges relaxed by shortest path searches, as work measure instead of settled nodes, which networkx doesn't expose; only counted while metrics are written."),
+    "route_cache_hits_total": ("counter", "Routes found in the route cache."),
+    "route_cache_misses_total": ("counter", "Routes not found in the route cache."),
+    "unreachable_pairs_total": ("counter", "Building and POI pairs without a route."),
+    "last_update_timestamp_seconds": ("gauge", "Time of the last update of this file.")}
+
+_values = dict.fromkeys(METRICS, 0)
+_labels = {}
+_writer = None
+
+
+def inc(name: str, value: int = 1):
+    _values[name] += value
+
+
+def set_gauge(name: str, value: float):
+    _values[name] = value
+
+
+def enabled() -> bool:
+    """
+    Returns whether this process writes metrics. Writers inherited from the
+    parent process by forking don't count.
+    """
+    return _writer is not None and _writer.pid == os.getpid()
+
+
+def render() -> str:
+    """
+    Renders all metrics in the Prometheus text format.
+    """
+    labels = ",".join(f'{key}="{value}"' for key, value in _labels.items())
+    lines = []
+    for name, (metric_type, description) in METRICS.items():
+        lines.append(f"# HELP bikeability_{name} {description}")
+        lines.append(f"# TYPE bikeability_{name} {metric_type}")
+        lines.append(f"bikeability_{name}{{{labels}}} {_values[name]}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsWriter(threading.Thread):
+    """
+    Writes the metrics to a textfile in a fixed interval.
+    """
+    def __init__(self, path: str, interval: float):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.pid = os.getpid()
+        self.last_count = _values["buildings_scored_total"]
+        self.last_time = time.monotonic()
+
+    def write(self):
+        now = time.monotonic()
+        count = _values["buildings_scored_total"]
+        set_gauge("buildings_per_second",
+                  (count - self.last_count) / max(now - self.last_time, 1e-9))
+        set_gauge("last_update_timestamp_seconds", time.time())
+        self.last_count, self.last_time = count, now
+
+        # written under a temporary name, so the collector never reads a partial file
+        with open(f"{self.path}.tmp", "w") as file:
+            file.write(render())
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+
+def remove_stale(metrics_path: str):
+    """
+    Removes the files of processes that ended without stopping their
+    metrics, so their counters aren't scraped anymore.
+    """
+    for entry in os.scandir(metrics_path):
+        match = re.fullmatch(r"bikeability_(\d+)\.prom", entry.name)
+        if match is None or int(match.group(1)) == os.getpid():
+            continue
+        try:
+            os.kill(int(match.group(1)), 0)
+        except ProcessLookupError:
+            os.remove(entry.path)
+        except PermissionError:
+            # the process runs under another user
+            pass
+
+
+def start(CONFIG: dict):
+    """
+    Starts writing the metrics of this process if "METRICS_PATH" is set.
+    """
+    global _writer
+    if not CONFIG["metrics_path"] or enabled():
+        return
+    if _writer is not None:
+        # counters inherited from the parent process by forking
+        _values.update(dict.fromkeys(METRICS, 0))
+    os.makedirs(CONFIG["metrics_path"], exist_ok=True)
+    remove_stale(CONFIG["metrics_path"])
+    _labels["city"] = CONFIG["city"].replace('"', "")
+    _labels["pid"] = str(os.getpid())
+    path = f"{CONFIG['metrics_path']}/bikeability_{os.getpid()}.prom"
+    _writer = MetricsWriter(path, CONFIG["metrics_interval"])
+    _writer.start()
+    log.info(f"Writing metrics to {path}.")
+
+
+def start_worker(CONFIG: dict):
+    """
+    Starts writing the metrics of a worker process of a process pool. The
+    file is removed when the worker exits.
+    """
+    start(CONFIG)
+    multiprocessing.util.Finalize(None, stop, exitpriority=0)
+
+
+def stop():
+    """
+    Stops writing the metrics and removes the file of this process, so the
+    counters of finished processes aren't scraped anymore.
+    """
+    global _writer
+    if not enabled():
+        return
+    _writer.stopped.set()
+    _writer.join()
+    if os.path.isfile(_writer.path):
+        os.remove(_writer.path)
+    _writer = None
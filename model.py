@@ -0,0 +1,141 @@
+"""
+Compiled scoring model.
+
+The scoring configuration (POI categories and their weight factors) is
+compiled once per run into an immutable object with numeric lookups, which
+is passed to the scoring functions instead of rereading the configuration
+for every building.
+"""
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import numpy as np
+import pandas as pd
+
+import compact
+import helper
+
+# category of POIs that don't belong to any category of the model
+NO_CATEGORY = "none"
+
+
+@dataclass(frozen=True)
+class ScoringModel():
+    """
+    Immutable form of the scoring configuration.
+
+    Attributes
+    ----------
+    categories : tuple
+        Names of the POI categories, their position is their code.
+    type_codes : MappingProxyType
+        Category code of each POI type.
+    weights : np.ndarray
+        Weight factors of each category (rows), padded with zeros to the
+        largest number of factors of a category.
+    weight_counts : np.ndarray
+        Number of weight factors of each category.
+    weight_sum : float
+        Sum of all weight factors, used to scale the scores from 0 to 1.
+    required_POIs : int
+        Number of nearest POIs of a category that are routed to.
+    building_types : tuple
+        Residential building types, their position is their code.
+    route_cache_size : int
+        Number of routes kept in the route cache of each process.
+
+    """
+    categories: tuple
+    type_codes: MappingProxyType
+    weights: np.ndarray
+    weight_counts: np.ndarray
+    weight_sum: float
+    required_POIs: int = 10
+    building_types: tuple = ()
+    route_cache_size: int = 0
+
+    def categorise(self, POI_types: pd.Series) -> np.ndarray:
+        """
+        Returns the category code of each POI type, -1 for types without
+        category.
+        """
+        return POI_types.map(dict(self.type_codes)).fillna(-1).to_numpy(dtype=np.int64)
+
+    def category_names(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Returns the category name of each code, NO_CATEGORY for -1.
+        """
+        names = np.array(self.categories + (NO_CATEGORY,), dtype=object)
+        return names[codes]
+
+    def building_codes(self, building_types: pd.Series) -> np.ndarray:
+        """
+        Returns the code of each building type, -1 for types that aren't
+        residential.
+        """
+        return pd.Categorical(building_types, categories=self.building_types) \
+            .codes.astype(np.int64)
+
+    def building_type_names(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Returns the building type of each code, NO_CATEGORY for codes of
+        other types.
+        """
+        names = np.array(self.building_types + (NO_CATEGORY,), dtype=object)
+        return names[np.minimum(codes, len(self.building_types))]
+
+    def split_POIs(self, POIs: pd.DataFrame, node_ids: np.ndarray) -> tuple:
+        """
+        Splits the POIs by category once and converts them into compact
+        points, so the POIs of a category don't have to be selected again
+        for every building.
+
+        Returns
+        -------
+        POIs_by_category : tuple
+            Compact POIs of each category, in the order of the categories.
+
+        """
+        codes = self.categorise(POIs.POI_type)
+        points = compact.compact_points(POIs, node_ids, codes)
+        return tuple(points.take(np.flatnonzero(codes == code))
+                     for code in range(len(self.categories)))
+
+
+def compile_model(CONFIG: dict) -> ScoringModel:
+    """
+    Compiles the scoring configuration into a ScoringModel.
+
+    Parameters
+    ----------
+    CONFIG : dict
+        Bikeability configuration.
+
+    Returns
+    -------
+    model : ScoringModel
+        The compiled model.
+
+    """
+    categories = tuple(CONFIG["weight_factors_categories"])
+    type_codes = {}
+    # a type listed in several categories belongs to the last one
+    for code, category in enumerate(categories):
+        for POI_type in CONFIG["weight_factors_categories"][category]:
+            type_codes[POI_type] = code
+
+    factors = [CONFIG["model_weight_factors"][category] for category in categories]
+    weight_counts = np.array([len(factor) for factor in factors], dtype=np.int64)
+    weights = np.zeros((len(categories), weight_counts.max(initial=0)))
+    for code, factor in enumerate(factors):
+        weights[code, :len(factor)] = factor
+    weights.setflags(write=False)
+    weight_counts.setflags(write=False)
+
+    return ScoringModel(categories=categories,
+                        type_codes=MappingProxyType(type_codes),
+                        weights=weights,
+                        weight_counts=weight_counts,
+                        weight_sum=float(helper.calc_weight_sum(CONFIG)),
+                        building_types=tuple(CONFIG["residential_building_types"]),
+                        route_cache_size=CONFIG["route_cache_size"])
@@ -0,0 +1,219 @@
+"""
+On-disk cache for the scored suitability network.
+
+Entries are stored under a key derived from the content of the protobuff file
+and the configuration sections that influence the suitability scores, so a
+changed input automatically leads to a new entry. The cache is limited in
+size by removing the least recently used entries.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+
+from shapely.geometry import Polygon
+
+from suitability import Suitability
+
+log = logging.getLogger("Bikeability")
+
+# configuration sections that change the scored network
+KEY_SECTIONS = ["city", "factor_weights", "translation_factors",
+                "default_scores", "ignored_types", "use_accidents",
+                "accident_path", "accident_years"]
+
+# files of the suitability network entries
+ENTRY_FILES = ("edges", "network")
+
+
+def hash_file(path: str, cache_path: str) -> str:
+    """
+    Calculates the sha256 hash of a file. The hash is stored in the cache
+    directory, as the directory of the file may be read-only, and only
+    recalculated if size or modification time of the file change.
+    """
+    stat = os.stat(path)
+    signature = f"{stat.st_size}-{stat.st_mtime_ns}"
+    path_hash = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:32]
+    os.makedirs(f"{cache_path}/hashes", exist_ok=True)
+    hash_path = f"{cache_path}/hashes/{path_hash}.sha256"
+    if os.path.isfile(hash_path):
+        with open(hash_path) as file:
+            stored_signature, stored_hash = file.read().split()
+        if stored_signature == signature:
+            return stored_hash
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(2**20), b""):
+            sha256.update(block)
+    file_hash = sha256.hexdigest()
+
+    # written under a temporary name, so parallel processes never read a
+    # partial hash
+    with open(f"{hash_path}.tmp{os.getpid()}", "w") as file:
+        file.write(f"{signature} {file_hash}")
+    os.replace(f"{hash_path}.tmp{os.getpid()}", hash_path)
+    return file_hash
+
+
+def cache_key(CONFIG: dict, pbf_path: str, polygon: Polygon = None) -> str:
+    """
+    Derives the cache key from the protobuff file, the relevant configuration
+    sections and the evaluated area.
+    """
+    sections = {section: CONFIG[section] for section in KEY_SECTIONS}
+    if polygon is not None:
+        sections["polygon"] = polygon.wkt
+    content = json.dumps(sections, sort_keys=True, default=str)
+
+    sha256 = hashlib.sha256()
+    sha256.update(hash_file(pbf_path, CONFIG["cache_path"]).encode())
+    sha256.update(content.encode())
+    return sha256.hexdigest()[:32]
+
+
+def load_entry(cache_path: str, key: str, names: tuple = ENTRY_FILES):
+    """
+    Loads the objects of a cache entry, by default edges and network.
+    Returns None if the entry doesn't exist.
+    """
+    entry_path = f"{cache_path}/{key}"
+    if not os.path.isdir(entry_path):
+        return None
+    objects = []
+    for name in names:
+        with open(f"{entry_path}/{name}.pkl", "rb") as file:
+            objects.append(pickle.load(file))
+    # mark the entry as recently used
+    os.utime(entry_path)
+    return tuple(objects)
+
+
+def store_entry(cache_path: str, key: str, *objects, names: tuple = ENTRY_FILES):
+    """
+    Writes objects, by default edges and network, to a new cache entry. The
+    entry is written to a temporary directory first, so no incomplete
+    entries are left behind.
+    """
+    entry_path = f"{cache_path}/{key}"
+    tmp_path = f"{entry_path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name, obj in zip(names, objects, strict=True):
+        with open(f"{tmp_path}/{name}.pkl", "wb") as file:
+            pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+    try:
+        os.replace(tmp_path, entry_path)
+    except OSError:
+        # another process stored the same entry in the meantime
+        if not os.path.isdir(entry_path):
+            raise
+        shutil.rmtree(tmp_path)
+
+
+def pin_entry(cache_path: str, key: str, owner: str):
+    """
+    Protects an entry from eviction until it is unpinned by the owner, e.g.
+    while workers on other machines load it.
+    """
+    open(f"{cache_path}/{key}/{owner}.pin", "w").close()
+
+
+def unpin_entry(cache_path: str, key: str, owner: str):
+    pin_path = f"{cache_path}/{key}/{owner}.pin"
+    if os.path.isfile(pin_path):
+        os.remove(pin_path)
+
+
+def is_pinned(entry_path: str) -> bool:
+    return any(entry.name.endswith(".pin") for entry in os.scandir(entry_path))
+
+
+def entry_size(entry_path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(entry_path))
+
+
+def evict(cache_path: str, max_size: int):
+    """
+    Removes the least recently used entries until the cache is smaller than
+    the given size in bytes.
+    """
+    entries = [entry.path for entry in os.scandir(cache_path)
+               if entry.is_dir() and ".tmp" not in entry.name
+               and entry.name != "hashes"]
+    entries.sort(key=os.path.getmtime)
+    # pinned entries are kept, but count towards the size
+    pinned = [entry for entry in entries if is_pinned(entry)]
+    sizes = {entry: entry_size(entry) for entry in entries}
+    total_size = sum(sizes.values())
+    # the most recently used entry is always kept
+    for entry in entries[:-1]:
+        if entry in pinned:
+            continue
+        if total_size <= max_size:
+            break
+        shutil.rmtree(entry)
+        total_size -= sizes[entry]
+        log.info(f"Removed cache entry {entry}.")
+
+
+def invalidate(CONFIG: dict, polygon: Polygon = None):
+    """
+    Removes the cache entry belonging to the current configuration.
+    """
+    pbf_path = Suitability().get_pbf_path(CONFIG)
+    entry_path = f"{CONFIG['cache_path']}/{cache_key(CONFIG, pbf_path, polygon)}"
+    if os.path.isdir(entry_path):
+        shutil.rmtree(entry_path)
+
+
+def clear(CONFIG: dict):
+    """
+    Removes all cache entries.
+    """
+    if os.path.isdir(CONFIG["cache_path"]):
+        shutil.rmtree(CONFIG["cache_path"])
+
+
+def eval_suitability_cached(CONFIG: dict, polygon: Polygon = None):
+    """
+    Returns the scored edges and network for the configuration, either from
+    the cache or by evaluating the suitability and caching the result.
+
+    Parameters
+    ----------
+    CONFIG : dict
+        Bikeability configuration.
+    polygon : Polygon, optional
+        Area (EPSG:4326) to evaluate instead of the whole city.
+
+    Returns
+    -------
+    edges : gpd.GeoDataFrame
+        List of edges in the network with corresponding suitability scores.
+    network : nx.MultiDiGraph
+        Road network with added suitability metadata.
+
+    """
+    suitability = Suitability()
+    if not CONFIG["use_cache"]:
+        return suitability.eval_suitability(CONFIG, polygon)
+
+    cache_path = CONFIG["cache_path"]
+    os.makedirs(cache_path, exist_ok=True)
+    key = cache_key(CONFIG, suitability.get_pbf_path(CONFIG), polygon)
+
+    start = time.time()
+    cached = load_entry(cache_path, key)
+    if cached is not None:
+        log.info(f"Loaded suitability network {key} from cache in {time.time() - start:.1f}s.")
+        return cached
+
+    edges, network = suitability.eval_suitability(CONFIG, polygon)
+    store_entry(cache_path, key, edges, network)
+    evict(cache_path, CONFIG["cache_max_size"])
+    log.info(f"Stored suitability network {key} in cache.")
+    return edges, network
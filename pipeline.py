@@ -0,0 +1,236 @@
+"""
+Checkpointed stages of the bikeability calculation.
+
+The outputs of every stage are written to "CHECKPOINT_PATH" under a key
+derived from the configuration sections the stage depends on and the keys
+of its input stages. A rerun with unchanged inputs loads the checkpoint
+instead of running the stage again, and building scoring resumes from the
+last finished chunk.
+"""
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+
+import aggregates
+import compact
+import instrumentation
+import network_cache
+import scoring
+from model import compile_model
+from suitability import Suitability
+
+log = logging.getLogger("Bikeability")
+
+# version of the contents of the checkpoints, part of every stage key, so
+# checkpoints of earlier versions aren't loaded
+CHECKPOINT_VERSION = 3
+
+# configuration sections the outputs of each stage depend on
+STAGE_SECTIONS = {
+    "suitability": network_cache.KEY_SECTIONS,
+    "buildings": ["city", "residential_building_types", "feature_source",
+                  "boundary_path"],
+    "POIs": ["city", "pois_model", "weight_factors_categories",
+             "feature_source", "boundary_path"],
+    "scores": ["weight_factors_categories", "model_weight_factors",
+               "score_chunk_size"]}
+
+
+class Pipeline():
+    """
+    Runs named stages and stores their outputs as checkpoints.
+
+    Parameters
+    ----------
+    CONFIG : dict
+        Bikeability configuration.
+
+    """
+    def __init__(self, CONFIG: dict):
+        self.CONFIG = CONFIG
+        self.path = CONFIG["checkpoint_path"]
+        self.enabled = CONFIG["use_checkpoints"]
+        self.keys = {}
+
+    def stage_key(self, name: str, inputs: list) -> str:
+        """
+        Derives the key of a stage from its configuration sections, the
+        protobuff file and the keys of its input stages.
+        """
+        sections = {section: self.CONFIG[section]
+                    for section in STAGE_SECTIONS.get(name, [])}
+        sections["inputs"] = [self.keys[stage] for stage in inputs]
+        sections["version"] = CHECKPOINT_VERSION
+        content = json.dumps(sections, sort_keys=True, default=str)
+
+        sha256 = hashlib.sha256()
+        if not inputs:
+            pbf_path = Suitability().get_pbf_path(self.CONFIG)
+            sha256.update(network_cache.hash_file(pbf_path, self.CONFIG["cache_path"]).encode())
+        sha256.update(name.encode())
+        sha256.update(content.encode())
+        return sha256.hexdigest()[:32]
+
+    def checkpoint_file(self, name: str) -> str:
+        return f"{self.path}/{name}-{self.keys[name]}.pkl"
+
+    def chunk_path(self, name: str) -> str:
+        """
+        Returns the directory for partial results of a running stage or None
+        if checkpoints are disabled.
+        """
+        if not self.enabled:
+            return None
+        return f"{self.path}/{name}-{self.keys[name]}-chunks"
+
+    def run(self, name: str, func, inputs: list = [], checkpoint: bool = True):
+        """
+        Runs a stage or loads its outputs from an existing checkpoint.
+
+        Parameters
+        ----------
+        name : str
+            Name of the stage.
+        func : callable
+            Function without arguments calculating the outputs of the stage.
+        inputs : list, optional
+            Names of the stages whose outputs are used by this stage.
+        checkpoint : bool, optional
+            Whether the outputs are written to a checkpoint.
+
+        Returns
+        -------
+        outputs
+            The outputs of the stage.
+
+        """
+        self.keys[name] = self.stage_key(name, inputs)
+        path = self.checkpoint_file(name)
+        checkpoint = checkpoint and self.enabled
+        loaded = checkpoint and os.path.isfile(path)
+        with instrumentation.stage(name) as record:
+            if loaded:
+                with open(path, "rb") as file:
+                    outputs = pickle.load(file)
+                log.info(f"Loaded stage {name} from checkpoint {path}.")
+            else:
+                start = time.time()
+                outputs = func()
+                log.info(f"Finished stage {name} in {time.time() - start:.1f}s.")
+            record["checkpoint"] = loaded
+            record["rows"] = len(outputs[0] if isinstance(outputs, tuple)
+                                 else outputs)
+        if checkpoint and not loaded:
+            os.makedirs(self.path, exist_ok=True)
+            with open(f"{path}.tmp", "wb") as file:
+                pickle.dump(outputs, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{path}.tmp", path)
+            # partial results aren't needed once the stage is complete
+            if os.path.isdir(self.chunk_path(name)):
+                shutil.rmtree(self.chunk_path(name))
+        return outputs
+
+    def load(self, name: str):
+        """
+        Loads the outputs of a stage that was already run from its
+        checkpoint.
+        """
+        with open(self.checkpoint_file(name), "rb") as file:
+            return pickle.load(file)
+
+
+def clear_checkpoints(CONFIG: dict):
+    """
+    Removes all checkpoints.
+    """
+    if os.path.isdir(CONFIG["checkpoint_path"]):
+        shutil.rmtree(CONFIG["checkpoint_path"])
+
+
+def run_pipeline(CONFIG: dict, executor=None, score_function=None) -> dict:
+    """
+    Runs the stages of the bikeability calculation for the configured city:
+    suitability, buildings, POIs and scores. Visualisation of the
+    suitability is submitted to the executor as soon as it is available.
+
+    Parameters
+    ----------
+    CONFIG : dict
+        Bikeability configuration.
+    executor : Executor, optional
+        Executor for the suitability visualisation.
+    score_function : callable, optional
+        Function scoring the compact buildings with the arguments of
+        scoring.score_compact_buildings, which is used by default.
+
+    Returns
+    -------
+    results : dict
+        Edges, network, scored buildings, POIs, score statistics and the
+        futures of submitted outputs.
+
+    """
+    pipeline = Pipeline(CONFIG)
+    model = compile_model(CONFIG)
+    score_function = score_function or scoring.score_compact_buildings
+    outputs = {}
+
+    # the network cache already keeps the suitability network
+    edges, network = pipeline.run(
+        "suitability",
+        lambda: network_cache.eval_suitability_cached(CONFIG),
+        checkpoint=not CONFIG["use_cache"])
+    log.info("Suitability network completed. Loading buildings... ")
+    if CONFIG["visualize"] and executor is not None:
+        import visualisation
+        outputs["suitability visualisation"] = executor.submit(
+            visualisation.create_suitability_visualisation, edges,
+            CONFIG["export_path"])
+
+    residential_buildings = pipeline.run(
+        "buildings",
+        lambda: scoring.fetch_and_filter_residences(city=CONFIG["city"],
+                                                    network=network,
+                                                    CONFIG=CONFIG),
+        inputs=["suitability"])
+    log.info("Buildings loaded. Loading POIs... ")
+
+    POIs = pipeline.run(
+        "POIs",
+        lambda: scoring.fetch_POIs(CONFIG=CONFIG, network=network, model=model),
+        inputs=["suitability"])
+    log.info("Points of interest (POIs) loaded. Calculating scores... ")
+
+    # only the compact buildings are kept while scoring, the buildings with
+    # their geometries are reloaded from the checkpoint for the export
+    node_ids = compact.node_table(network)
+    buildings = compact.compact_points(
+        residential_buildings, node_ids,
+        model.building_codes(residential_buildings["building"]))
+    if pipeline.enabled:
+        del residential_buildings
+
+    def score():
+        statistics = aggregates.ScoreStatistics(CONFIG["weight_factors_categories"])
+        scores = score_function(
+            buildings, model.split_POIs(POIs, node_ids), network, edges, model,
+            statistics, checkpoint_path=pipeline.chunk_path("scores"),
+            chunk_size=CONFIG["score_chunk_size"])
+        return scores, statistics
+
+    scores, statistics = pipeline.run(
+        "scores", score, inputs=["suitability", "buildings", "POIs"])
+    if pipeline.enabled:
+        residential_buildings = pipeline.load("buildings")
+    buildings_scored = scoring.join_scores(residential_buildings, scores)
+
+    return {"edges": edges,
+            "network": network,
+            "buildings": buildings_scored,
+            "POIs": POIs,
+            "statistics": statistics,
+            "outputs": outputs}
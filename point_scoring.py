@@ -0,0 +1,263 @@
+"""
+Scoring of arbitrary points, e.g. development sites, address registers or
+survey locations, without fetching buildings.
+
+Every point is snapped to the nearest node of the suitability network and
+scored like a building located at that node. Points are snapped in bulk and
+every node is scored only once, however many points snap to it. The nodes
+are scored in batches of "SCORE_CHUNK_SIZE" in parallel processes.
+
+Usage: python cli.py points points.csv [--output scored.parquet]
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+from tqdm import tqdm
+
+import compact
+import metrics
+import network_cache
+import scoring
+from model import compile_model
+from pipeline import Pipeline
+
+log = logging.getLogger("Bikeability")
+
+# profiles loaded in this process, by name
+_profiles = {}
+
+
+def load_profile(config: dict) -> dict:
+    """
+    Loads the suitability network and POIs of a profile from the cache and
+    checkpoints, or calculates them, and prepares them for scoring single
+    nodes.
+
+    Returns
+    -------
+    profile : dict
+        Network, edges, compiled model, POIs by category, a search tree
+        of the node coordinates and the maximum snapping distance.
+
+    """
+    pipeline = Pipeline(config)
+    edges, network = pipeline.run(
+        "suitability",
+        lambda: network_cache.eval_suitability_cached(config),
+        checkpoint=not config["use_cache"])
+    model = compile_model(config)
+    POIs = pipeline.run(
+        "POIs",
+        lambda: scoring.fetch_POIs(CONFIG=config, network=network, model=model),
+        inputs=["suitability"])
+
+    nodes = compact.node_table(network)
+    coordinates = np.array([[network.nodes[node]["x"], network.nodes[node]["y"]]
+                            for node in nodes])
+    # bounds of the network as longitude and latitude
+    lon, lat = Transformer.from_crs("EPSG:25832", "EPSG:4326", always_xy=True) \
+        .transform(coordinates[:, 0], coordinates[:, 1])
+    return {"network": network,
+            "edges": edges,
+            "model": model,
+            "POIs_by_category": model.split_POIs(POIs, nodes),
+            "nodes": nodes,
+            "tree": cKDTree(coordinates),
+            "max_snap_distance": config["max_snap_distance"],
+            "bounds": [float(lon.min()), float(lat.min()),
+                       float(lon.max()), float(lat.max())]}
+
+
+def init_worker(configs: dict):
+    """
+    Loads all profiles in a worker process. Workers started by forking
+    inherit the profiles of the parent process and skip loading. Every
+    worker writes its own metrics.
+    """
+    for name, config in configs.items():
+        if name not in _profiles:
+            _profiles[name] = load_profile(config)
+    # metrics are configured by the first profile
+    metrics.start_worker(next(iter(configs.values())))
+
+
+def snap(profile: str, x: np.ndarray, y: np.ndarray) -> tuple:
+    """
+    Snaps points in EPSG:25832 to the nearest nodes of a loaded profile.
+
+    Returns
+    -------
+    nodes : np.ndarray
+        Nearest node of each point.
+    distances : np.ndarray
+        Distance of each point to its node.
+
+    """
+    data = _profiles[profile]
+    distances, indices = data["tree"].query(np.column_stack([x, y]))
+    return data["nodes"][indices], distances
+
+
+def snap_points(profile: str, x: np.ndarray, y: np.ndarray) -> tuple:
+    """
+    Snaps the points with coordinates to the nearest nodes of a loaded
+    profile.
+
+    Returns
+    -------
+    nodes : np.ndarray
+        Nearest node of each point, -1 for points without coordinates.
+    distances : np.ndarray
+        Distance of each point to its node, NaN for points without
+        coordinates.
+    located : np.ndarray
+        Mask of the points with coordinates.
+    near : np.ndarray
+        Mask of the points within "MAX_SNAP_DISTANCE" of their node, which
+        are scored.
+
+    """
+    located = np.isfinite(x) & np.isfinite(y)
+    nodes = np.full(len(x), -1, dtype=np.int64)
+    distances = np.full(len(x), np.nan)
+    if located.any():
+        nodes[located], distances[located] = snap(profile, x[located], y[located])
+    near = located & (distances <= _profiles[profile]["max_snap_distance"])
+    return nodes, distances, located, near
+
+
+def score_nodes(profile: str, nodes: list) -> list:
+    """
+    Scores a building located at each of the nodes. Runs in the worker
+    processes.
+
+    Returns
+    -------
+    results : list
+        Score and scores by category of each node, scaled from 0 to 1.
+
+    """
+    data = _profiles[profile]
+    network = data["network"]
+    model = data["model"]
+    results = []
+    for node in nodes:
+        category_scores = scoring.score_building_categories(
+            node, network.nodes[node]["x"], network.nodes[node]["y"],
+            data["POIs_by_category"], network, data["edges"], model)
+        category_scores = category_scores / model.weight_sum
+        results.append({"score": float(category_scores.sum()),
+                        "categories": dict(zip(model.categories,
+                                               category_scores.tolist()))})
+    return results
+
+
+def read_points(path: str,
+                x_column: str = "lon",
+                y_column: str = "lat",
+                crs: str = "EPSG:4326") -> gpd.GeoDataFrame:
+    """
+    Reads points from a CSV or Parquet file. Files with geometries
+    (GeoParquet) use the centroids of their geometries, all other files
+    the coordinate columns in the given coordinate reference system.
+    """
+    if path.endswith(".parquet"):
+        try:
+            return gpd.read_parquet(path)
+        except ValueError:
+            # plain Parquet without geometry column
+            points = pd.read_parquet(path)
+    else:
+        points = pd.read_csv(path)
+    return gpd.GeoDataFrame(
+        points,
+        geometry=gpd.points_from_xy(points[x_column], points[y_column]),
+        crs=crs)
+
+
+def score_points(points: gpd.GeoDataFrame,
+                 CONFIG: dict,
+                 workers: int = None) -> gpd.GeoDataFrame:
+    """
+    Calculates scores for arbitrary points.
+
+    Parameters
+    ----------
+    points : gpd.GeoDataFrame
+        Points to score, other geometries are scored at their centroid.
+    CONFIG : dict
+        Bikeability configuration.
+    workers : int, optional
+        Number of processes scoring nodes, None uses all cores.
+
+    Returns
+    -------
+    points_scored : gpd.GeoDataFrame
+        The points with their node, the distance to it, the score and the
+        scores by POI category. Points without coordinates have no node,
+        and points farther than "MAX_SNAP_DISTANCE" from their node have no
+        scores.
+
+    """
+    profile = "points"
+    _profiles[profile] = load_profile(CONFIG)
+    model = _profiles[profile]["model"]
+
+    centroids = points.geometry.to_crs("EPSG:25832").centroid
+    x, y = centroids.x.to_numpy(), centroids.y.to_numpy()
+    # missing and empty geometries have no coordinates
+    nodes, distances, located, near = snap_points(profile, x, y)
+    if not located.all():
+        log.warning(f"{(~located).sum()} points without coordinates aren't scored.")
+    if (located & ~near).any():
+        log.warning(f"{(located & ~near).sum()} points farther than "
+                    f"{CONFIG['max_snap_distance']}m from the network aren't scored.")
+    unique_nodes = np.unique(nodes[near])
+    log.info(f"{near.sum()} points snapped to {len(unique_nodes)} nodes.")
+
+    chunk_size = CONFIG["score_chunk_size"]
+    batches = [unique_nodes[start:start + chunk_size].tolist()
+               for start in range(0, len(unique_nodes), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=({profile: CONFIG},)) as executor, \
+            tqdm(total=len(unique_nodes)) as progress:
+        for batch in executor.map(score_nodes, repeat(profile), batches):
+            results.extend(batch)
+            progress.update(len(batch))
+
+    node_scores = pd.DataFrame(
+        [[result["score"], *result["categories"].values()] for result in results],
+        index=unique_nodes,
+        columns=["score", *(f"score_{category}" for category in model.categories)])
+    points_scored = points.copy()
+    points_scored["node"] = pd.array(np.where(located, nodes, None), dtype="Int64")
+    points_scored["snap_distance"] = distances
+    # points that aren't scored get no scores
+    scores = node_scores.reindex(np.where(near, nodes, -1))
+    for column in scores.columns:
+        points_scored[column] = scores[column].to_numpy()
+    return points_scored
+
+
+def write_points(points: gpd.GeoDataFrame, path: str):
+    """
+    Writes scored points as GeoParquet or, for ".csv" paths, as CSV with
+    the coordinates in EPSG:4326.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if path.endswith(".csv"):
+        geometry = points.geometry.to_crs("EPSG:25832").centroid.to_crs("EPSG:4326")
+        table = pd.DataFrame(points.drop(columns=points.geometry.name))
+        table["lon"], table["lat"] = geometry.x, geometry.y
+        table.to_csv(path, index=False)
+    else:
+        points.to_parquet(path)
@@ -0,0 +1,262 @@
+"""
+Opt-in profiling of selected stages and of the scoring of single buildings.
+
+Profiling is enabled with "PROFILE_MODE" and applies to the stages listed in
+"PROFILE_STAGES". Stages are the instrumented stages of the run report, e.g.
+"scores" or "suitability/separation", and "score_building", which profiles
+every call of the per-building scoring. Three profilers are available:
+
+- "cprofile": deterministic profiling of all function calls,
+- "sampling": samples the call stack of the main thread in a fixed interval,
+  with a far smaller overhead than cprofile,
+- "tracemalloc": traces memory allocations.
+
+The profile of every stage is written to "PROFILE_PATH", and the top
+functions by cumulative time or allocated memory are appended to
+"PROFILE_PATH/summary.txt".
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+log = logging.getLogger("Bikeability")
+
+PROFILE_MODES = ["cprofile", "sampling", "tracemalloc"]
+
+# interval in seconds in which the sampling profiler records the call stack
+SAMPLE_INTERVAL = 0.005
+
+# profiling settings of the current run
+_settings = {"mode": None, "stages": [], "path": "profiles", "top": 20}
+# stage currently profiled, profilers can't be nested
+_active = None
+
+
+def configure(CONFIG: dict):
+    """
+    Applies the profiling settings of the configuration to the following
+    stages.
+    """
+    mode = CONFIG["profile_mode"]
+    if mode is not None and mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode {mode}, "
+                         f"expected one of {PROFILE_MODES}.")
+    _settings.update(mode=mode,
+                     stages=list(CONFIG["profile_stages"]),
+                     path=CONFIG["profile_path"],
+                     top=CONFIG["profile_top"])
+
+
+def is_profiled(stage: str) -> bool:
+    """
+    Checks whether a stage is profiled, either by its full name or by the
+    name without parents.
+    """
+    if _settings["mode"] is None:
+        return False
+    if stage not in _settings["stages"] and \
+            stage.split("/")[-1] not in _settings["stages"]:
+        return False
+    if _active is not None:
+        log.warning(f"{stage} isn't profiled, as it is part of the profiled stage {_active}.")
+        return False
+    return True
+
+
+@contextmanager
+def activate(stage: str):
+    global _active
+    _active = stage
+    try:
+        yield
+    finally:
+        _active = None
+
+
+class DeterministicProfiler():
+    suffix = "prof"
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+
+    def resume(self):
+        self.profiler.enable()
+
+    def pause(self):
+        self.profiler.disable()
+
+    def write(self, path: str, top: int) -> str:
+        self.profiler.dump_stats(path)
+        output = io.StringIO()
+        pstats.Stats(self.profiler, stream=output) \
+            .sort_stats("cumulative").print_stats(top)
+        return output.getvalue()
+
+
+class SamplingProfiler():
+    """
+    Records the call stack of the thread that created the profiler while it
+    is active.
+    """
+    suffix = "samples.txt"
+
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self.active = threading.Event()
+        self.stopped = threading.Event()
+        self.stacks = Counter()
+        self.samples = 0
+        self.sampler = threading.Thread(target=self.run, daemon=True)
+        self.sampler.start()
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            if not self.active.is_set():
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:"
+                             f"{code.co_name}:{code.co_firstlineno}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def resume(self):
+        self.active.set()
+
+    def pause(self):
+        self.active.clear()
+
+    def write(self, path: str, top: int) -> str:
+        self.stopped.set()
+        self.sampler.join()
+        # collapsed stacks, readable by common flame graph tools
+        with open(path, "w") as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+        cumulative = Counter()
+        own = Counter()
+        for stack, count in self.stacks.items():
+            functions = stack.split(";")
+            for function in set(functions):
+                cumulative[function] += count
+            own[functions[-1]] += count
+        total = max(self.samples, 1)
+        lines = [f"{self.samples} samples every {SAMPLE_INTERVAL * 1000:.0f} ms",
+                 f"{'cumulative':>10} {'own':>6}  function"]
+        for function, count in cumulative.most_common(top):
+            lines.append(f"{count / total:10.1%} {own[function] / total:6.1%}  {function}")
+        return "\n".join(lines) + "\n"
+
+
+class AllocationProfiler():
+    """
+    Traces allocations from the first call of resume until the profile is
+    written. Tracing can't be paused, so allocations in between calls are
+    included as well.
+    """
+    suffix = "tracemalloc.txt"
+
+    def __init__(self):
+        self.started = False
+
+    def resume(self):
+        if not self.started:
+            tracemalloc.start(25)
+            self.started = True
+
+    def pause(self):
+        pass
+
+    def write(self, path: str, top: int) -> str:
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)])
+        with open(path, "w") as file:
+            for statistic in snapshot.statistics("traceback")[:top]:
+                file.write(f"{statistic}\n")
+                file.write("\n".join(statistic.traceback.format()) + "\n\n")
+
+        lines = [f"peak traced memory {peak / 1024**2:.1f} MiB",
+                 f"{'size':>10} {'blocks':>8}  line"]
+        for statistic in snapshot.statistics("lineno")[:top]:
+            lines.append(f"{statistic.size / 1024**2:8.1f}MB {statistic.count:8}  "
+                         f"{statistic.traceback[0]}")
+        return "\n".join(lines) + "\n"
+
+
+PROFILERS = {"cprofile": DeterministicProfiler,
+             "sampling": SamplingProfiler,
+             "tracemalloc": AllocationProfiler}
+
+
+def write_profile(stage: str, profiler):
+    """
+    Writes the profile of a stage and appends its top functions to the
+    summary.
+    """
+    os.makedirs(_settings["path"], exist_ok=True)
+    name = stage.replace("/", ".")
+    path = f"{_settings['path']}/{name}.{profiler.suffix}"
+    summary = profiler.write(path, _settings["top"])
+    with open(f"{_settings['path']}/summary.txt", "a") as file:
+        file.write(f"=== {stage} ({_settings['mode']}, "
+                   f"{time.strftime('%Y-%m-%d %H:%M:%S')}) ===\n{summary}\n")
+    log.info(f"Wrote profile of {stage} to {path}.")
+
+
+@contextmanager
+def profile(stage: str):
+    """
+    Profiles the enclosed code if the stage is selected for profiling.
+    """
+    if not is_profiled(stage):
+        yield
+        return
+    profiler = PROFILERS[_settings["mode"]]()
+    with activate(stage):
+        profiler.resume()
+        try:
+            yield
+        finally:
+            profiler.pause()
+            write_profile(stage, profiler)
+
+
+@contextmanager
+def profile_calls(stage: str, func):
+    """
+    Yields a wrapper of the function that profiles all of its calls in one
+    profile, or the function itself if the stage isn't profiled. The profile
+    is written when the context is left.
+    """
+    if not is_profiled(stage):
+        yield func
+        return
+    profiler = PROFILERS[_settings["mode"]]()
+
+    def profiled(*args, **kwargs):
+        profiler.resume()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.pause()
+
+    with activate(stage):
+        try:
+            yield profiled
+        finally:
+            write_profile(stage, profiler)
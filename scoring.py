@@ -0,0 +1,488 @@
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import geopandas as gpd
+import networkx as nx
+import osmnx as ox
+import pandas as pd
+import numpy as np
+from shapely.geometry import Polygon
+
+import aggregates
+import compact
+import features
+import helper
+import metrics
+import profiling
+from model import ScoringModel, compile_model
+from bikeability_config import CONFIG
+from tqdm import tqdm
+
+# logging
+log = logging.getLogger("Bikeability")
+
+def fetch_and_filter_residences(
+        city: str,
+        network: nx.MultiDiGraph,
+        polygon: Polygon = None,
+        CONFIG: dict = CONFIG) -> gpd.GeoDataFrame:
+    """
+    Fetches buildings and calculates nearest node for each building for given city in EPSG:25832.
+    If a polygon (EPSG:4326) is given, only buildings within it are fetched.
+    """
+    # load buildings from the configured feature source
+    buildings = features.fetch_features(
+        {**CONFIG, "city": city},
+        {"building": CONFIG["residential_building_types"]},
+        polygon)
+
+    # convert to EPSG:25832
+    buildings = buildings.to_crs("EPSG:25832")
+
+    # filter out non-polygon geometries
+    buildings = buildings[buildings.geometry.type == "Polygon"]
+    
+    buildings = buildings[buildings.building.isin(CONFIG["residential_building_types"])]
+
+    # calculate centroids for nearest nodes
+    buildings["centroid"] = buildings.centroid
+
+    # get nearest nodes
+    buildings["node"] = ox.nearest_nodes(
+        G=network,
+        X=buildings["centroid"].x,
+        Y=buildings["centroid"].y)
+
+    # reset index
+    buildings.reset_index(inplace=True)
+
+    # filter out everything but geometry, centroid and node
+    return buildings[["osmid", "geometry", "centroid", "node", "building"]]
+
+
+def fetch_POIs(
+        CONFIG: dict,
+        network: nx.MultiDiGraph,
+        polygon: Polygon = None,
+        model: ScoringModel = None) -> gpd.GeoDataFrame:
+    """
+    Function for fetching POIs for given group of people.
+    If a polygon (EPSG:4326) is given, only POIs within it are fetched.
+    POIs are categorised with the compiled model, which is compiled from
+    the configuration if not given.
+    """
+    poi_dict = CONFIG["pois_model"]
+    # fetch original POI GDF from the configured feature source
+    pois = features.fetch_features(CONFIG, poi_dict, polygon)
+
+    # convert POIs to EPSG:25832
+    pois = pois.to_crs("EPSG:25832")
+
+    # calculate centroid for nearest nodes
+    pois["centroid"] = pois.centroid
+
+    # find nearest node
+    pois["node"] = ox.nearest_nodes(
+        G=network,
+        X=pois["centroid"].x,
+        Y=pois["centroid"].y)
+
+    # fill missing names
+    pois["name"].fillna("No name", inplace=True)
+
+    # POI is mix of amenity and shop
+    pois["POI_type"] = pois["amenity"].fillna(pois["shop"].fillna("office"))
+
+    # resetting index
+    pois.reset_index(inplace=True)
+    
+    model = model or compile_model(CONFIG)
+    pois.insert(1, "POI_category",
+                model.category_names(model.categorise(pois.POI_type)))
+
+    return pois[["name", "osmid", "geometry", "centroid", "node", "POI_type", "POI_category"]]
+
+
+def score_building_categories(node: int,
+                              x: float,
+                              y: float,
+                              POIs_by_category: tuple,
+                              network: nx.MultiDiGraph,
+                              edges: gpd.GeoDataFrame,
+                              model: ScoringModel) -> np.ndarray:
+    """
+    Calculate the weighted scores of each POI category for one building,
+    using a suitability network.
+
+    Parameters
+    ----------
+    node : int
+        Id of the nearest node of the building.
+    x, y : float
+        Centroid of the building in EPSG:25832.
+    POIs_by_category : tuple
+        Compact points of interest by category, see ScoringModel.split_POIs.
+    network : nx.MultiDiGraph
+        Node-Edge-Network of the relevant area.
+    edges : gpd.GeoDataFrame
+        Scored edges of the suitability network.
+    model : ScoringModel
+        Compiled scoring model.
+
+    Returns
+    -------
+    building_scores : np.ndarray
+        Weighted scores of the building in the order of the POI categories.
+
+    """
+    building_scores = np.zeros(len(model.categories))
+    for code, POIs_category in enumerate(POIs_by_category):
+        # Filter the specified number of POIs in the category, using the 
+        # shortest linear distances
+        nearest = POIs_category.nearest(x, y, model.required_POIs)
+        
+        # Find the shortest (weighted) routes from building to POI
+        routes = pd.Series(POIs_category.node_id(nearest)).apply(
+            helper.calc_shortest_path,
+            args = (node, network, model.route_cache_size))
+        
+        # Extract lengths and suitability values from routes
+        route_values = helper.get_route_values(routes = routes,
+                                          edges = edges)
+        # transform distances to scores using sigmoid function
+        distance_scores = helper.sigmoid(route_values.length)
+        route_values.insert(1, "dist_score", distance_scores)
+        
+        # calculate full route scores
+        route_scores = route_values.dist_score - (1-route_values.suitability)
+        route_scores[route_scores<0] = 0
+        route_values.insert(3, "route_score", route_scores)
+        
+        # weight the best routes with the (unpadded) weight factors
+        n = min(model.weight_counts[code], len(route_values))
+        relevant_scores = route_values["route_score"].nsmallest(n).to_numpy()
+        building_scores[code] = model.weights[code, :n] @ relevant_scores
+    metrics.inc("buildings_scored_total")
+    return building_scores
+
+
+def score_building(node: int,
+                   x: float,
+                   y: float,
+                   POIs_by_category: tuple,
+                   network: nx.MultiDiGraph,
+                   edges: gpd.GeoDataFrame,
+                   model: ScoringModel):
+    """
+    Calculate bikeability scores for one building, using a suitability
+    network.
+
+    Parameters
+    ----------
+    node : int
+        Id of the nearest node of the building.
+    x, y : float
+        Centroid of the building in EPSG:25832.
+    POIs_by_category : tuple
+        Compact points of interest by category, see ScoringModel.split_POIs.
+    network : nx.MultiDiGraph
+        Node-Edge-Network of the relevant area.
+    edges : gpd.GeoDataFrame
+        Scored edges of the suitability network.
+    model : ScoringModel
+        Compiled scoring model.
+
+    Returns
+    -------
+    building_score : float
+        Bikeability score of the building.
+
+    """
+    building_scores = score_building_categories(node, x, y, POIs_by_category,
+                                                network, edges, model)
+    building_score = sum(building_scores)/model.weight_sum
+    return building_score
+
+
+def score_compact_buildings(buildings: compact.CompactPoints,
+                            POIs_by_category: tuple,
+                            network: nx.MultiDiGraph,
+                            edges: gpd.GeoDataFrame,
+                            model: ScoringModel,
+                            statistics: aggregates.ScoreStatistics = None,
+                            checkpoint_path: str = None,
+                            chunk_size: int = 1000) -> np.ndarray:
+    """
+    Calculates scores for compact buildings. Buildings are scored in
+    chunks, after each of which the aggregate statistics are updated. If a
+    checkpoint path is given, every finished chunk is written to it and
+    chunks found there are loaded instead of scored again.
+
+    Parameters
+    ----------
+    buildings : compact.CompactPoints
+        Compact buildings with their building type codes as categories.
+    POIs_by_category : tuple
+        Compact points of interest by category, see ScoringModel.split_POIs.
+    network : nx.MultiDiGraph
+        Node-Edge-Network of the relevant area.
+    edges : gpd.GeoDataFrame
+        Scored edges of the suitability network.
+    model : ScoringModel
+        Compiled scoring model.
+    statistics : aggregates.ScoreStatistics, optional
+        Aggregate statistics updated with the scores of all buildings.
+    checkpoint_path : str, optional
+        Directory for the scores of finished chunks.
+    chunk_size : int, optional
+        Number of buildings per chunk.
+
+    Returns
+    -------
+    scores : np.ndarray
+        Score of each building, in the order of the buildings.
+
+    """
+    metrics.set_gauge("buildings_to_score", len(buildings))
+    if checkpoint_path is not None:
+        os.makedirs(checkpoint_path, exist_ok=True)
+    building_nodes = buildings.node_id(np.arange(len(buildings)))
+
+    # score buildings chunk by chunk with progress bar, optionally profiling
+    # every building
+    scores = np.empty(len(buildings))
+    with tqdm(total = len(buildings)) as progress, \
+            profiling.profile_calls("score_building", score_building_categories) as score_function:
+        for start in range(0, len(buildings), chunk_size):
+            stop = min(start + chunk_size, len(buildings))
+            chunk_file = None
+            if checkpoint_path is not None:
+                chunk_file = f"{checkpoint_path}/chunk_{start}.pkl"
+            if chunk_file is not None and os.path.isfile(chunk_file):
+                category_scores = pd.read_pickle(chunk_file)
+            else:
+                x, y = buildings.coordinates(np.arange(start, stop))
+                category_scores = np.array(
+                    [score_function(building_nodes[position], x[position - start],
+                                    y[position - start], POIs_by_category,
+                                    network, edges, model)
+                     for position in range(start, stop)]).reshape(-1, len(model.categories))
+                if chunk_file is not None:
+                    # written under a temporary name, so a crash can't leave a partial chunk
+                    pd.to_pickle(category_scores, f"{chunk_file}.tmp")
+                    os.replace(f"{chunk_file}.tmp", chunk_file)
+            contributions = category_scores / model.weight_sum
+            if statistics is not None:
+                statistics.update(
+                    pd.DataFrame(contributions, columns=list(model.categories)),
+                    pd.Series(model.building_type_names(buildings.category[start:stop])))
+            scores[start:stop] = contributions.sum(axis = 1)
+            progress.update(stop - start)
+    return scores
+
+
+def join_scores(residential_buildings: gpd.GeoDataFrame,
+                scores: np.ndarray) -> gpd.GeoDataFrame:
+    """
+    Adds the scores of compact buildings to the buildings they were created
+    from, by position.
+    """
+    buildings_scored = residential_buildings.copy()
+    buildings_scored.insert(5, "score", scores)
+    return buildings_scored
+
+
+def score_buildings(residential_buildings: gpd.GeoDataFrame,
+                    POIs: gpd.GeoDataFrame,
+                    network: nx.MultiDiGraph,
+                    edges: gpd.GeoDataFrame,
+                    CONFIG: dict,
+                    statistics: aggregates.ScoreStatistics = None,
+                    checkpoint_path: str = None,
+                    model: ScoringModel = None) -> gpd.GeoDataFrame:
+    """
+    Calculates scores for all buildings, see score_compact_buildings.
+
+    Parameters
+    ----------
+    residential_buildings : gpd.GeoDataFrame
+        Dataframe containing a list of buildings.
+    POIs : gpd.GeoDataFrame
+        List of points of interest.
+    network : nx.MultiDiGraph
+        Node-Edge-Network of the relevant area.
+    edges : gpd.GeoDataFrame
+        Scored edges of the suitability network.
+    CONFIG : dict
+        Bikeability configuration.
+    statistics : aggregates.ScoreStatistics, optional
+        Aggregate statistics updated with the scores of all buildings.
+    checkpoint_path : str, optional
+        Directory for the scores of finished chunks.
+    model : ScoringModel, optional
+        Compiled scoring model, compiled from the configuration if not
+        given.
+
+    Returns
+    -------
+    buildings_scored : gpd.GeoDataFrame
+        The building dataframe with added scores.
+
+    """
+    # compile the configuration once and convert buildings and POIs into
+    # compact points
+    model = model or compile_model(CONFIG)
+    node_ids = compact.node_table(network)
+    buildings = compact.compact_points(
+        residential_buildings, node_ids,
+        model.building_codes(residential_buildings["building"]))
+    scores = score_compact_buildings(buildings,
+                                     model.split_POIs(POIs, node_ids),
+                                     network, edges, model, statistics,
+                                     checkpoint_path, CONFIG["score_chunk_size"])
+    return join_scores(residential_buildings, scores)
+
+def prepare_for_export(layer: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """
+    Converts a layer to a form that can be written to columnar files: the
+    index is turned into columns, secondary geometries are removed and
+    values of mixed lists and scalars (e.g. merged OSM ids) are converted
+    to strings.
+    """
+    layer = layer.drop(columns=["centroid"], errors="ignore")
+    if isinstance(layer.index, pd.MultiIndex):
+        layer = layer.reset_index()
+    for column in layer.columns:
+        if layer[column].dtype == object and column != "geometry":
+            if layer[column].map(type).isin([list, dict, set]).any():
+                layer[column] = layer[column].astype(str)
+    return gpd.GeoDataFrame(layer, geometry="geometry", crs="EPSG:25832")
+
+
+def export_layer(layer: gpd.GeoDataFrame, name: str, CONFIG: dict):
+    """
+    Writes one result layer in all configured export formats.
+    """
+    export_path = CONFIG["export_path"]
+    layer = prepare_for_export(layer)
+    if "parquet" in CONFIG["export_formats"]:
+        layer.to_parquet(f"{export_path}/{name}.parquet")
+    if "flatgeobuf" in CONFIG["export_formats"]:
+        layer.to_file(f"{export_path}/{name}.fgb", driver="FlatGeobuf",
+                      SPATIAL_INDEX="YES")
+
+
+def submit_exports(executor: Executor,
+                   buildings: gpd.GeoDataFrame,
+                   POIs: gpd.GeoDataFrame,
+                   edges: gpd.GeoDataFrame,
+                   CONFIG: dict,
+                   visualise: bool = True) -> dict:
+    """
+    Submits the independent exports and visualisations of the results to an
+    executor, so they run concurrently.
+
+    Parameters
+    ----------
+    executor : Executor
+        Executor running the outputs.
+    buildings : gpd.GeoDataFrame
+        Dataframe containing a list of buildings with scores.
+    POIs : gpd.GeoDataFrame
+        Dataframe containing a list of POIs.
+    edges : gpd.GeoDataFrame
+        Scored edges of the suitability network.
+    CONFIG : dict
+        Bikeability configuration.
+    visualise : bool, optional
+        Whether the html maps of buildings and POIs are created.
+
+    Returns
+    -------
+    futures : dict
+        Futures of the submitted outputs by name.
+
+    """
+    os.makedirs(CONFIG["export_path"], exist_ok=True)
+    futures = {
+        # the buildings are the largest layer, all their outputs run in one
+        # task so they are sent to a worker process only once
+        "building outputs": executor.submit(
+            export_buildings, buildings, edges, CONFIG, visualise),
+        "POI export": executor.submit(export_layer, POIs, "POIs", CONFIG),
+        "edge export": executor.submit(export_layer, edges, "edges", CONFIG)}
+    if visualise:
+        # folium is only imported when maps are created
+        import visualisation
+        #visualise POIs as html file
+        futures["POI visualisation"] = executor.submit(
+            visualisation.create_POI_visualisation, POIs,
+            CONFIG["export_path"])
+    return futures
+
+
+def export_buildings(buildings: gpd.GeoDataFrame,
+                     edges: gpd.GeoDataFrame,
+                     CONFIG: dict,
+                     visualise: bool = True):
+    """
+    Writes the scored buildings in all configured export formats, the html
+    map of the buildings and the vector tiles one after another.
+    """
+    #export as columnar files
+    export_layer(buildings, "buildings", CONFIG)
+    if visualise:
+        import visualisation
+        # visualise buildings as html file
+        visualisation.create_building_visualisation(buildings,
+                                                    CONFIG["export_path"])
+    #export as vector tiles
+    if CONFIG["vector_tiles"]:
+        import vector_tiles
+        vector_tiles.export_vector_tiles(buildings, edges, CONFIG)
+
+
+def wait_for_outputs(futures: dict):
+    """
+    Waits for all submitted outputs and reports every failure at the end
+    instead of stopping at the first one.
+    """
+    failures = []
+    for name, future in futures.items():
+        try:
+            future.result()
+            log.info(f"Finished {name}.")
+        except Exception as error:
+            log.exception(f"{name} failed: {error}")
+            failures.append(name)
+    if failures:
+        raise RuntimeError(f"Failed outputs: {', '.join(failures)}")
+
+
+def save_results(buildings: gpd.GeoDataFrame,
+                 POIs: gpd.GeoDataFrame,
+                 edges: gpd.GeoDataFrame,
+                 CONFIG: dict):
+    """
+    Export the results as GeoParquet and/or FlatGeobuf files and visualisation
+
+    Parameters
+    ----------
+    buildings : gpd.GeoDataFrame
+        Dataframe containing a list of buildings with scores.
+    POIs : gpd.GeoDataFrame
+        Dataframe containing a list of POIs.
+    edges : gpd.GeoDataFrame
+        Scored edges of the suitability network.
+    CONFIG : dict
+        Bikeability configuration.
+
+    Returns
+    -------
+    None.
+
+    """
+    with ProcessPoolExecutor(max_workers=CONFIG["output_workers"]) as executor:
+        futures = submit_exports(executor, buildings, POIs, edges, CONFIG)
+        wait_for_outputs(futures)
@@ -0,0 +1,291 @@
+"""
+HTTP service scoring arbitrary coordinates.
+
+The suitability network, the POIs and the compiled model of every profile are
+loaded once at startup, from the cache and the checkpoints if possible.
+Posted coordinates are snapped to the nearest node of the network and scored
+like a building located at that node, as in `point_scoring`; points farther
+than "MAX_SNAP_DISTANCE" from the network get null scores. Scores are kept
+in a least recently used cache keyed by profile and node, so addresses
+snapping to the same node are only scored once. Nodes requested within "SERVICE_BATCH_DELAY" are
+collected into batches, whose searches run in a pool of worker processes.
+
+Usage: python cli.py serve [--host HOST] [--port PORT] [--profiles FILE]
+
+The profiles file contains overrides of the configuration by profile name,
+as in batch files. Requests:
+    POST /score   {"profile": "default", "points": [[6.08, 50.77], ...]}
+                  points as longitude and latitude (EPSG:4326)
+    GET /health   loaded profiles, bounds of their networks and cache usage
+"""
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Callable
+
+import numpy as np
+from pyproj import Transformer
+
+from point_scoring import _profiles, init_worker, load_profile, score_nodes, snap_points
+
+log = logging.getLogger("Bikeability")
+
+# reason phrases of the status codes used
+STATUS = {200: "OK",
+          400: "Bad Request",
+          404: "Not Found",
+          405: "Method Not Allowed",
+          413: "Content Too Large",
+          500: "Internal Server Error"}
+
+
+class ScoringService():
+    """
+    Scores points of HTTP requests with the profiles loaded in this process.
+
+    Parameters
+    ----------
+    create_executor : callable
+        Function without arguments creating the pool of worker processes
+        running the searches. The pool is created again if a worker dies.
+    CONFIG : dict
+        Bikeability configuration.
+
+    """
+    def __init__(self, create_executor: Callable[[], Executor], CONFIG: dict):
+        self.create_executor = create_executor
+        self.executor = create_executor()
+        self.transformer = Transformer.from_crs("EPSG:4326", "EPSG:25832",
+                                                always_xy=True)
+        self.cache = OrderedDict()
+        self.cache_size = CONFIG["service_cache_size"]
+        self.batch_delay = CONFIG["service_batch_delay"]
+        self.batch_size = CONFIG["service_batch_size"]
+        self.max_body = CONFIG["service_max_body"]
+        self.hits = 0
+        self.misses = 0
+        # futures of the nodes queued or being scored, by profile and node
+        self.pending = {}
+        self.queue = None
+        self.tasks = set()
+
+    async def score_node(self, profile: str, node: int) -> dict:
+        key = (profile, node)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        # concurrent requests of a node wait for the same search
+        if key not in self.pending:
+            self.pending[key] = asyncio.get_running_loop().create_future()
+            self.queue.put_nowait(key)
+        return await self.pending[key]
+
+    async def score_points(self, profile: str, points: np.ndarray) -> list:
+        """
+        Snaps the points (longitude, latitude) to the nearest nodes and
+        returns their scores. Points farther than "MAX_SNAP_DISTANCE" from
+        their node get null scores.
+        """
+        if not len(points):
+            return []
+        x, y = self.transformer.transform(points[:, 0], points[:, 1])
+        nodes, distances, located, near = snap_points(profile, x, y)
+        results = await asyncio.gather(*(self.score_node(profile, int(node))
+                                         for node in nodes[near]))
+        results = iter(results)
+        # coordinates outside of the projection have no node
+        return [{"lon": float(lon), "lat": float(lat),
+                 "node": int(node) if is_located else None,
+                 "snap_distance": float(distance) if is_located else None,
+                 **(next(results) if is_near else {"score": None, "categories": None})}
+                for (lon, lat), node, distance, is_located, is_near
+                in zip(points, nodes, distances, located, near)]
+
+    async def batch_requests(self):
+        """
+        Collects queued nodes into batches of up to "SERVICE_BATCH_SIZE"
+        nodes and submits them to the workers.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            keys = [await self.queue.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(keys) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    keys.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            batches = {}
+            for profile, node in keys:
+                batches.setdefault(profile, []).append(node)
+            for profile, nodes in batches.items():
+                task = asyncio.create_task(self.run_batch(profile, nodes))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, profile: str, nodes: list):
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            results = await loop.run_in_executor(executor, score_nodes,
+                                                 profile, nodes)
+        except Exception as error:
+            # a worker died, e.g. killed for using too much memory, which
+            # breaks the whole pool; batches running on it fail as well
+            if isinstance(error, BrokenProcessPool) and self.executor is executor:
+                log.error("Worker process died, restarting the workers.")
+                executor.shutdown(wait=False)
+                self.executor = self.create_executor()
+            log.exception(f"Scoring {len(nodes)} nodes of profile {profile} failed.")
+            for node in nodes:
+                self.pending.pop((profile, node)).set_exception(error)
+            return
+        for node, result in zip(nodes, results):
+            key = (profile, node)
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+            self.pending.pop(key).set_result(result)
+
+    def health(self) -> dict:
+        return {"profiles": {name: {"bounds": data["bounds"],
+                                    "nodes": len(data["nodes"])}
+                             for name, data in _profiles.items()},
+                "cache": {"size": len(self.cache),
+                          "hits": self.hits,
+                          "misses": self.misses},
+                "pending": len(self.pending)}
+
+    async def route(self, method: str, path: str, body: bytes) -> tuple:
+        """
+        Answers a request.
+
+        Returns
+        -------
+        status : int
+            HTTP status code.
+        content : dict
+            Response, sent as json.
+
+        """
+        if path == "/health":
+            return 200, self.health()
+        if path != "/score":
+            return 404, {"error": f"unknown path {path}"}
+        if method != "POST":
+            return 405, {"error": "scores are requested with POST"}
+        try:
+            request = json.loads(body)
+            profile = request.get("profile", next(iter(_profiles)))
+            points = np.array(request["points"], dtype=float).reshape(-1, 2)
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return 400, {"error": f"invalid request: {error}"}
+        if profile not in _profiles:
+            return 400, {"error": f"unknown profile {profile}"}
+        if not np.isfinite(points).all():
+            return 400, {"error": "coordinates must be finite numbers"}
+        try:
+            return 200, {"profile": profile,
+                         "scores": await self.score_points(profile, points)}
+        except Exception as error:
+            log.exception("Scoring request failed.")
+            return 500, {"error": str(error)}
+
+    async def handle_connection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter):
+        """
+        Answers the HTTP/1.1 requests of one connection, which is kept open
+        unless the client asks to close it.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if length < 0:
+                    # the end of the request is unknown, so the connection
+                    # can't be reused
+                    status, keep_alive = 400, False
+                    content = {"error": "invalid Content-Length"}
+                elif length > self.max_body:
+                    # the body isn't read, so the connection can't be reused
+                    status, keep_alive = 413, False
+                    content = {"error": f"request larger than {self.max_body} bytes"}
+                else:
+                    body = await reader.readexactly(length)
+                    status, content = await self.route(method, path, body)
+                payload = json.dumps(content).encode()
+                writer.write((f"HTTP/1.1 {status} {STATUS[status]}\r\n"
+                              "Content-Type: application/json\r\n"
+                              f"Content-Length: {len(payload)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                              "\r\n").encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # client disconnected or sent a malformed request
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        self.queue = asyncio.Queue()
+        batcher = asyncio.create_task(self.batch_requests())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        log.info(f"Serving scores on http://{host}:{port}.")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def serve(CONFIG: dict, profiles: dict = None):
+    """
+    Loads the profiles and serves scores until interrupted.
+
+    Parameters
+    ----------
+    CONFIG : dict
+        Bikeability configuration.
+    profiles : dict, optional
+        Overrides of the configuration by profile name. The first profile
+        is used by requests without profile.
+
+    Returns
+    -------
+    None.
+
+    """
+    profiles = profiles or {"default": {}}
+    configs = {name: {**CONFIG, **overrides} for name, overrides in profiles.items()}
+    for name, config in configs.items():
+        log.info(f"Loading profile {name}.")
+        _profiles[name] = load_profile(config)
+
+    service = ScoringService(partial(ProcessPoolExecutor,
+                                     max_workers=CONFIG["service_workers"],
+                                     initializer=init_worker,
+                                     initargs=(configs,)),
+                             CONFIG)
+    try:
+        asyncio.run(service.serve(CONFIG["service_host"], CONFIG["service_port"]))
+    finally:
+        service.executor.shutdown()
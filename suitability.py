@@ -7,7 +7,9 @@ import osmnx as ox
 
 import os
 import pyrosm
+from shapely.geometry import Polygon
 import accident_data.accidents_util as acd
+import instrumentation
 log = logging.getLogger('Bikeability')
 # test = pyrosm.get_data("Aachen")
 # print(test)W
@@ -18,13 +20,18 @@ log = logging.getLogger('Bikeability')
 
 class Suitability():
     def fetch_network_edges(self,
-                            city: str) -> nx.MultiDiGraph:
+                            city: str,
+                            polygon: Polygon = None) -> nx.MultiDiGraph:
         """
         Fetches network and it's edges for given city in EPSG:25832.
+        If a polygon (EPSG:4326) is given, the network within it is fetched instead.
         """
 
         # get original network
-        network = ox.graph_from_place(city, network_type="bike")
+        if polygon is None:
+            network = ox.graph_from_place(city, network_type="bike")
+        else:
+            network = ox.graph_from_polygon(polygon, network_type="bike")
 
         # fetch the edges
         # network_edges = ox.graph_to_gdfs(network, nodes=False)
@@ -120,7 +127,8 @@ class Suitability():
         missing_scores = network_osm[scoring["score_separation"] == -1]
         num_missing = missing_scores["id"].size
         if num_missing > 0:
-            scoring = self.fill_in_scores(scoring, CONFIG, "separation")
+            with instrumentation.stage("fill_in_scores", rows=num_missing):
+                scoring = self.fill_in_scores(scoring, CONFIG, "separation")
         #     log.warning(f"{num_missing} elements couldn't be scored for separation. \
         #                 \n This is most likely due to an unknown exception in the data structure.")
         #     scoring.loc[scoring["score_separation"] == -1,
@@ -238,7 +246,8 @@ class Suitability():
 
         num_missing = missing_scores["id"].size
         if num_missing > 0:
-            scoring = self.fill_in_scores(scoring, CONFIG, "surface")
+            with instrumentation.stage("fill_in_scores", rows=num_missing):
+                scoring = self.fill_in_scores(scoring, CONFIG, "surface")
         #     log.warning(f"{num_unknown} elements couldn't be scored for surface area \
         #                 \n due to unknown values. The default value {CONFIG['default_scores']['surface']} is used.")
 
@@ -313,18 +322,33 @@ class Suitability():
         #     if score.score_separation == -1:
         #         score = self.complete_road_related(scoring, score, "separation", CONFIG, type_defaults)
             
-    def import_network(self, CONFIG: dict) -> pd.DataFrame():
+    def get_pbf_path(self, CONFIG: dict, download: bool = True) -> str:
+        """
+        Returns the path of the protobuff file for the configured region and
+        downloads it if it isn't available locally and download is enabled.
+        """
+        fp = CONFIG["pbf_path"]
+        if not fp:
+            city = CONFIG["city"].split(",")[0]
+            fp = f"pyrosm/{city}.osm.pbf"
+        if not os.path.isfile(fp):
+            if not download:
+                raise FileNotFoundError(f"Protobuff file {fp} not found.")
+            region = os.path.basename(fp).removesuffix(".osm.pbf")
+            fp = pyrosm.get_data(region, directory = "pyrosm")
+        return fp
+
+    def import_network(self, CONFIG: dict, polygon: Polygon = None) -> pd.DataFrame():
         """
         Imports and filters the road network from osm.
     
         Parameters
         ----------
-        osm : pyrosm.OSM
-            Pyrosm OSM reference object.
-        log : logging.Logger
-            Log file.
         CONFIG: dict
             Dictionary of configuration options and static variables for bikeability calculation.
+        polygon : Polygon, optional
+            Area (EPSG:4326) to restrict the import to. The whole protobuff
+            file is imported if none is given.
     
         Returns
         -------
@@ -332,12 +356,9 @@ class Suitability():
             Dataframe containing OSM map- and metadata that is relevant for calculating bikeability.
             
         """
-        city = CONFIG["city"].split(",")[0]
-        fp = f"pyrosm/{city}.osm.pbf"
-        if not os.path.isfile(fp):
-            fp = pyrosm.get_data(city, directory = "pyrosm")
+        fp = self.get_pbf_path(CONFIG)
         
-        osm = pyrosm.OSM(fp)
+        osm = pyrosm.OSM(fp, bounding_box = polygon)
         
         network_osm = osm.get_network("cycling")
         log.info("Successfully downloaded osm network data!")
@@ -414,8 +435,12 @@ class Suitability():
 
 
         if CONFIG['use_accidents']:
-            accidents = acd.fetch_accidents(path=CONFIG['accident_path'])
-            edges = acd.match_accidents_network(edges, accidents)
+            with instrumentation.stage("accidents") as record:
+                accidents = acd.fetch_accidents(path=CONFIG['accident_path'],
+                                                bbox=tuple(edges.total_bounds),
+                                                years=CONFIG['accident_years'])
+                edges = acd.match_accidents_network(edges, accidents)
+                record["rows"] = len(accidents)
 
         for index, edge in edges.iterrows():
             # differentiate between single edges and edge lists
@@ -548,17 +573,18 @@ class Suitability():
         nodes = nodes.loc[nodes.index.isin(valid_nodes)]
         return nodes, edges
 
-    def eval_suitability(self, CONFIG: dict):
+    def eval_suitability(self, CONFIG: dict, polygon: Polygon = None):
         """
         Downloads a road network for a specified city and scores it for
         
 
         Parameters
         ----------
-        log : logging.logger
-            Relevant log file.
         CONFIG : dict
             Dictionary of configuration options and static variables for bikeability calculation.
+        polygon : Polygon, optional
+            Area (EPSG:4326) to evaluate instead of the whole city, e.g. one
+            tile of a larger region.
 
         Returns
         -------
@@ -571,7 +597,9 @@ class Suitability():
         log.info("Starting to download osm network data!")
 
         # Download OSM network for given city
-        network = self.fetch_network_edges(CONFIG['city'])
+        with instrumentation.stage("network_fetch") as record:
+            network = self.fetch_network_edges(CONFIG['city'], polygon)
+            record["rows"] = network.number_of_edges()
         log.info("Network and it's edges loaded... ")
 
         # Convert to dataframe for easier data handling
@@ -581,36 +609,42 @@ class Suitability():
         nodes, edges = self.remove_ignored_types(nodes, edges, CONFIG)
     
         # import OSM network to access metadata
-        network_osm = self.import_network(CONFIG)
+        with instrumentation.stage("pbf_import") as record:
+            network_osm = self.import_network(CONFIG, polygon)
+            record["rows"] = len(network_osm)
 
         # initialise scoring dataframe
         scoring = network_osm[["name", "id", "tags", "osm_type", "highway", "geometry", 
                                "motor_vehicle", "lit", "length"]]
 
         log.info("Starting to score for separation!")
-        scoring, missing_scores = self.score_route_separation(
-            network_osm=network_osm,
-            scoring=scoring,
-            CONFIG=CONFIG)
+        with instrumentation.stage("separation", rows=len(scoring)):
+            scoring, missing_scores = self.score_route_separation(
+                network_osm=network_osm,
+                scoring=scoring,
+                CONFIG=CONFIG)
         log.info(
             "Successfully scored for separation. Starting to score for surface area!")
         
-        scoring, missing_scores = self.score_route_surfaces(
-            network_osm=network_osm,
-            scoring=scoring,
-            CONFIG=CONFIG)
+        with instrumentation.stage("surface", rows=len(scoring)):
+            scoring, missing_scores = self.score_route_surfaces(
+                network_osm=network_osm,
+                scoring=scoring,
+                CONFIG=CONFIG)
         log.info(
             "Successfully scored for surface area. Starting to score for light level!")
         
-        scoring, missing_scores = self.score_route_lights(
-            network_osm=network_osm,
-            scoring=scoring,
-            CONFIG=CONFIG)
+        with instrumentation.stage("light", rows=len(scoring)):
+            scoring, missing_scores = self.score_route_lights(
+                network_osm=network_osm,
+                scoring=scoring,
+                CONFIG=CONFIG)
         log.info(
             "Successfully scored for light level. Starting to calculate suitability!")
         
-        edges, network = self.suitability_to_network(nodes,
-            edges, network, scoring, CONFIG)
+        with instrumentation.stage("suitability_to_network", rows=len(edges)):
+            edges, network = self.suitability_to_network(nodes,
+                edges, network, scoring, CONFIG)
         edges.sort_index(inplace = True)
         log.info(
             "Successfully calculated suitability!")
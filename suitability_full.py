@@ -1,16 +1,9 @@
 import logging
 
-import geopandas as gpd
-import networkx as nx
-import osmnx as ox
-import pandas as pd
-import numpy as np
-
-import visualisation
-import helper
+from aggregates import write_statistics
 from bikeability_config import CONFIG
-from suitability import Suitability
-from tqdm import tqdm
+from scoring import save_results
+from tiling import eval_tiled
 
 import warnings
 
@@ -18,15 +11,23 @@ warnings.filterwarnings("error", message="DeprecationWarning: Passing a BlockMan
 # logging
 log = logging.getLogger("Bikeability")
 
-CONFIG["city"] = "nordrhein_westfalen"
+# A federal state is too large for a single run, so it is evaluated in tiles.
+CONFIG["city"] = "Nordrhein-Westfalen, Germany"
+CONFIG["pbf_path"] = "pyrosm/nordrhein_westfalen.osm.pbf"
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        filename="bikeability.log",
+        level=logging.INFO,
+        format="%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s",
+        datefmt="%d-%m-%Y %H:%M:%S")
 
-logging.basicConfig(
-    filename="bikeability.log",
-    level=logging.INFO,
-    format="%(asctime)s.%(msecs)03d %(levelname)s %(module)s - %(funcName)s: %(message)s",
-    datefmt="%d-%m-%Y %H:%M:%S")
+    # calculate suitability and building scores tile by tile
+    edges, buildings_scored, POIs, statistics = eval_tiled(CONFIG)
+    log.info("All tiles completed. Saving results... ")
 
-# calculate suitability
-suitability = Suitability()
-edges, network = suitability.eval_suitability(CONFIG)
-log.info("Suitability network completed. Loading buildings... ")
+    save_results(buildings = buildings_scored,
+                 POIs = POIs,
+                 edges = edges,
+                 CONFIG = CONFIG)
+    write_statistics(statistics, edges, CONFIG)
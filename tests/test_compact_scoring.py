@@ -0,0 +1,77 @@
+"""
+Equivalence of the compact building scoring with the scoring of buildings
+and POIs as GeoDataFrames it replaced.
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+ox = pytest.importorskip("osmnx")
+
+import helper
+import scoring
+from benchmarks.synthetic_city import generate_city
+from bikeability_config import CONFIG
+from model import compile_model
+from suitability import Suitability
+
+
+@pytest.fixture(scope="module")
+def city():
+    """
+    A synthetic city with more POIs per category than are searched for
+    every building, and its scored suitability network.
+    """
+    config = {**CONFIG, "use_accidents": False}
+    city = generate_city(4000, config, seed=1)
+    suitability = Suitability()
+    network_osm = city["network_osm"]
+    scores = network_osm[["name", "id", "tags", "osm_type", "highway",
+                          "geometry", "motor_vehicle", "lit", "length"]]
+    scores, _ = suitability.score_route_separation(network_osm, scores, config)
+    scores, _ = suitability.score_route_surfaces(network_osm, scores, config)
+    scores, _ = suitability.score_route_lights(network_osm, scores, config)
+    nodes, edges = ox.graph_to_gdfs(city["graph"])
+    nodes, edges = suitability.remove_ignored_types(nodes, edges, config)
+    edges, network = suitability.suitability_to_network(
+        nodes, edges, city["graph"], scores, config)
+    edges.sort_index(inplace=True)
+    return {**city, "config": config, "edges": edges, "network": network}
+
+
+def reference_score(building, POIs_by_category, network, edges, model):
+    """
+    Scores a building with the nearest POIs of every category selected from
+    GeoDataFrames, as before the compact scoring.
+    """
+    building_scores = np.zeros(len(model.categories))
+    for code, POIs_category in enumerate(POIs_by_category):
+        shortest_distances = helper.knearest(from_points=building.centroid,
+                                             to_points=POIs_category.centroid,
+                                             k=model.required_POIs)
+        POIs_within = POIs_category.loc[shortest_distances.index]
+        routes = POIs_within["node"].reset_index(drop=True).apply(
+            helper.calc_shortest_path, args=(building.node, network))
+        route_values = helper.get_route_values(routes=routes, edges=edges)
+        route_scores = helper.sigmoid(route_values.length) - (1 - route_values.suitability)
+        route_scores[route_scores < 0] = 0
+        n = min(model.weight_counts[code], len(route_scores))
+        building_scores[code] = model.weights[code, :n] @ route_scores.nsmallest(n).to_numpy()
+    return building_scores.sum() / model.weight_sum
+
+
+def test_compact_scores_match_geodataframe_scores(city):
+    config = city["config"]
+    model = compile_model(config)
+    buildings = city["buildings"].iloc[:100]
+    POIs = city["POIs"]
+    assert len(POIs) > len(model.categories) * model.required_POIs
+
+    scored = scoring.score_buildings(buildings, POIs, city["network"],
+                                     city["edges"], config, model=model)
+
+    codes = model.categorise(POIs.POI_type)
+    POIs_by_category = [POIs[codes == code] for code in range(len(model.categories))]
+    expected = [reference_score(building, POIs_by_category, city["network"],
+                                city["edges"], model)
+                for _, building in buildings.iterrows()]
+    np.testing.assert_allclose(scored["score"].to_numpy(), expected, rtol=1e-12)
@@ -0,0 +1,115 @@
+from types import SimpleNamespace
+
+import pytest
+
+import work_queue
+from work_queue import WorkQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Replaces the clock of the queue, so leases expire without waiting.
+    """
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(work_queue, "time", SimpleNamespace(time=lambda: now.value))
+    return now
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = WorkQueue({"queue_path": str(tmp_path / "queue"),
+                       "queue_lease": 60,
+                       "queue_max_attempts": 2})
+    queue.publish("job", 2)
+    return queue
+
+
+def test_chunks_are_claimed_once(queue):
+    assert queue.claim("a") == ("job", 0)
+    assert queue.claim("b") == ("job", 1)
+    assert queue.claim("c") is None
+    assert queue.status("job") == {"pending": 0, "claimed": 2, "done": 0, "failed": 0}
+
+
+def test_expired_claims_are_claimed_again(queue, clock):
+    queue.claim("a")
+    queue.claim("a")
+    clock.value += 30
+    assert queue.claim("b") is None
+    clock.value += 31
+    assert queue.claim("b") == ("job", 0)
+    assert queue.claim("c") == ("job", 1)
+
+
+def test_expired_claims_fail_after_the_last_attempt(queue, clock):
+    for worker in ["a", "b"]:
+        queue.claim(worker)
+        queue.claim(worker)
+        clock.value += 61
+    assert queue.claim("c") is None
+    assert queue.status("job")["failed"] == 2
+    assert queue.errors("job")[0] == (0, "claim expired after the last attempt")
+
+
+def test_fail_is_ignored_after_losing_the_claim(queue, clock):
+    queue.claim("a")
+    clock.value += 61
+    assert queue.claim("b") == ("job", 0)
+    queue.fail("job", 0, "a", "late failure")
+    assert queue.status("job")["claimed"] == 1
+    assert queue.errors("job") == []
+
+    queue.complete("job", 0)
+    assert queue.status("job")["done"] == 1
+
+
+def test_failed_chunks_are_returned_until_the_last_attempt(queue):
+    queue.claim("a")
+    queue.fail("job", 0, "a", "first failure")
+    assert queue.status("job")["pending"] == 2
+    assert queue.claim("a") == ("job", 0)
+    queue.fail("job", 0, "a", "second failure")
+    assert queue.errors("job") == [(0, "second failure")]
+
+
+def test_failed_chunks_are_retried_on_resume(queue):
+    for _ in range(2):
+        queue.claim("a")
+        queue.fail("job", 0, "a", "failure")
+    assert queue.status("job")["failed"] == 1
+
+    queue.retry_failed("job")
+    assert queue.status("job")["failed"] == 0
+    assert queue.claim("b") == ("job", 0)
+    queue.fail("job", 0, "b", "failure")
+    # the retried chunk has all attempts again
+    assert queue.status("job")["failed"] == 0
+
+
+def test_jobs_are_published_once(queue):
+    assert queue.has_job("job")
+    assert not queue.has_job("other")
+    queue.publish("other", 1)
+    assert queue.status()["pending"] == 3
+
+
+def test_expired_claims_fail_without_workers(queue, clock):
+    queue.claim("a")
+    queue.claim("a")
+    clock.value += 61
+    queue.expire()
+    assert queue.status("job") == {"pending": 2, "claimed": 0, "done": 0, "failed": 0}
+
+    # the workers crash on the last attempt and none is left to claim
+    queue.claim("b")
+    queue.claim("b")
+    clock.value += 30
+    queue.expire()
+    assert queue.status("job")["claimed"] == 2
+    clock.value += 31
+    queue.expire()
+    status = queue.status("job")
+    assert status["pending"] == status["claimed"] == 0
+    assert queue.errors("job") == [(0, "claim expired after the last attempt"),
+                                   (1, "claim expired after the last attempt")]
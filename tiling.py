@@ -0,0 +1,301 @@
+"""
+Tiled execution of the bikeability calculation for regions that are too large
+to be processed in one go, e.g. whole federal states.
+
+The region is split into square core tiles. Every tile is evaluated on its
+core plus a halo wide enough for routing, but only keeps the edges, buildings
+and POIs located in its core, so the merged results contain every object
+exactly once.
+"""
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import osmnx as ox
+import pandas as pd
+from osmnx._errors import InsufficientResponseError
+from shapely.geometry import box
+
+import aggregates
+import metrics
+import network_cache
+import scoring
+from model import compile_model
+from network_cache import eval_suitability_cached
+
+log = logging.getLogger("Bikeability")
+
+# configuration sections the results of a tile depend on
+TILE_SECTIONS = ["tile_size", "tile_halo", "feature_source", "pois_model",
+                 "weight_factors_categories", "model_weight_factors",
+                 "residential_building_types", *network_cache.KEY_SECTIONS]
+
+# columns of fetched buildings and POIs, used for empty tiles
+BUILDING_COLUMNS = ["osmid", "geometry", "centroid", "node", "building"]
+POI_COLUMNS = ["name", "osmid", "geometry", "centroid", "node", "POI_type",
+               "POI_category"]
+
+
+def create_tiles(region: gpd.GeoSeries,
+                 tile_size: float,
+                 halo: float) -> gpd.GeoDataFrame:
+    """
+    Splits a region into square tiles with overlapping halos.
+
+    Parameters
+    ----------
+    region : gpd.GeoSeries
+        Outline of the region in EPSG:25832.
+    tile_size : float
+        Edge length of the core tiles in metres.
+    halo : float
+        Width of the overlap around each core tile in metres.
+
+    Returns
+    -------
+    tiles : gpd.GeoDataFrame
+        Tiles with their core area as geometry and the area including the
+        halo in the column "halo", both clipped to the region.
+
+    """
+    outline = region.unary_union
+    minx, miny, maxx, maxy = outline.bounds
+    cores = [box(x, y, x + tile_size, y + tile_size)
+             for x in np.arange(minx, maxx, tile_size)
+             for y in np.arange(miny, maxy, tile_size)]
+
+    tiles = gpd.GeoDataFrame(geometry=cores, crs="EPSG:25832")
+    tiles = tiles[tiles.intersects(outline)]
+    tiles["halo"] = tiles.buffer(halo, join_style=2).intersection(outline)
+    tiles["geometry"] = tiles.intersection(outline)
+    tiles = tiles.reset_index(drop=True)
+    tiles.index.name = "tile_id"
+    return tiles
+
+
+def tile_directory(CONFIG: dict) -> str:
+    """
+    Returns the directory of the tile results, named after a key of the
+    tiling and scoring configuration, so results of other settings are
+    never merged.
+    """
+    sections = {section: CONFIG[section] for section in TILE_SECTIONS}
+    content = json.dumps(sections, sort_keys=True, default=str)
+    key = hashlib.sha256(content.encode()).hexdigest()[:32]
+    return f"{CONFIG['tile_path']}/{key}"
+
+
+def tile_files(CONFIG: dict, tile_id: int) -> dict:
+    """
+    Returns the paths of the intermediate result files of one tile.
+    """
+    tile_path = tile_directory(CONFIG)
+    return {layer: f"{tile_path}/tile_{tile_id}_{layer}.pkl"
+            for layer in ["edges", "buildings", "POIs", "statistics"]}
+
+
+def tile_finished(CONFIG: dict, tile_id: int) -> bool:
+    """
+    Returns whether all result files of a tile exist. Tiles missing any of
+    them, e.g. results of earlier versions without statistics, are run
+    again.
+    """
+    return all(os.path.isfile(path)
+               for path in tile_files(CONFIG, tile_id).values())
+
+
+def empty_layer(columns: list) -> gpd.GeoDataFrame:
+    """
+    Returns an empty layer in EPSG:25832 with the given columns.
+    """
+    layer = gpd.GeoDataFrame(columns=columns, geometry="geometry",
+                             crs="EPSG:25832")
+    layer["centroid"] = gpd.GeoSeries(crs="EPSG:25832")
+    layer["node"] = layer["node"].astype(np.int64)
+    return layer
+
+
+def run_tile(tile_id: int,
+             core: gpd.GeoSeries,
+             halo: gpd.GeoSeries,
+             CONFIG: dict):
+    """
+    Calculates suitability and building scores for one tile and writes the
+    parts belonging to the tile's core to the tile directory.
+
+    Parameters
+    ----------
+    tile_id : int
+        Number of the tile.
+    core : gpd.GeoSeries
+        Core area of the tile in EPSG:25832.
+    halo : gpd.GeoSeries
+        Core area including the halo in EPSG:25832.
+    CONFIG : dict
+        Bikeability configuration.
+
+    Returns
+    -------
+    None.
+
+    """
+    core_polygon = core.iloc[0]
+    core_wgs84 = core.to_crs("EPSG:4326").iloc[0]
+    halo_wgs84 = halo.to_crs("EPSG:4326").iloc[0]
+    model = compile_model(CONFIG)
+
+    # the network and POIs are needed for the whole halo to route correctly
+    edges, network = eval_suitability_cached(CONFIG, polygon=halo_wgs84)
+    # tiles at the border of the region can be slivers without any POIs or
+    # buildings, for which Overpass returns no features
+    try:
+        POIs = scoring.fetch_POIs(CONFIG=CONFIG,
+                                  network=network,
+                                  polygon=halo_wgs84,
+                                  model=model)
+    except InsufficientResponseError:
+        log.info(f"Tile {tile_id} has no POIs.")
+        POIs = empty_layer(POI_COLUMNS)
+
+    # only buildings of the core are scored
+    try:
+        buildings = scoring.fetch_and_filter_residences(city=CONFIG["city"],
+                                                        network=network,
+                                                        polygon=core_wgs84,
+                                                        CONFIG=CONFIG)
+    except InsufficientResponseError:
+        log.info(f"Tile {tile_id} has no buildings.")
+        buildings = empty_layer(BUILDING_COLUMNS)
+    buildings = buildings[buildings.centroid.within(core_polygon)]
+    statistics = aggregates.ScoreStatistics(CONFIG["weight_factors_categories"])
+    # every tile runs in its own process, which writes its own metrics
+    metrics.start(CONFIG)
+    try:
+        buildings_scored = scoring.score_buildings(buildings, POIs, network,
+                                                   edges, CONFIG, statistics,
+                                                   model=model)
+    finally:
+        metrics.stop()
+
+    # an edge belongs to the tile containing its midpoint
+    midpoints = edges.geometry.interpolate(0.5, normalized=True)
+    edges = edges[midpoints.within(core_polygon)]
+    POIs = POIs[POIs.centroid.within(core_polygon)]
+
+    files = tile_files(CONFIG, tile_id)
+    edges.to_pickle(files["edges"])
+    POIs.to_pickle(files["POIs"])
+    pd.to_pickle(statistics, files["statistics"])
+    # buildings are written last, so a tile interrupted while writing
+    # misses them and isn't considered finished
+    buildings_scored.to_pickle(files["buildings"])
+    log.info(f"Tile {tile_id} finished with {len(buildings_scored)} buildings.")
+
+
+def merge_tiles(CONFIG: dict, tile_ids: list) -> tuple:
+    """
+    Merges the results of all tiles, removing objects that were written by
+    more than one tile.
+
+    Parameters
+    ----------
+    CONFIG : dict
+        Bikeability configuration.
+    tile_ids : list
+        Numbers of the tiles to merge.
+
+    Returns
+    -------
+    edges : gpd.GeoDataFrame
+        Scored edges of the whole region.
+    buildings : gpd.GeoDataFrame
+        Scored buildings of the whole region.
+    POIs : gpd.GeoDataFrame
+        POIs of the whole region.
+    statistics : aggregates.ScoreStatistics
+        Aggregate statistics of the building scores of the whole region.
+
+    """
+    layers = {"edges": [], "buildings": [], "POIs": [], "statistics": []}
+    for tile_id in tile_ids:
+        for layer, path in tile_files(CONFIG, tile_id).items():
+            layers[layer].append(pd.read_pickle(path))
+
+    edges = pd.concat(layers["edges"])
+    edges = edges[~edges.index.duplicated()]
+    buildings = pd.concat(layers["buildings"], ignore_index=True)
+    buildings = buildings.drop_duplicates(subset="osmid")
+    POIs = pd.concat(layers["POIs"], ignore_index=True)
+    POIs = POIs.drop_duplicates(subset="osmid")
+
+    edges = gpd.GeoDataFrame(edges, crs="EPSG:25832")
+    buildings = gpd.GeoDataFrame(buildings, crs="EPSG:25832")
+    POIs = gpd.GeoDataFrame(POIs, crs="EPSG:25832")
+
+    statistics = aggregates.ScoreStatistics(CONFIG["weight_factors_categories"])
+    for tile_statistics in layers["statistics"]:
+        statistics.merge(tile_statistics)
+    return edges, buildings, POIs, statistics
+
+
+def eval_tiled(CONFIG: dict, workers: int = 1) -> tuple:
+    """
+    Runs the bikeability calculation for the configured region tile by tile.
+    Each tile runs in its own process, so its memory is released once it is
+    finished. Tiles with existing results for the same configuration are
+    skipped, so an interrupted run can be continued; tiles that failed are
+    reported together once all tiles are finished.
+
+    Parameters
+    ----------
+    CONFIG : dict
+        Bikeability configuration.
+    workers : int, optional
+        Number of tiles processed at the same time. The default is 1.
+
+    Returns
+    -------
+    edges : gpd.GeoDataFrame
+        Scored edges of the whole region.
+    buildings : gpd.GeoDataFrame
+        Scored buildings of the whole region.
+    POIs : gpd.GeoDataFrame
+        POIs of the whole region.
+    statistics : aggregates.ScoreStatistics
+        Aggregate statistics of the building scores of the whole region.
+
+    """
+    os.makedirs(tile_directory(CONFIG), exist_ok=True)
+
+    region = ox.geocode_to_gdf(CONFIG["city"]).to_crs("EPSG:25832").geometry
+    tiles = create_tiles(region, CONFIG["tile_size"], CONFIG["tile_halo"])
+    log.info(f"Split {CONFIG['city']} into {len(tiles)} tiles.")
+
+    pending = [tile_id for tile_id in tiles.index
+               if not tile_finished(CONFIG, tile_id)]
+    log.info(f"{len(tiles) - len(pending)} tiles already finished.")
+
+    with ProcessPoolExecutor(max_workers=workers,
+                             max_tasks_per_child=1) as executor:
+        futures = {}
+        for tile_id in pending:
+            core = tiles.geometry.loc[[tile_id]]
+            halo = gpd.GeoSeries(tiles.halo.loc[[tile_id]], crs="EPSG:25832")
+            futures[tile_id] = executor.submit(run_tile, tile_id, core,
+                                               halo, CONFIG)
+        # every failed tile is reported, not only the first one
+        failures = []
+        for tile_id, future in futures.items():
+            try:
+                future.result()
+            except Exception as error:
+                log.exception(f"Tile {tile_id} failed: {error}")
+                failures.append(str(tile_id))
+    if failures:
+        raise RuntimeError(f"Failed tiles: {', '.join(failures)}")
+
+    return merge_tiles(CONFIG, list(tiles.index))
@@ -0,0 +1,232 @@
+"""
+Export of buildings and suitability edges as vector tile pyramid (MBTiles).
+
+Instead of inlining all geometries in one HTML file, every zoom level is cut
+into tiles holding only the simplified geometries visible in them, so maps of
+whole cities can be served by any MBTiles capable tile server or viewer.
+"""
+import gzip
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import geopandas as gpd
+import numpy as np
+import shapely
+
+try:
+    import mapbox_vector_tile
+except ImportError:
+    mapbox_vector_tile = None
+
+log = logging.getLogger("Bikeability")
+
+# half of the extent of the web mercator projection in metres
+WORLD_HALF = 20037508.342789244
+# resolution of a tile in vector tile coordinates
+TILE_EXTENT = 4096
+
+# attributes written to the tiles for each layer
+LAYER_COLUMNS = {"buildings": ["score", "building"],
+                 "edges": ["suitability_modifier", "score_surface",
+                           "score_separation", "highway"]}
+
+# layers are only contained from this zoom level on
+LAYER_MIN_ZOOM = {"buildings": 13,
+                  "edges": 0}
+
+# tile layers of the worker processes
+_worker_layers = {}
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """
+    Returns the bounds of a tile in EPSG:3857.
+    """
+    size = 2 * WORLD_HALF / 2**z
+    minx = -WORLD_HALF + x * size
+    maxy = WORLD_HALF - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def tiles_in_bounds(bounds: tuple, z: int) -> list:
+    """
+    Lists all tiles of a zoom level intersecting the given bounds in
+    EPSG:3857.
+    """
+    size = 2 * WORLD_HALF / 2**z
+    minx, miny, maxx, maxy = bounds
+    x_range = range(int((minx + WORLD_HALF) // size),
+                    int((maxx + WORLD_HALF) // size) + 1)
+    y_range = range(int((WORLD_HALF - maxy) // size),
+                    int((WORLD_HALF - miny) // size) + 1)
+    return [(z, x, y) for x in x_range for y in y_range]
+
+
+def prepare_layer(layer: gpd.GeoDataFrame, name: str) -> gpd.GeoDataFrame:
+    """
+    Reduces a layer to the tile attributes and reprojects it to EPSG:3857.
+    """
+    layer = layer[~layer.geometry.isna()]
+    layer = layer[LAYER_COLUMNS[name] + ["geometry"]].copy()
+    for column in LAYER_COLUMNS[name]:
+        if layer[column].dtype == object:
+            layer[column] = layer[column].astype(str)
+    return layer.to_crs("EPSG:3857")
+
+
+def _init_worker(layers: dict):
+    global _worker_layers
+    _worker_layers = layers
+    for layer in _worker_layers.values():
+        # build the spatial index once per worker
+        layer.sindex
+
+
+def encode_tile(z: int, x: int, y: int) -> Optional[bytes]:
+    """
+    Encodes one tile from the layers of the worker process. Geometries are
+    clipped to the tile and simplified to its resolution.
+
+    Returns
+    -------
+    tile : bytes or None
+        Gzip compressed vector tile or None if the tile is empty.
+
+    """
+    bounds = tile_bounds(z, x, y)
+    # one unit of the tile grid in metres
+    resolution = (bounds[2] - bounds[0]) / TILE_EXTENT
+    # a small buffer avoids seams between neighbouring tiles
+    buffer = 8 * resolution
+    clip_box = (bounds[0] - buffer, bounds[1] - buffer,
+                bounds[2] + buffer, bounds[3] + buffer)
+
+    tile_layers = []
+    for name, layer in _worker_layers.items():
+        if z < LAYER_MIN_ZOOM[name]:
+            continue
+        positions = layer.sindex.query(shapely.box(*clip_box))
+        if len(positions) == 0:
+            continue
+        features = layer.iloc[positions]
+        geometries = shapely.clip_by_rect(features.geometry.to_numpy(),
+                                          *clip_box)
+        geometries = shapely.simplify(geometries, resolution)
+        keep = ~shapely.is_empty(geometries)
+        properties = features[LAYER_COLUMNS[name]].to_dict("records")
+        tile_layers.append({
+            "name": name,
+            "features": [{"geometry": geometry, "properties": props}
+                         for geometry, props, kept
+                         in zip(geometries, properties, keep) if kept]})
+
+    if not any(layer["features"] for layer in tile_layers):
+        return None
+    tile = mapbox_vector_tile.encode(
+        tile_layers,
+        default_options={"quantize_bounds": bounds,
+                         "extents": TILE_EXTENT,
+                         "y_coord_down": False})
+    return gzip.compress(tile)
+
+
+def encode_tiles(tiles: list) -> list:
+    """
+    Encodes a batch of tiles, returning (z, x, y, data) for non-empty tiles.
+    """
+    encoded = []
+    for z, x, y in tiles:
+        data = encode_tile(z, x, y)
+        if data is not None:
+            encoded.append((z, x, y, data))
+    return encoded
+
+
+def create_mbtiles(path: str, metadata: dict) -> sqlite3.Connection:
+    """
+    Creates an empty MBTiles file with the given metadata.
+    """
+    if os.path.isfile(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
+    connection.execute("CREATE TABLE tiles (zoom_level INTEGER, "
+                       "tile_column INTEGER, tile_row INTEGER, "
+                       "tile_data BLOB)")
+    connection.execute("CREATE UNIQUE INDEX tile_index ON tiles "
+                       "(zoom_level, tile_column, tile_row)")
+    connection.executemany("INSERT INTO metadata VALUES (?, ?)",
+                           metadata.items())
+    return connection
+
+
+def export_vector_tiles(buildings: gpd.GeoDataFrame,
+                        edges: gpd.GeoDataFrame,
+                        CONFIG: dict):
+    """
+    Writes buildings with scores and scored edges as MBTiles file with one
+    level of tiles for each configured zoom level.
+
+    Parameters
+    ----------
+    buildings : gpd.GeoDataFrame
+        Dataframe containing a list of buildings with scores.
+    edges : gpd.GeoDataFrame
+        Scored edges of the suitability network.
+    CONFIG : dict
+        Bikeability configuration.
+
+    Returns
+    -------
+    None.
+
+    """
+    if mapbox_vector_tile is None:
+        raise ImportError("The vector tile export requires the package "
+                          "mapbox-vector-tile.")
+
+    min_zoom, max_zoom = CONFIG["vector_tile_zooms"]
+    layers = {"buildings": prepare_layer(buildings, "buildings"),
+              "edges": prepare_layer(edges, "edges")}
+    layer_bounds = np.array([layer.total_bounds for layer in layers.values()])
+    bounds = (*np.nanmin(layer_bounds[:, :2], axis=0),
+              *np.nanmax(layer_bounds[:, 2:], axis=0))
+    bounds_wgs84 = gpd.GeoSeries([shapely.box(*bounds)], crs="EPSG:3857") \
+        .to_crs("EPSG:4326").total_bounds
+
+    vector_layers = [{"id": name,
+                      "fields": {column: "String" if layer[column].dtype == object
+                                 else "Number"
+                                 for column in LAYER_COLUMNS[name]},
+                      "minzoom": max(min_zoom, LAYER_MIN_ZOOM[name]),
+                      "maxzoom": max_zoom}
+                     for name, layer in layers.items()]
+    metadata = {"name": "bikeability",
+                "format": "pbf",
+                "minzoom": str(min_zoom),
+                "maxzoom": str(max_zoom),
+                "bounds": ",".join(str(value) for value in bounds_wgs84),
+                "json": json.dumps({"vector_layers": vector_layers})}
+
+    path = f"{CONFIG['export_path']}/bikeability.mbtiles"
+    connection = create_mbtiles(path, metadata)
+
+    with ProcessPoolExecutor(max_workers=CONFIG["vector_tile_workers"],
+                             initializer=_init_worker,
+                             initargs=(layers,)) as executor:
+        for z in range(min_zoom, max_zoom + 1):
+            tiles = tiles_in_bounds(bounds, z)
+            batches = [tiles[i:i + 64] for i in range(0, len(tiles), 64)]
+            for encoded in executor.map(encode_tiles, batches):
+                # MBTiles counts tile rows from the bottom (TMS scheme)
+                connection.executemany(
+                    "INSERT INTO tiles VALUES (?, ?, ?, ?)",
+                    [(zoom, x, 2**zoom - 1 - y, data)
+                     for zoom, x, y, data in encoded])
+            connection.commit()
+            log.info(f"Wrote {len(tiles)} vector tiles for zoom level {z}.")
+    connection.close()
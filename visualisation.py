@@ -1,12 +1,64 @@
+import numpy as np
 import pandas as pd
 import geopandas as gpd
+import shapely
 import folium
-from bikeability_config import USE_ACCIDENTS, EXPORT_PATH
+from bikeability_config import VIS_LOD, VIS_ZOOM, VIS_PRECISION, VIS_POLYGON_TOLERANCE
 
-def create_suitability_visualisation(edges: pd.DataFrame):
+def map_tolerance(zoom: int, latitude: float = 51) -> float:
+    """
+    Returns the size of one screen pixel in metres at the given zoom level,
+    which is used as tolerance for simplifying geometries.
+    """
+    return 156543.03 * np.cos(np.radians(latitude)) / 2**zoom
+
+def reduce_for_map(layer: gpd.GeoDataFrame, columns: list,
+                   tolerance: float = None) -> gpd.GeoDataFrame:
+    """
+    Reduces a layer in EPSG:25832 to the displayed columns, simplifies its
+    geometries by the tolerance in metres, by default the resolution of
+    VIS_ZOOM, and rounds the coordinates to VIS_PRECISION decimals in
+    EPSG:4326.
+    """
+    if tolerance is None:
+        tolerance = map_tolerance(VIS_ZOOM)
+    layer = gpd.GeoDataFrame(layer[columns + ["geometry"]], crs="EPSG:25832")
+    layer["geometry"] = layer.simplify(tolerance)
+    layer = layer.to_crs("EPSG:4326")
+    layer["geometry"] = shapely.set_precision(layer.geometry.to_numpy(),
+                                              10**-VIS_PRECISION,
+                                              mode="pointwise")
+    return layer[~layer.is_empty]
+
+def merge_by_class(edges: gpd.GeoDataFrame, column: str, class_width: float) -> gpd.GeoDataFrame:
+    """
+    Merges adjacent edges whose values of the given column fall into the same
+    class into continuous lines.
+    """
+    edges = gpd.GeoDataFrame(edges[[column, "geometry"]], crs="EPSG:25832")
+    edges[column] = (edges[column] / class_width).round() * class_width
+    merged = edges.dissolve(by=column, as_index=False)
+    merged["geometry"] = shapely.line_merge(merged.geometry.to_numpy())
+    return merged.explode(index_parts=False)
+
+def edge_map_layer(edges: gpd.GeoDataFrame, column: str, class_width: float) -> gpd.GeoDataFrame:
+    """
+    Returns the edges to display for one map, merged by class and reduced to
+    the map's level of detail if VIS_LOD is enabled.
+    """
+    if not VIS_LOD:
+        return edges
+    return reduce_for_map(merge_by_class(edges, column, class_width), [column])
+
+def create_suitability_visualisation(edges: pd.DataFrame, export_path: str):
     edges_for_vis = gpd.GeoDataFrame(edges, crs="EPSG:25832")
     edges_for_vis = edges_for_vis[~edges_for_vis.geometry.isna()]
-    edges_for_vis = edges_for_vis[['osmid', 'name', 'suitability_modifier', 'score_surface', 'score_separation', "accident_count", 'highway', 'geometry']]
+    # accidents are only matched to the edges if enabled in the configuration
+    use_accidents = "accident_count" in edges_for_vis.columns
+    columns = ['osmid', 'name', 'suitability_modifier', 'score_surface', 'score_separation', 'highway', 'geometry']
+    if use_accidents:
+        columns.insert(5, "accident_count")
+    edges_for_vis = edges_for_vis[columns]
     style_kwds = {"weight": 3}
 
     edges_for_vis.rename(columns={'osmid': "OSM ID",
@@ -19,71 +71,80 @@ def create_suitability_visualisation(edges: pd.DataFrame):
                          inplace = True)
 
     scores_surface = folium.Map(tiles = "CartoDB positron")
-    scores_surface = edges_for_vis.explore(column = "Wertung Oberflächenqualität", 
+    surface_edges = edge_map_layer(edges_for_vis, "Wertung Oberflächenqualität", 1)
+    scores_surface = surface_edges.explore(column = "Wertung Oberflächenqualität", 
                                             cmap = "viridis", 
                                             vmin = 1, 
                                             vmax = 5,
                                             style_kwds = style_kwds,
                                             m = scores_surface)
-    scores_surface.save(f"{EXPORT_PATH}/surface.html")
+    scores_surface.save(f"{export_path}/surface.html")
     
     
     scores_separation = folium.Map(tiles = "CartoDB positron")
-    scores_separation = edges_for_vis.explore(column = "Wertung Trennung", 
+    separation_edges = edge_map_layer(edges_for_vis, "Wertung Trennung", 1)
+    scores_separation = separation_edges.explore(column = "Wertung Trennung", 
                                               cmap = "viridis", 
                                               vmin = 1, 
                                               vmax = 5,
                                               style_kwds = style_kwds,
                                               m = scores_separation)
-    scores_separation.save(f"{EXPORT_PATH}/separation.html")
+    scores_separation.save(f"{export_path}/separation.html")
     
     
     
     suitability_score = folium.Map(tiles = "CartoDB positron")
-    suitability_score = edges_for_vis.explore(column = "Tauglichkeits-Modifikator",
+    suitability_edges = edge_map_layer(edges_for_vis, "Tauglichkeits-Modifikator", 0.05)
+    suitability_score = suitability_edges.explore(column = "Tauglichkeits-Modifikator",
                                       cmap = "viridis",
                                       vmin = 0, 
                                       vmax = 1,
                                       style_kwds = style_kwds,
                                       m = suitability_score)
-    suitability_score.save(f"{EXPORT_PATH}/suitability.html")
+    suitability_score.save(f"{export_path}/suitability.html")
 
-    if USE_ACCIDENTS:
-        accident_count = edges_for_vis.explore(column = "Anzahl Unfälle (3 Jahre)",
+    if use_accidents:
+        accident_edges = edge_map_layer(edges_for_vis, "Anzahl Unfälle (3 Jahre)", 1)
+        accident_count = accident_edges.explore(column = "Anzahl Unfälle (3 Jahre)",
                                           cmap = "viridis",
                                           vmin = 0,
                                           vmax = 10)
-        accident_count.save(f"{EXPORT_PATH}/accidents.html")
+        accident_count.save(f"{export_path}/accidents.html")
     
         # score_accident = edges_for_vis.explore(column = "score_accident",
         #                                   cmap = "viridis",
         #                                   vmin = 0, 
         #                                   vmax = 5)
-        # score_accident.save(f"{EXPORT_PATH}/accidents_score.html")
+        # score_accident.save(f"{export_path}/accidents_score.html")
 
-def create_building_visualisation(buildings:gpd.GeoDataFrame):
-    buildings_for_vis = buildings[["id", "node", "building", "score", "geometry", "centroid"]]
-    buildings_for_vis.rename(columns = {"id": "OSM ID",
+def create_building_visualisation(buildings:gpd.GeoDataFrame, export_path: str):
+    buildings_for_vis = buildings[["osmid", "node", "building", "score", "geometry"]]
+    buildings_for_vis = buildings_for_vis.rename(columns = {"osmid": "OSM ID",
                                         "node": "Zugehöriger Knoten",
                                         "building": "Gebäudetyp",
-                                        "score": "Score"},
-                             inplace = True)
+                                        "score": "Score"})
+    if VIS_LOD:
+        # a pixel of VIS_ZOOM would collapse small buildings
+        buildings_for_vis = reduce_for_map(buildings_for_vis, ["Gebäudetyp", "Score"],
+                                           VIS_POLYGON_TOLERANCE)
     buildings_vis = folium.Map(tiles = "CartoDB positron")
     buildings_vis = buildings_for_vis.explore(column = "Score",
                                       cmap = "viridis",
                                       vmin = 0, 
                                       vmax = 1,
                                       m = buildings_vis)
-    buildings_vis.save(f"{EXPORT_PATH}/buildings.html")
+    buildings_vis.save(f"{export_path}/buildings.html")
     
-def create_POI_visualisation(POIs: gpd.GeoDataFrame):
-    POIs_for_vis = POIs[["name", "id", "geometry", "node", "POI_category"]]
-    POIs_for_vis.rename(columns = {"id": "OSM ID",
+def create_POI_visualisation(POIs: gpd.GeoDataFrame, export_path: str):
+    POIs_for_vis = POIs[["name", "osmid", "geometry", "node", "POI_category"]]
+    POIs_for_vis = POIs_for_vis.rename(columns = {"osmid": "OSM ID",
                                    "name": "Name",
                                    "node": "Zugehöriger Knoten",
-                                   "POI_category": "Kategorie"},
-                        inplace = True)
+                                   "POI_category": "Kategorie"})
     POIs_for_vis = POIs_for_vis[POIs_for_vis.Kategorie != "none"]
+    if VIS_LOD:
+        POIs_for_vis = reduce_for_map(POIs_for_vis, ["Name", "Kategorie"],
+                                      VIS_POLYGON_TOLERANCE)
     POIs_vis = folium.Map(tiles = "CartoDB positron")
-    POIs_vis = POIs.explore(column = "POI_category", m = POIs_vis)
-    POIs_vis.save(f"{EXPORT_PATH}/POIs.html")
\ No newline at end of file
+    POIs_vis = POIs_for_vis.explore(column = "Kategorie", m = POIs_vis)
+    POIs_vis.save(f"{export_path}/POIs.html")
\ No newline at end of file
@@ -1,31 +1,99 @@
 import geopandas as gpd
 import numpy as np
 import plotly.express as px
-import shapely.geometry
-
-
-def plot_road_scores(scoring: gpd.GeoDataFrame()):
-    lats = []
-    lons = []
-    names = []
-    
-    for feature, name in zip(scoring.geometry, scoring.name):
-        if isinstance(feature, shapely.geometry.linestring.LineString):
-            linestrings = [feature]
-        elif isinstance(feature, shapely.geometry.multilinestring.MultiLineString):
-            linestrings = feature.geoms
-        else:
+import plotly.graph_objects as go
+import shapely
+from plotly.express.colors import sample_colorscale
+
+
+def flatten_lines(geometries: np.ndarray, names: np.ndarray) -> tuple:
+    """
+    Extracts the coordinates of all LineStrings and MultiLineStrings at once
+    and separates the single lines with NaN (coordinates) and None (names),
+    as expected by plotly. Other geometry types are skipped.
+
+    Returns
+    -------
+    lats : np.ndarray
+        Latitudes of all lines.
+    lons : np.ndarray
+        Longitudes of all lines.
+    names : np.ndarray
+        Name of the feature each coordinate belongs to.
+
+    """
+    # 1: LineString, 5: MultiLineString
+    is_line = np.isin(shapely.get_type_id(geometries), [1, 5])
+    parts, part_index = shapely.get_parts(geometries[is_line],
+                                          return_index=True)
+    coords, coord_index = shapely.get_coordinates(parts, return_index=True)
+
+    # a separator is inserted after the last coordinate of every line
+    counts = np.bincount(coord_index, minlength=len(parts))
+    line_ends = np.cumsum(counts)
+
+    lons = np.insert(coords[:, 0], line_ends, np.nan)
+    lats = np.insert(coords[:, 1], line_ends, np.nan)
+    names = np.insert(names[is_line][part_index][coord_index].astype(object),
+                      line_ends, None)
+    return lats, lons, names
+
+
+def plot_road_scores(scoring: gpd.GeoDataFrame(),
+                     color_col: str = None,
+                     classes: int = 10,
+                     colorscale: str = "Viridis"):
+    """
+    Plots the ways of a scoring dataframe (EPSG:4326) on a map.
+
+    Parameters
+    ----------
+    scoring : gpd.GeoDataFrame
+        Ways with their names and, optionally, scores.
+    color_col : str, optional
+        Score column the lines are coloured by. All lines have the same
+        colour if none is given.
+    classes : int, optional
+        Number of colour classes between minimum and maximum score.
+    colorscale : str, optional
+        Plotly colorscale used for the score classes.
+
+    Returns
+    -------
+    fig : plotly.graph_objects.Figure
+        The map.
+
+    """
+    geometries = scoring.geometry.to_numpy()
+    names = scoring.name.to_numpy()
+
+    if color_col is None:
+        lats, lons, names = flatten_lines(geometries, names)
+        fig = px.line_geo(lat=lats, lon=lons, hover_name=names)
+        fig.show()
+        return fig
+
+    # one trace per score class, coloured along the colorscale
+    values = scoring[color_col].to_numpy(dtype=float)
+    edges = np.linspace(np.nanmin(values), np.nanmax(values), classes + 1)
+    bins = np.clip(np.digitize(values, edges[1:-1]), 0, classes - 1)
+    # ways without score aren't plotted
+    bins[np.isnan(values)] = -1
+    colors = sample_colorscale(colorscale, np.linspace(0, 1, classes))
+
+    fig = go.Figure()
+    for i in range(classes):
+        in_class = bins == i
+        if not in_class.any():
             continue
-        
-        for linestring in linestrings:
-            x, y = linestring.xy
-            lats = np.append(lats, y)
-            lons = np.append(lons, x)
-            names = np.append(names, [name]*len(y))
-            lats = np.append(lats, None)
-            lons = np.append(lons, None)
-            names = np.append(names, None)
-            
-    fig = px.line_geo(lat=lats, lon=lons, hover_name=names)
+        lats, lons, class_names = flatten_lines(geometries[in_class],
+                                                names[in_class])
+        fig.add_trace(go.Scattergeo(
+            lat=lats,
+            lon=lons,
+            mode="lines",
+            line={"color": colors[i]},
+            hovertext=class_names,
+            name=f"{edges[i]:.2f} - {edges[i + 1]:.2f}"))
     fig.show()
-    return fig
\ No newline at end of file
+    return fig
@@ -1,8 +1,11 @@
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 from plotly.express.colors import sample_colorscale
 import pandas as pd
 import geopandas as gpd
-from shapely import wkt, Polygon
+import shapely
+from shapely import Polygon
 from shapely.ops import transform
 import pydeck as pdk
 
@@ -65,6 +68,27 @@ def get_color_dict(
     return dict(zip(values, colorscale))
 
 
+def get_color_palette(
+        min_value: float,
+        max_value: float,
+        colorscale: str,
+        color_dict: dict | None = None) -> np.ndarray:
+    """
+    Creates an array of [r, g, b] colors, one for each step of 0.01
+    between min_value and max_value.
+    """
+
+    if not color_dict:
+        color_dict = get_color_dict(
+        min_value=min_value,
+        max_value=max_value,
+        colorscale=colorscale)
+
+    colors = [color_dict[value] for value in sorted(color_dict)]
+
+    return np.array(colors, dtype=np.uint8)
+
+
 def add_color_to_data(
         data: pd.DataFrame,
         min_value: float,
@@ -73,7 +97,7 @@ def add_color_to_data(
         colorscale: str = "Viridis",
         color_dict: dict | None = None) -> pd.DataFrame:
     """
-    Adds color column to given data.
+    Adds color columns "r", "g" and "b" to given data.
 
     Parameters:
     -------------
@@ -98,19 +122,21 @@ def add_color_to_data(
         parameter.
     """
 
-    if not color_dict:
-        color_dict = get_color_dict(
+    palette = get_color_palette(
         min_value=min_value,
         max_value=max_value,
-        colorscale=colorscale)
-
-    data["adjusted_value"] = data[value_col].copy()
-    data.loc[data["adjusted_value"] > max_value, "adjusted_value"] = max_value
-    data.loc[data["adjusted_value"] < min_value, "adjusted_value"] = min_value
+        colorscale=colorscale,
+        color_dict=color_dict)
 
-    data["color"] = data["adjusted_value"].round(2).map(color_dict)
+    # index of the 0.01 step of each value within the palette
+    values = np.clip(data[value_col].to_numpy(dtype=float), min_value, max_value)
+    bins = np.rint((values - min_value) / 0.01).astype(np.int64)
+    bins = np.clip(bins, 0, len(palette) - 1)
 
-    data.drop(columns="adjusted_value", inplace=True)
+    colors = palette[bins]
+    data["r"] = colors[:, 0]
+    data["g"] = colors[:, 1]
+    data["b"] = colors[:, 2]
 
     return data
 
@@ -163,7 +189,7 @@ def create_poylgon_pydeck(
         data=data,
         pickable=True,
         filled=True,
-        get_fill_color="color",
+        get_fill_color="[r, g, b]",
         get_line_color=[255, 255, 255],
         get_polygon="geom")
 
@@ -259,49 +285,67 @@ def vis_polygon():
         vmax = 1)
     vis.save("test.html")
 
-def conv_to_list(geom):
+def polygons_to_lists(geometries: gpd.GeoSeries) -> list:
+    """
+    Converts the exterior rings of polygons to nested coordinate lists as used
+    by pydeck. All coordinates are extracted at once and rounded to about
+    10 cm to keep the exported maps small.
+    """
+
+    rings = shapely.get_exterior_ring(geometries.to_numpy())
+    coords, index = shapely.get_coordinates(rings, return_index=True)
+    coords = np.round(coords, decimals=6)
 
-    xx, yy = geom.exterior.coords.xy
+    counts = np.bincount(index, minlength=len(rings))
+    rings = np.split(coords, np.cumsum(counts)[:-1])
 
-    return [[[x, y] for x, y in zip(xx.tolist(), yy.tolist())]]
+    return [[ring.tolist()] for ring in rings]
 
 
 def read_prepare_data(filepath):
 
-    gdf = pd.read_csv(filepath)
-    
-    gdf['geometry'] = gdf['geometry'].apply(wkt.loads)
-    gdf = gpd.GeoDataFrame(gdf, crs='epsg:25832')
+    gdf = gpd.read_parquet(filepath)
     gdf.to_crs("wgs84", inplace=True)
 
-    gdf["geom"] = gdf["geometry"].apply(conv_to_list)
+    gdf["geom"] = polygons_to_lists(gdf.geometry)
 
     return gdf
 
 
-if __name__ == "__main__":
+def create_city_map(city: str, percentage: str):
+    """
+    Creates the building map of one city from its score file.
+    """
+    filepath = f"../input/{city}/data/{percentage}percent.parquet"
 
-    cities = ["Aachen", "Dortmund", "Dresden", "Leipzig", "Mannheim", "Münster", "München", "Utrecht"] # enter the paths to the files with the scores here
-    #cities = ["Aachen"]
-    percentages = ["100"]
+    gdf = read_prepare_data(filepath)
+
+    gdf = add_color_to_data(
+        data=gdf,
+        min_value=gdf["score"].min(),
+        max_value=gdf["score"].max(),
+        value_col="score")
 
-    for city in cities:
-        for percentage in percentages:
-            filepath = f"../input/{city}/data/{percentage}percent.csv"
+    # only the columns used by the map are exported
+    deck = create_poylgon_pydeck(
+        city = city,
+        data=pd.DataFrame(gdf[["geom", "r", "g", "b", "score"]]),
+        tooltip={"text": "Score: {score}"})
 
-            gdf = read_prepare_data(filepath)
+    filename = f"../input/{city}/Maps/{percentage}percent" # enter the filename here (without .html)
+    deck.to_html(filename + ".html")
 
-            gdf = add_color_to_data(
-                data=gdf,
-                min_value=gdf["score"].min(),
-                max_value=gdf["score"].max(),
-                value_col="score")
 
-            deck = create_poylgon_pydeck(
-                city = city,
-                data=gdf,
-                tooltip={"text": "Score: {score}"})
+if __name__ == "__main__":
 
-            filename = f"../input/{city}/Maps/{percentage}percent" # enter the filename here (without .html)
-            deck.to_html(filename + ".html")
+    cities = ["Aachen", "Dortmund", "Dresden", "Leipzig", "Mannheim", "Münster", "München", "Utrecht"] # enter the paths to the files with the scores here
+    #cities = ["Aachen"]
+    percentages = ["100"]
 
+    # the maps of all cities are created in parallel
+    with ProcessPoolExecutor() as executor:
+        futures = [executor.submit(create_city_map, city, percentage)
+                   for city in cities
+                   for percentage in percentages]
+        for future in futures:
+            future.result()
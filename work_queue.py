@@ -0,0 +1,185 @@
+"""
+Work queue of distributed building scoring in a shared directory.
+
+The queue keeps the state of the chunks of every job in a SQLite database,
+a local stand-in for a message broker, next to the files of the chunks and
+their results. Claims expire after "QUEUE_LEASE" seconds, so chunks of
+crashed workers are claimed again or, after the last attempt, fail; failed chunks are retried up to
+"QUEUE_MAX_ATTEMPTS" times. SQLite locking is unreliable on some network
+file systems, so the directory should be on a file system with working file
+locks. The coordinator and the workers are in `distributed`.
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger("Bikeability")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job TEXT PRIMARY KEY,
+    chunks INTEGER,
+    created REAL);
+CREATE TABLE IF NOT EXISTS chunks (
+    job TEXT,
+    chunk INTEGER,
+    status TEXT DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    worker TEXT,
+    claimed REAL,
+    error TEXT,
+    PRIMARY KEY (job, chunk));
+"""
+
+
+def write_pickle(path: str, content):
+    # written under a temporary name, so no partial files are read
+    with open(f"{path}.tmp{os.getpid()}", "wb") as file:
+        pickle.dump(content, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.tmp{os.getpid()}", path)
+
+
+class WorkQueue():
+    """
+    Chunks of scoring jobs and their state in a SQLite database.
+
+    Parameters
+    ----------
+    CONFIG : dict
+        Bikeability configuration.
+
+    """
+    def __init__(self, CONFIG: dict):
+        self.path = CONFIG["queue_path"]
+        self.lease = CONFIG["queue_lease"]
+        self.max_attempts = CONFIG["queue_max_attempts"]
+        os.makedirs(self.path, exist_ok=True)
+        connection = sqlite3.connect(f"{self.path}/queue.sqlite", timeout=60)
+        connection.executescript(SCHEMA)
+        connection.close()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Yields a connection in a transaction that locks the database for
+        other writers, so a chunk can't be claimed twice.
+        """
+        connection = sqlite3.connect(f"{self.path}/queue.sqlite", timeout=60,
+                                     isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def job_path(self, job: str) -> str:
+        return f"{self.path}/{job}"
+
+    def chunk_file(self, job: str, chunk: int) -> str:
+        return f"{self.path}/{job}/chunk_{chunk}.pkl"
+
+    def result_file(self, job: str, chunk: int) -> str:
+        return f"{self.path}/{job}/result_{chunk}.pkl"
+
+    def has_job(self, job: str) -> bool:
+        with self.transaction() as connection:
+            return connection.execute("SELECT 1 FROM jobs WHERE job = ?",
+                                      (job,)).fetchone() is not None
+
+    def publish(self, job: str, chunks: int):
+        """
+        Adds the chunks of a job, whose files must already be written.
+        """
+        with self.transaction() as connection:
+            connection.execute("INSERT INTO jobs VALUES (?, ?, ?)",
+                               (job, chunks, time.time()))
+            connection.executemany("INSERT INTO chunks (job, chunk) VALUES (?, ?)",
+                                   [(job, chunk) for chunk in range(chunks)])
+
+    def expire(self, connection=None):
+        """
+        Returns chunks whose claim expired to the queue or, after the last
+        attempt, marks them as failed. Called by the coordinator as well, so
+        the chunks of crashed workers fail when no worker is left to claim.
+        """
+        if connection is None:
+            with self.transaction() as connection:
+                return self.expire(connection)
+        connection.execute(
+            "UPDATE chunks SET status = CASE WHEN attempts >= ? "
+            "THEN 'failed' ELSE 'pending' END, error = CASE WHEN attempts >= ? "
+            "THEN 'claim expired after the last attempt' ELSE error END "
+            "WHERE status = 'claimed' AND claimed < ?",
+            (self.max_attempts, self.max_attempts, time.time() - self.lease))
+
+    def claim(self, worker: str) -> tuple:
+        """
+        Claims the next pending chunk, after returning chunks whose claim
+        expired to the queue.
+
+        Returns
+        -------
+        claimed : tuple
+            Job and chunk, or None if there is nothing to do.
+
+        """
+        with self.transaction() as connection:
+            self.expire(connection)
+            claimed = connection.execute(
+                "SELECT job, chunk FROM chunks WHERE status = 'pending' "
+                "ORDER BY rowid LIMIT 1").fetchone()
+            if claimed is not None:
+                connection.execute(
+                    "UPDATE chunks SET status = 'claimed', worker = ?, claimed = ?, "
+                    "attempts = attempts + 1 WHERE job = ? AND chunk = ?",
+                    (worker, time.time(), *claimed))
+        return claimed
+
+    def complete(self, job: str, chunk: int):
+        with self.transaction() as connection:
+            connection.execute("UPDATE chunks SET status = 'done', error = NULL "
+                               "WHERE job = ? AND chunk = ?", (job, chunk))
+
+    def fail(self, job: str, chunk: int, worker: str, error: str):
+        """
+        Returns a failed chunk to the queue or, after the last attempt,
+        marks it as failed.
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE chunks SET status = CASE WHEN attempts >= ? "
+                "THEN 'failed' ELSE 'pending' END, error = ? "
+                "WHERE job = ? AND chunk = ? AND status = 'claimed' AND worker = ?",
+                (self.max_attempts, error, job, chunk, worker))
+
+    def retry_failed(self, job: str):
+        """
+        Returns the failed chunks of a job to the queue with new attempts.
+        """
+        with self.transaction() as connection:
+            connection.execute("UPDATE chunks SET status = 'pending', attempts = 0 "
+                               "WHERE job = ? AND status = 'failed'", (job,))
+
+    def status(self, job: str = None) -> dict:
+        """
+        Returns the number of chunks by status, of one job or all jobs.
+        """
+        with self.transaction() as connection:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) FROM chunks "
+                "WHERE job = COALESCE(?, job) GROUP BY status", (job,)).fetchall()
+        return {"pending": 0, "claimed": 0, "done": 0, "failed": 0, **dict(rows)}
+
+    def errors(self, job: str) -> list:
+        with self.transaction() as connection:
+            return connection.execute(
+                "SELECT chunk, error FROM chunks WHERE job = ? AND status = 'failed'",
+                (job,)).fetchall()